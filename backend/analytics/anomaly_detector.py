@@ -1,15 +1,70 @@
 # backend/analytics/anomaly_detector.py
-from typing import Dict, Any
+"""
+Statistical anomaly detection over per-day KPI series.
 
+Every (workflow, dimension, key) in KpiDailyRollup is one daily series (the workflow total,
+each product, each customer). All series of a merchant are loaded in one query and laid out
+as a days x series matrix, so each detector below is a handful of NumPy operations over
+the whole matrix instead of one query or one Python loop per series:
 
-def detect_anomalies(kpis: Dict[str, Any]) -> Dict[str, Any]:
+  rolling   : z-score against the mean / std of the previous ROLLING_WINDOW days
+  ewma      : EWMA control chart (exponentially weighted mean and std, span EWMA_SPAN)
+  weekday   : z-score against the same weekday over the previous WEEKDAY_WEEKS weeks
+
+Each detector only looks at history before the day it scores. A day is reported when at
+least MIN_DETECTORS of them exceed Z_THRESHOLD in the metric's bad direction; anomalies
+are ranked by their strongest z-score.
+"""
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+from sqlalchemy import String, type_coerce
+from sqlmodel import Session, select, func
+
+from models.rollup_model import KpiDailyRollup, ROLLUP_TOTAL
+from services.kpi_rollups import ensure_rollup_table, ensure_workflow_rollups
+
+ROLLING_WINDOW = 28
+EWMA_SPAN = 14
+WEEKDAY_WEEKS = 6
+MIN_HISTORY = 7 # observations a detector needs before it scores a day
+Z_THRESHOLD = 3.0
+MIN_DETECTORS = 2
+MIN_DAILY_ORDERS = 5 # rates of days with fewer orders are too noisy to score
+HISTORY_DAYS = 120 # days loaded as baseline
+RECENT_DAYS = 7 # only the last days are reported
+
+# metric -> (numerator column or None for the raw count, direction that counts as bad, std floor)
+METRICS = {
+    "otif_rate": ("otif_count", "drop", 0.02),
+    "on_time_rate": ("on_time_count", "drop", 0.02),
+    "in_full_rate": ("in_full_count", "drop", 0.02),
+    "order_count": (None, "both", 1.0),
+}
+SEVERITIES = ((6.0, "high"), (4.5, "medium"), (0.0, "low"))
+DETECTORS = ("rolling", "ewma", "weekday")
+
+
+def detect_anomalies(kpis: Dict[str, Any], series_anomalies: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     """
-    Placeholder for simple anomaly detection logic.
-    In the final project, this would compare current KPIs against historical data.
+    Headline anomaly for the insights view: the top-ranked series anomaly when there is one
+    (see find_kpi_anomalies), otherwise the all-time OTIF target check.
     """
-    
+    if series_anomalies:
+        top = series_anomalies[0]
+        scope = "overall" if top["dimension"] == ROLLUP_TOTAL else f"{top['dimension']} {top['key']}"
+        return {
+            "flagged": True,
+            "type": f"{top['metric'].upper()}_{top['direction'].upper()}",
+            "message": (f"{top['metric']} for {scope} was {top['value']:.3g} on {top['day']}, against an "
+                        f"expected {top['expected']:.3g} (z = {top['z_score']:.1f}, {top['severity']} severity)."),
+            "data_point": top["value"],
+            "anomalies": series_anomalies,
+        }
+
     otif = kpis['delivery_performance']['otif_rate']
-    
+
     # Simple Mock Anomaly Rule: If OTIF is under 0.90, flag it.
     if otif < 0.90:
         return {
@@ -18,9 +73,206 @@ def detect_anomalies(kpis: Dict[str, Any]) -> Dict[str, Any]:
             "message": f"The overall OTIF Rate is currently {otif*100:.1f}%, which is below the target threshold of 90%.",
             "data_point": otif
         }
-    
+
     return {
         "flagged": False,
         "type": "NORMAL",
         "message": "All key performance indicators are currently within historical norms."
-    }
\ No newline at end of file
+    }
+
+
+def load_kpi_series(session: Session, workflow_ids: Sequence[int], end_date: Optional[date] = None,
+                    history_days: int = HISTORY_DAYS) -> pd.DataFrame:
+    """
+    Day rollups of the workflows for the history_days up to end_date (default: the latest
+    day with data), as one long frame (one row per series and day).
+    """
+    workflow_ids = list(workflow_ids)
+    columns = ["workflow_id", "dimension", "dim_key", "day", "order_count",
+               "on_time_count", "in_full_count", "otif_count"]
+    if not workflow_ids:
+        return pd.DataFrame(columns=columns)
+    if end_date is None:
+        end_date = session.exec(select(func.max(KpiDailyRollup.day)).where(
+            KpiDailyRollup.workflow_id.in_(workflow_ids), KpiDailyRollup.dimension == ROLLUP_TOTAL
+        )).one()
+        if end_date is None:
+            return pd.DataFrame(columns=columns)
+        end_date = date.fromisoformat(end_date) if isinstance(end_date, str) else end_date
+
+    # Core rows, and the day column left as the driver returns it (parsed once, vectorized, below)
+    selected = [type_coerce(KpiDailyRollup.day, String) if column == "day" else getattr(KpiDailyRollup, column)
+                for column in columns]
+    stmt = select(*selected).where(
+        KpiDailyRollup.workflow_id.in_(workflow_ids),
+        KpiDailyRollup.day > end_date - timedelta(days=history_days),
+        KpiDailyRollup.day <= end_date,
+    )
+    frame = pd.DataFrame.from_records(session.connection().execute(stmt).fetchall(), columns=columns)
+    frame["day"] = pd.to_datetime(frame["day"])
+    return frame
+
+
+def _series_matrix(frame: pd.DataFrame, column: str, days: pd.DatetimeIndex, series_codes, n_series: int) -> np.ndarray:
+    matrix = np.full((len(days), n_series), np.nan)
+    matrix[days.get_indexer(frame["day"]), series_codes] = frame[column].to_numpy(dtype=float)
+    return matrix
+
+
+def _trailing_stats(values: np.ndarray, window: int, min_periods: int):
+    """Mean / sample std of the previous `window` rows (NaNs skipped), per column; NaN below min_periods."""
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.vstack([zeros, np.cumsum(filled, axis=0)])
+    squares = np.vstack([zeros, np.cumsum(filled * filled, axis=0)])
+    counts = np.vstack([zeros, np.cumsum(valid, axis=0)])
+
+    rows = np.arange(values.shape[0])
+    start = np.maximum(rows - window, 0)
+    n = counts[rows] - counts[start]
+    total = sums[rows] - sums[start]
+    total_sq = squares[rows] - squares[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+        variance = np.maximum(total_sq - total * mean, 0.0) / (n - 1)
+    enough = n >= min_periods
+    return np.where(enough, mean, np.nan), np.where(enough, np.sqrt(variance), np.nan)
+
+
+def _ewma_stats(values: np.ndarray, span: int, min_periods: int):
+    """EWMA mean / std of the rows before each row, per column (one vectorized step per day)."""
+    alpha = 2.0 / (span + 1)
+    mean = np.full(values.shape[1], np.nan)
+    variance = np.zeros(values.shape[1])
+    seen = np.zeros(values.shape[1])
+    means = np.full(values.shape, np.nan)
+    stds = np.full(values.shape, np.nan)
+    for row in range(values.shape[0]):
+        ready = seen >= min_periods
+        means[row] = np.where(ready, mean, np.nan)
+        stds[row] = np.where(ready, np.sqrt(variance), np.nan)
+
+        current = values[row]
+        valid = ~np.isnan(current)
+        first = valid & (seen == 0)
+        update = valid & ~first
+        diff = np.where(update, current - np.nan_to_num(mean), 0.0)
+        increment = alpha * diff
+        mean = np.where(first, current, np.where(update, mean + increment, mean))
+        variance = np.where(update, (1 - alpha) * (variance + diff * increment), variance)
+        seen += valid
+    return means, stds
+
+
+def _weekday_stats(values: np.ndarray, weeks: int, min_periods: int):
+    """Trailing mean / std of the same weekday over the previous `weeks` weeks."""
+    means = np.full(values.shape, np.nan)
+    stds = np.full(values.shape, np.nan)
+    for offset in range(7):
+        rows = slice(offset, None, 7)
+        means[rows], stds[rows] = _trailing_stats(values[rows], weeks, min_periods)
+    return means, stds
+
+
+def detect_series_anomalies(frame: pd.DataFrame, metrics: Sequence[str] = ("otif_rate", "order_count"),
+                            recent_days: int = RECENT_DAYS, limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Scores every series in a load_kpi_series frame with all detectors and returns the
+    anomalies of the last recent_days days, strongest first.
+    Raises ValueError for an unknown metric.
+    """
+    unknown = [metric for metric in metrics if metric not in METRICS]
+    if unknown:
+        raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+    if frame.empty:
+        return []
+
+    days = pd.date_range(frame["day"].min(), frame["day"].max(), freq="D")
+    key_columns = ["workflow_id", "dimension", "dim_key"]
+    codes = frame.groupby(key_columns, sort=False).ngroup().to_numpy()
+    series = frame[key_columns].drop_duplicates() # same first-seen order as ngroup(sort=False)
+    series_workflows, series_dimensions, series_keys = (series[column].to_numpy() for column in key_columns)
+    orders = _series_matrix(frame, "order_count", days, codes, len(series))
+    scored = slice(max(len(days) - recent_days, 0), None) # baselines use all rows, only these are scored
+
+    # Candidates from every metric as parallel arrays; dicts are only built for the top `limit`
+    candidates = []
+    for metric in metrics:
+        numerator, direction, std_floor = METRICS[metric]
+        if numerator is None:
+            # A day without rows had no orders
+            values = np.nan_to_num(orders)
+        else:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = _series_matrix(frame, numerator, days, codes, len(series)) / orders
+            values[~(orders >= MIN_DAILY_ORDERS)] = np.nan
+
+        baselines = [
+            _trailing_stats(values, ROLLING_WINDOW, MIN_HISTORY),
+            _ewma_stats(values, EWMA_SPAN, MIN_HISTORY),
+            _weekday_stats(values, WEEKDAY_WEEKS, max(MIN_HISTORY // 2, 2)),
+        ]
+        current = values[scored]
+        expected = np.stack([mean[scored] for mean, _ in baselines])
+        floors = [std_floor] * len(baselines)
+        if numerator is not None:
+            # A rate over n orders has binomial noise of sqrt(p(1 - p) / n) even when its history is flat
+            with np.errstate(invalid="ignore", divide="ignore"):
+                floors = [np.fmax(np.sqrt(mean[scored] * (1 - mean[scored]) / orders[scored]), std_floor)
+                          for mean, _ in baselines]
+        z_scores = np.stack([(current - mean[scored]) / np.maximum(std[scored], floor)
+                             for (mean, std), floor in zip(baselines, floors)])
+        if direction == "drop":
+            scores = -z_scores
+        elif direction == "spike":
+            scores = z_scores
+        else:
+            scores = np.abs(z_scores)
+        scores = np.nan_to_num(scores, nan=0.0)
+        hits = scores >= Z_THRESHOLD
+        if numerator is None:
+            # Volume swings of rarely ordered keys are not interesting
+            hits &= ~(np.nan_to_num(expected) < MIN_DAILY_ORDERS)
+
+        rows, columns = np.nonzero(hits.sum(axis=0) >= MIN_DETECTORS)
+        strongest = np.argmax(scores[:, rows, columns], axis=0)
+        candidates.append((metric, rows + scored.start, columns, scores[strongest, rows, columns],
+                           z_scores[strongest, rows, columns], expected[strongest, rows, columns],
+                           current[rows, columns], hits[:, rows, columns]))
+
+    ranked = sorted(
+        ((score, metric_index, position) for metric_index, candidate in enumerate(candidates)
+         for position, score in enumerate(candidate[3])),
+        key=lambda item: -item[0],
+    )[:limit]
+    found = []
+    for score, metric_index, position in ranked:
+        metric, rows, columns, _, z_scores, expected, current, hits = candidates[metric_index]
+        row, column, z_score = rows[position], columns[position], float(z_scores[position])
+        found.append({
+            "workflow_id": int(series_workflows[column]),
+            "dimension": series_dimensions[column],
+            "key": series_keys[column],
+            "day": days[row].date().isoformat(),
+            "metric": metric,
+            "direction": "drop" if z_score < 0 else "spike",
+            "value": round(float(current[position]), 4),
+            "expected": round(float(expected[position]), 4),
+            "z_score": round(z_score, 2),
+            "detectors": [name for name, hit in zip(DETECTORS, hits[:, position]) if hit],
+            "severity": next(label for bound, label in SEVERITIES if score >= bound),
+            "orders": int(np.nan_to_num(orders[row, column])),
+        })
+    return found
+
+
+def find_kpi_anomalies(session: Session, workflow_ids: Sequence[int], metrics: Sequence[str] = ("otif_rate", "order_count"),
+                       end_date: Optional[date] = None, recent_days: int = RECENT_DAYS, limit: int = 50) -> List[Dict[str, Any]]:
+    """Loads the workflows' day rollups (one query) and returns their ranked anomalies."""
+    workflow_ids = list(workflow_ids)
+    ensure_rollup_table(session.connection())
+    if workflow_ids:
+        ensure_workflow_rollups(session, workflow_ids)
+    frame = load_kpi_series(session, workflow_ids, end_date, HISTORY_DAYS + recent_days)
+    return detect_series_anomalies(frame, metrics, recent_days, limit)
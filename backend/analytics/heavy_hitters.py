@@ -0,0 +1,87 @@
+# backend/analytics/heavy_hitters.py
+"""
+Mergeable heavy-hitter summary (Space-Saving style) for top-N products / customers.
+
+A summary monitors at most `capacity` keys. Each monitored key has an estimated
+count that never underestimates and an `error` (how much of the count may be
+overestimation); any key that is not monitored has a true count of at most
+`floor`. Merging two summaries keeps those guarantees (errors add up),
+so per-workflow, per-month summaries combine into merchant-wide, multi-month answers.
+"""
+import heapq
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class HeavyHitter:
+    key: str
+    count: int # upper bound (estimate)
+    error: int # count - error is a guaranteed lower bound
+
+    @property
+    def lower_bound(self) -> int:
+        return self.count - self.error
+
+
+@dataclass
+class TopKSummary:
+    capacity: int
+    counters: Dict[str, Tuple[int, int]] = field(default_factory=dict) # key -> (count, error)
+    floor: int = 0 # true count of any key not in counters is <= floor
+
+    @classmethod
+    def from_counts(cls, counts: Iterable[Tuple[str, int]], capacity: int) -> "TopKSummary":
+        """Exact summary of already-aggregated (key, count) pairs: top `capacity` kept with zero error."""
+        ranked = heapq.nlargest(capacity + 1, counts, key=lambda item: (item[1], item[0]))
+        summary = cls(capacity, {key: (int(count), 0) for key, count in ranked[:capacity]})
+        summary.floor = int(ranked[capacity][1]) if len(ranked) > capacity else 0
+        return summary
+
+    def merge(self, other: "TopKSummary") -> "TopKSummary":
+        """Combines two summaries (e.g. two workflows or two months) into a new one."""
+        capacity = max(self.capacity, other.capacity)
+        merged: Dict[str, Tuple[int, int]] = {}
+        for key in self.counters.keys() | other.counters.keys():
+            count_a, error_a = self.counters.get(key, (self.floor, self.floor))
+            count_b, error_b = other.counters.get(key, (other.floor, other.floor))
+            merged[key] = (count_a + count_b, error_a + error_b)
+
+        kept = heapq.nlargest(capacity + 1, merged.items(), key=lambda item: (item[1][0], item[0]))
+        floor = self.floor + other.floor
+        if len(kept) > capacity:
+            floor = max(floor, kept[capacity][1][0])
+        return TopKSummary(capacity, dict(kept[:capacity]), floor)
+
+    def top(self, n: int) -> List[HeavyHitter]:
+        ranked = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))[:n]
+        return [HeavyHitter(key, count, error) for key, (count, error) in ranked]
+
+    def is_exact_top(self, n: int) -> bool:
+        """
+        True when the top-n keys are guaranteed to be the true top-n (as a set): every reported
+        key's lower bound is at least the largest possible count of any key ranked below it.
+        """
+        ranked = sorted((count for count, _ in self.counters.values()), reverse=True)
+        hitters = self.top(n)
+        if not hitters:
+            return True
+        challenger = max(ranked[n] if len(ranked) > n else 0, self.floor)
+        return min(hitter.lower_bound for hitter in hitters) >= challenger
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"capacity": self.capacity, "floor": self.floor,
+                "counters": {key: [count, error] for key, (count, error) in self.counters.items()}}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "TopKSummary":
+        return cls(data["capacity"], {key: (value[0], value[1]) for key, value in data["counters"].items()},
+                   data.get("floor", 0))
+
+
+def merge_summaries(summaries: Iterable[TopKSummary]) -> Optional[TopKSummary]:
+    """Merges any number of summaries; None if there are none."""
+    merged = None
+    for summary in summaries:
+        merged = summary if merged is None else merged.merge(summary)
+    return merged
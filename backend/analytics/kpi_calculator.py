@@ -1,15 +1,43 @@
 # backend/analytics/kpi_calculator.py
 from sqlmodel import Session, select, func
-from typing import Dict, Any, Type
+from sqlalchemy import case, literal, tuple_, union_all
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Sequence, Type
+
+from models.rollup_model import KpiDailyRollup, KpiKeyRollup, ROLLUP_TOTAL, ROLLUP_PRODUCT, ROLLUP_CUSTOMER
+from models.sales_data_model import workflow_id_for_model
+from analytics.heavy_hitters import merge_summaries
+from services import analytics_engine
+from services.kpi_rollups import ensure_rollup_table, ensure_workflow_rollups
+from services.kpi_sketches import SKETCH_CAPACITY, SKETCH_VALUE_COLUMNS, load_sketches, month_counts, month_start, next_month
+
+# How many rows the top product / top customer lists return
+TOP_N = 3
+
+
+def _count_where(condition):
+    """Conditional count usable inside a single aggregate SELECT (portable form of COUNT(*) FILTER)."""
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
 
 
 # NOTE: All functions now accept model_class: Type
 def calculate_delivery_kpis(session: Session, model_class: Type) -> Dict[str, Any]:
-    """Calculates On-Time, In-Full, and OTIF rates using a provided model class."""
-    
-    # Use model_class instead of hardcoded SalesData
-    total_orders = session.exec(select(func.count(model_class.id))).one_or_none()
-    
+    """Calculates On-Time, In-Full, and OTIF rates using a provided model class (one table scan)."""
+    return _delivery_rates(*session.exec(_delivery_select(model_class)).one())
+
+
+def _delivery_select(model_class: Type):
+    # Use model_class instead of hardcoded SalesData; every count comes out of the same pass
+    return select(
+        func.count(model_class.id),
+        _count_where(model_class.on_time == 1),
+        _count_where(model_class.in_full == 1),
+        _count_where((model_class.on_time == 1) & (model_class.in_full == 1)),
+    )
+
+
+def _delivery_rates(total_orders, on_time_count, in_full_count, otif_count) -> Dict[str, Any]:
+    """Turns the four counts into the delivery_performance block."""
     if not total_orders or total_orders == 0:
         return {
             "on_time_rate": 0.0,
@@ -18,13 +46,6 @@ def calculate_delivery_kpis(session: Session, model_class: Type) -> Dict[str, An
             "total_orders": 0
         }
 
-    # Use aggregation to calculate success counts, referencing model_class
-    on_time_count = session.exec(select(func.count(model_class.id)).where(model_class.on_time == 1)).one()
-    in_full_count = session.exec(select(func.count(model_class.id)).where(model_class.in_full == 1)).one()
-    otif_count = session.exec(select(func.count(model_class.id)).where(
-        (model_class.on_time == 1) & (model_class.in_full == 1)
-    )).one()
-
     # Calculate Rates
     on_time_rate = round(on_time_count / total_orders, 3) if total_orders else 0
     in_full_rate = round(in_full_count / total_orders, 3) if total_orders else 0
@@ -37,56 +58,241 @@ def calculate_delivery_kpis(session: Session, model_class: Type) -> Dict[str, An
         "total_orders": total_orders
     }
 
-# NOTE: All functions now accept model_class: Type
-def calculate_product_kpis(session: Session, model_class: Type) -> Dict[str, Any]:
-    """Calculates top products and order quantities."""
-    
-    # Example: Top 3 Most Ordered Products
-    stmt = select(
-        model_class.product_id,
-        func.sum(model_class.order_qty).label('total_qty')
-    ).group_by(model_class.product_id).order_by(func.sum(model_class.order_qty).desc()).limit(3)
-    
-    top_products_result = session.exec(stmt).all()
-    
-    # Format results for JSON response
-    top_products = [
-        {"product_id": prod_id, "total_qty": qty}
-        for prod_id, qty in top_products_result
-    ]
+
+def _top_n_grouping_sets(model_class: Type, limit: int):
+    """PostgreSQL: both rankings from ONE scan via GROUPING SETS + ROW_NUMBER per grouping set."""
+    is_customer_row = func.grouping(model_class.product_id) # 1 on the customer_id grouping set
+    ranking_value = case(
+        (is_customer_row == 0, func.sum(model_class.order_qty)),
+        else_=func.count(model_class.order_id),
+    )
+    ranked = select(
+        is_customer_row.label('is_customer'),
+        func.coalesce(model_class.product_id, model_class.customer_id).label('key'),
+        ranking_value.label('value'),
+        func.row_number().over(
+            partition_by=is_customer_row,
+            order_by=(ranking_value.desc(), func.coalesce(model_class.product_id, model_class.customer_id)),
+        ).label('rank'),
+    ).group_by(
+        func.grouping_sets(tuple_(model_class.product_id), tuple_(model_class.customer_id))
+    ).subquery()
+
+    return select(
+        case((ranked.c.is_customer == 0, literal('product')), else_=literal('customer')).label('dimension'),
+        ranked.c.key,
+        ranked.c.value,
+    ).where(ranked.c.rank <= limit).order_by(ranked.c.is_customer, ranked.c.rank)
+
+
+def _top_products_select(model_class: Type, limit: int):
+    """Top products by ordered quantity, as (dimension, key, value) rows."""
+    return select(
+        literal('product').label('dimension'),
+        model_class.product_id.label('key'),
+        func.sum(model_class.order_qty).label('value'),
+    ).group_by(model_class.product_id).order_by(
+        func.sum(model_class.order_qty).desc(), model_class.product_id
+    ).limit(limit)
+
+
+def _top_customers_select(model_class: Type, limit: int):
+    """Top customers by order count, as (dimension, key, value) rows."""
+    return select(
+        literal('customer').label('dimension'),
+        model_class.customer_id.label('key'),
+        func.count(model_class.order_id).label('value'),
+    ).group_by(model_class.customer_id).order_by(
+        func.count(model_class.order_id).desc(), model_class.customer_id
+    ).limit(limit)
+
+
+def _top_n_union_all(model_class: Type, limit: int):
+    """Other dialects: both rankings in one statement / round trip (UNION ALL of two limited groupings)."""
+    # LIMIT inside a compound member needs the subquery wrapper (SQLite)
+    return union_all(
+        select(_top_products_select(model_class, limit).subquery()),
+        select(_top_customers_select(model_class, limit).subquery()),
+    )
+
+
+def calculate_top_n_kpis(session: Session, model_class: Type, limit: int = TOP_N) -> Dict[str, List[Dict[str, Any]]]:
+    """Top products by ordered quantity and top customers by order count, in a single statement."""
+    if session.get_bind().dialect.name == "postgresql":
+        stmt = _top_n_grouping_sets(model_class, limit)
+    else:
+        stmt = _top_n_union_all(model_class, limit)
+
+    return _top_lists(session.exec(stmt).all())
+
+
+def _top_lists(rows) -> Dict[str, List[Dict[str, Any]]]:
+    """(dimension, key, value) ranking rows -> the top product and top customer lists."""
+    top = {"product": [], "customer": []}
+    for dimension, key, value in rows:
+        top[dimension].append((key, value))
 
     return {
-        "top_ordered_products": top_products
+        "top_ordered_products": [{"product_id": prod_id, "total_qty": qty} for prod_id, qty in top["product"]],
+        "top_ordering_customers": [{"customer_id": cust_id, "order_count": count} for cust_id, count in top["customer"]],
     }
 
-# NOTE: All functions now accept model_class: Type
-def calculate_customer_kpis(session: Session, model_class: Type) -> Dict[str, Any]:
-    """Calculates basic customer ordering patterns."""
-
-    # Example: Customers with the most orders
-    stmt = select(
-        model_class.customer_id,
-        func.count(model_class.order_id).label('order_count')
-    ).group_by(model_class.customer_id).order_by(func.count(model_class.order_id).desc()).limit(3)
-    
-    top_customers_result = session.exec(stmt).all()
-    
-    top_customers = [
-        {"customer_id": cust_id, "order_count": count}
-        for cust_id, count in top_customers_result
-    ]
-    
+
+def _columnar_kpis(session: Session, workflow_id: int, limit: int = TOP_N) -> Dict[str, Any]:
+    """get_all_kpis from a workflow's raw rows on the DuckDB mirror (same two statements)."""
+    view = analytics_engine.sales_view().c
+    counts = analytics_engine.run_statement(session, [workflow_id], _delivery_select(view))[0]
+    top_n = _top_lists(analytics_engine.run_statement(session, [workflow_id], _top_n_union_all(view, limit)))
     return {
-        "top_ordering_customers": top_customers
+        "delivery_performance": _delivery_rates(*counts),
+        "product_performance": {"top_ordered_products": top_n["top_ordered_products"]},
+        "customer_insights": {"top_ordering_customers": top_n["top_ordering_customers"]},
     }
 
+
+def _rollup_top_n(workflow_ids: Sequence[int], dimension: str, value_column, limit: int):
+    return select(
+        literal(dimension).label('dimension'),
+        KpiKeyRollup.dim_key.label('key'),
+        func.sum(value_column).label('value'),
+    ).where(
+        KpiKeyRollup.workflow_id.in_(workflow_ids), KpiKeyRollup.dimension == dimension
+    ).group_by(KpiKeyRollup.dim_key).order_by(
+        func.sum(value_column).desc(), KpiKeyRollup.dim_key
+    ).limit(limit).subquery()
+
+
+def get_rollup_kpis(session: Session, workflow_ids: Sequence[int], limit: int = TOP_N) -> Optional[Dict[str, Any]]:
+    """
+    Same result as get_all_kpis, read from the rollups of one or more workflows: totals from the
+    per-day rows, rankings from the all-time per product/customer rows. Cost grows with days and
+    distinct products/customers, not with raw rows; two statements for any number of workflows.
+    Rankings are merged across workflows. Returns None if none of them has rollups yet.
+    """
+    ensure_rollup_table(session.connection())
+    total_orders, on_time_count, in_full_count, otif_count = session.exec(
+        select(
+            func.sum(KpiDailyRollup.order_count),
+            func.sum(KpiDailyRollup.on_time_count),
+            func.sum(KpiDailyRollup.in_full_count),
+            func.sum(KpiDailyRollup.otif_count),
+        ).where(KpiDailyRollup.workflow_id.in_(workflow_ids), KpiDailyRollup.dimension == ROLLUP_TOTAL)
+    ).one()
+    if total_orders is None:
+        return None
+
+    top = {"product": [], "customer": []}
+    stmt = union_all(
+        select(_rollup_top_n(workflow_ids, ROLLUP_PRODUCT, KpiKeyRollup.order_qty_sum, limit)),
+        select(_rollup_top_n(workflow_ids, ROLLUP_CUSTOMER, KpiKeyRollup.order_count, limit)),
+    )
+    for dimension, key, value in session.exec(stmt).all():
+        top[dimension].append((key, value))
+
+    return {
+        "delivery_performance": _delivery_rates(total_orders, on_time_count, in_full_count, otif_count),
+        "product_performance": {
+            "top_ordered_products": [{"product_id": prod_id, "total_qty": qty} for prod_id, qty in top["product"]],
+        },
+        "customer_insights": {
+            "top_ordering_customers": [{"customer_id": cust_id, "order_count": count} for cust_id, count in top["customer"]],
+        },
+    }
+
+
+def get_merchant_kpis(session: Session, workflow_ids: Sequence[int]) -> Dict[str, Any]:
+    """
+    Merchant-wide KPIs across all of a user's workflow tables, from their merged rollups
+    (workflow tables that predate rollups are rolled up once, on first use).
+    """
+    workflow_ids = list(workflow_ids)
+    kpis = None
+    if workflow_ids:
+        ensure_workflow_rollups(session, workflow_ids)
+        kpis = get_rollup_kpis(session, workflow_ids)
+    if kpis is None:
+        return {
+            "delivery_performance": _delivery_rates(0, 0, 0, 0),
+            "product_performance": {"top_ordered_products": []},
+            "customer_insights": {"top_ordering_customers": []},
+        }
+    return kpis
+
+def calculate_heavy_hitters(session: Session, workflow_ids: Sequence[int], dimension: str, n: int = TOP_N,
+                            start_date: Optional[date] = None, end_date: Optional[date] = None,
+                            exact: bool = False) -> Dict[str, Any]:
+    """
+    Top-n products (by ordered quantity) or customers (by order count) of one or more workflows,
+    over the whole months covering [start_date, end_date]. Answered by merging the monthly
+    sketches (with per-key error bounds), or exactly from the day rollups with exact=True.
+    Raises ValueError for an unknown dimension or an n above SKETCH_CAPACITY.
+    """
+    if dimension not in SKETCH_VALUE_COLUMNS:
+        raise ValueError(f"dimension must be one of {', '.join(SKETCH_VALUE_COLUMNS)}")
+    if not 1 <= n <= SKETCH_CAPACITY:
+        raise ValueError(f"n must be between 1 and {SKETCH_CAPACITY}")
+
+    workflow_ids = list(workflow_ids)
+    ensure_rollup_table(session.connection())
+    if workflow_ids:
+        ensure_workflow_rollups(session, workflow_ids)
+    first_month = month_start(start_date) if start_date else None
+    last_month = month_start(end_date) if end_date else None
+
+    if exact:
+        ranked = month_counts(session, workflow_ids, dimension, first_month, last_month, n)
+        items = [{"key": key, "value": value, "lower_bound": value, "error": 0} for key, value in ranked]
+        exact_top = True
+    else:
+        summary = merge_summaries(load_sketches(session, workflow_ids, dimension, first_month, last_month))
+        hitters = summary.top(n) if summary else []
+        items = [{"key": hitter.key, "value": hitter.count, "lower_bound": hitter.lower_bound, "error": hitter.error}
+                 for hitter in hitters]
+        exact_top = summary.is_exact_top(n) if summary else True
+
+    return {
+        "dimension": dimension,
+        "metric": "order_qty" if dimension == ROLLUP_PRODUCT else "order_count",
+        "method": "exact" if exact else "sketch",
+        "start_date": first_month,
+        "end_date": next_month(last_month) - timedelta(days=1) if last_month else None,
+        "exact_top": exact_top, # the reported keys are guaranteed to be the true top-n
+        "items": items,
+    }
+
+# NOTE: All functions now accept model_class: Type
+def calculate_product_kpis(session: Session, model_class: Type, limit: int = TOP_N) -> Dict[str, Any]:
+    """Calculates top products and order quantities (the product grouping only)."""
+    rows = session.exec(_top_products_select(model_class, limit)).all()
+    return {"top_ordered_products": _top_lists(rows)["top_ordered_products"]}
+
+# NOTE: All functions now accept model_class: Type
+def calculate_customer_kpis(session: Session, model_class: Type, limit: int = TOP_N) -> Dict[str, Any]:
+    """Calculates basic customer ordering patterns (the customer grouping only)."""
+    rows = session.exec(_top_customers_select(model_class, limit)).all()
+    return {"top_ordering_customers": _top_lists(rows)["top_ordering_customers"]}
+
 # NOTE: The aggregator function now accepts model_class: Type
 def get_all_kpis(session: Session, model_class: Type) -> Dict[str, Any]:
-    """Aggregates all KPI calculations into a single dictionary."""
-    
+    """
+    Aggregates all KPI calculations into a single dictionary. Workflow tables are served from
+    the KPI rollups; the shared SalesData table (or a workflow without rollups yet) is
+    aggregated from raw rows in two statements, on the DuckDB mirror for a workflow when the
+    analytics engine is enabled.
+    """
+    workflow_id = workflow_id_for_model(model_class)
+    if workflow_id is not None:
+        kpis = get_rollup_kpis(session, [workflow_id])
+        if kpis is not None:
+            return kpis
+        if analytics_engine.analytics_enabled():
+            return _columnar_kpis(session, workflow_id)
+
+    top_n = calculate_top_n_kpis(session, model_class)
+
     kpis = {}
     kpis["delivery_performance"] = calculate_delivery_kpis(session, model_class)
-    kpis["product_performance"] = calculate_product_kpis(session, model_class)
-    kpis["customer_insights"] = calculate_customer_kpis(session, model_class)
-    
-    return kpis
\ No newline at end of file
+    kpis["product_performance"] = {"top_ordered_products": top_n["top_ordered_products"]}
+    kpis["customer_insights"] = {"top_ordering_customers": top_n["top_ordering_customers"]}
+
+    return kpis
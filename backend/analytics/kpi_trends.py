@@ -0,0 +1,168 @@
+# backend/analytics/kpi_trends.py
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Type
+from sqlalchemy import Date, case, cast, literal_column
+from sqlmodel import Session, select, func
+
+from models.rollup_model import KpiDailyRollup, ROLLUP_TOTAL, ROLLUP_PRODUCT, ROLLUP_CUSTOMER
+from models.sales_data_model import workflow_id_for_model
+from services import analytics_engine
+from services.kpi_rollups import has_rollups, ensure_rollup_table, ensure_workflow_rollups
+
+GRANULARITIES = ("day", "week", "month")
+
+# Columnar series returned for every bucket
+TREND_SERIES = ["total_orders", "on_time_rate", "in_full_rate", "otif_rate", "order_qty", "delivery_qty"]
+
+
+def _bucket(column, granularity: str, dialect: str):
+    """delivery_date truncated to the bucket start (weeks start on Monday, as date_trunc does)."""
+    if dialect == "postgresql":
+        # Inline (granularity is one of GRANULARITIES): a bound value would make the SELECT and
+        # GROUP BY expressions differ for engines that bind server-side (DuckDB)
+        return cast(func.date_trunc(literal_column(f"'{granularity}'"), column), Date)
+    # SQLite (and anything without date_trunc): date()/strftime() modifiers
+    if granularity == "week":
+        return func.date(column, "weekday 0", "-6 days")
+    if granularity == "month":
+        return func.strftime("%Y-%m-01", column)
+    return func.date(column)
+
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _raw_trend_select(model_class: Type, granularity: str, dialect: str,
+                      product_id: Optional[str], customer_id: Optional[str]):
+    bucket = _bucket(model_class.delivery_date, granularity, dialect).label("bucket")
+    stmt = select(
+        bucket,
+        func.count(model_class.id),
+        _count_where(model_class.on_time == 1),
+        _count_where(model_class.in_full == 1),
+        _count_where((model_class.on_time == 1) & (model_class.in_full == 1)),
+        func.coalesce(func.sum(model_class.order_qty), 0),
+        func.coalesce(func.sum(model_class.delivery_qty), 0),
+    )
+    if product_id is not None:
+        stmt = stmt.where(model_class.product_id == product_id)
+    if customer_id is not None:
+        stmt = stmt.where(model_class.customer_id == customer_id)
+    return stmt, model_class.delivery_date, bucket
+
+
+def _rollup_trend_select(workflow_ids: Sequence[int], granularity: str, dialect: str,
+                         product_id: Optional[str], customer_id: Optional[str]):
+    if product_id is not None:
+        dimension, dim_key = ROLLUP_PRODUCT, product_id
+    elif customer_id is not None:
+        dimension, dim_key = ROLLUP_CUSTOMER, customer_id
+    else:
+        dimension, dim_key = ROLLUP_TOTAL, ""
+
+    bucket = _bucket(KpiDailyRollup.day, granularity, dialect).label("bucket")
+    stmt = select(
+        bucket,
+        func.sum(KpiDailyRollup.order_count),
+        func.sum(KpiDailyRollup.on_time_count),
+        func.sum(KpiDailyRollup.in_full_count),
+        func.sum(KpiDailyRollup.otif_count),
+        func.sum(KpiDailyRollup.order_qty_sum),
+        func.sum(KpiDailyRollup.delivery_qty_sum),
+    ).where(
+        KpiDailyRollup.workflow_id.in_(workflow_ids),
+        KpiDailyRollup.dimension == dimension,
+        KpiDailyRollup.dim_key == dim_key,
+    )
+    return stmt, KpiDailyRollup.day, bucket
+
+
+def calculate_kpi_trend(session: Session, model_class: Type, granularity: str = "day",
+                        start_date: Optional[date] = None, end_date: Optional[date] = None,
+                        product_id: Optional[str] = None, customer_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Delivery KPIs per day/week/month of delivery_date, as one array per metric (columnar,
+    ordered by bucket). Workflow tables are read from the KPI rollups unless both a product
+    and a customer filter are given; everything else is grouped from raw rows (a workflow's
+    rows on the DuckDB mirror when the analytics engine is enabled).
+    Raises ValueError for an unknown granularity.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    dialect = session.get_bind().dialect.name
+
+    workflow_id = workflow_id_for_model(model_class)
+    use_rollups = (
+        workflow_id is not None
+        and (product_id is None or customer_id is None)
+        and has_rollups(session, workflow_id)
+    )
+    columnar = not use_rollups and workflow_id is not None and analytics_engine.analytics_enabled()
+    if use_rollups:
+        stmt, day_column, bucket = _rollup_trend_select([workflow_id], granularity, dialect, product_id, customer_id)
+    elif columnar:
+        stmt, day_column, bucket = _raw_trend_select(analytics_engine.sales_view().c, granularity, "postgresql",
+                                                     product_id, customer_id)
+    else:
+        stmt, day_column, bucket = _raw_trend_select(model_class, granularity, dialect, product_id, customer_id)
+
+    return _run_trend(session, stmt, day_column, bucket, granularity, start_date, end_date,
+                      "rollup" if use_rollups else "raw", workflow_id if columnar else None)
+
+
+def calculate_merchant_kpi_trend(session: Session, workflow_ids: Sequence[int], granularity: str = "day",
+                                 start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                 product_id: Optional[str] = None, customer_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    calculate_kpi_trend across all of a merchant's workflows, from their merged rollups (one
+    statement for any number of workflows). Combining a product and a customer filter needs raw
+    rows and is only supported per workflow. Raises ValueError for invalid arguments.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if product_id is not None and customer_id is not None:
+        raise ValueError("product_id and customer_id can only be combined for a single workflow_id")
+    workflow_ids = list(workflow_ids)
+    ensure_rollup_table(session.connection())
+    if workflow_ids:
+        ensure_workflow_rollups(session, workflow_ids)
+
+    dialect = session.get_bind().dialect.name
+    stmt, day_column, bucket = _rollup_trend_select(workflow_ids, granularity, dialect, product_id, customer_id)
+    return _run_trend(session, stmt, day_column, bucket, granularity, start_date, end_date, "rollup")
+
+
+def _run_trend(session: Session, stmt, day_column, bucket, granularity: str,
+               start_date: Optional[date], end_date: Optional[date], source: str,
+               columnar_workflow_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Applies the date range, groups by bucket and pivots the rows into one array per metric.
+    With columnar_workflow_id the statement (built on analytics_engine.sales_view()) runs on DuckDB.
+    """
+    if start_date is not None:
+        stmt = stmt.where(day_column >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(day_column <= end_date)
+    stmt = stmt.group_by(bucket).order_by(bucket)
+    if columnar_workflow_id is not None:
+        rows = analytics_engine.run_statement(session, [columnar_workflow_id], stmt)
+    else:
+        rows = session.exec(stmt).all()
+
+    trend: Dict[str, List] = {"buckets": [], **{name: [] for name in TREND_SERIES}}
+    for bucket_start, total, on_time, in_full, otif, order_qty, delivery_qty in rows:
+        trend["buckets"].append(str(bucket_start))
+        trend["total_orders"].append(total)
+        trend["on_time_rate"].append(round(on_time / total, 3) if total else 0.0)
+        trend["in_full_rate"].append(round(in_full / total, 3) if total else 0.0)
+        trend["otif_rate"].append(round(otif / total, 3) if total else 0.0)
+        trend["order_qty"].append(order_qty)
+        trend["delivery_qty"].append(delivery_qty)
+
+    return {
+        "granularity": granularity,
+        "source": source,
+        "engine": "duckdb" if columnar_workflow_id is not None else "sql",
+        **trend,
+    }
@@ -0,0 +1,118 @@
+# backend/benchmarks/bench_analytics_engine.py
+"""
+Ad-hoc analytical SELECTs (the kind /api/v1/query-data produces) over one large workflow table:
+  database : the query on the OLTP table (sales_data_<id>) through SQLAlchemy
+  duckdb   : the same query on the workflow's Parquet mirror (services/analytics_engine.py)
+Also reports the cost of the initial export and of re-syncing one dirty month.
+
+Requires the optional 'duckdb' package. Run from the backend/ folder:
+    python -m benchmarks.bench_analytics_engine --rows 1000000
+Set BENCH_DATABASE_URL to benchmark PostgreSQL; defaults to a temp SQLite file.
+The synthetic table is kept between runs (use --reload to rebuild it).
+"""
+import argparse
+import os
+import tempfile
+import time
+from sqlalchemy import inspect, text
+from sqlmodel import Session, create_engine
+
+from benchmarks.bench_ingestion import make_sales_frame
+from models.analytics_model import AnalyticsDirtyMonth, AnalyticsWatermark
+from models.sales_data_model import get_sales_data_model
+from models.user_model import User
+from models.workflow import Workflow
+from services import analytics_engine
+from services.ingestion import ingest_data_frame
+from services.kpi_rollups import ensure_rollup_table
+
+BENCH_WORKFLOW_ID = 930000
+
+# {table} is the workflow table for the database run and the 'salesdata' view for DuckDB
+QUERIES = {
+    "monthly otif by product": (
+        "SELECT product_id, strftime(delivery_date, '%Y-%m') AS month, count(*) AS orders, "
+        "avg(CASE WHEN on_time = 1 AND in_full = 1 THEN 1.0 ELSE 0 END) AS otif "
+        "FROM {table} GROUP BY 1, 2 ORDER BY 1, 2"
+    ),
+    "short-shipped customers": (
+        "SELECT customer_id, sum(order_qty - delivery_qty) AS short_qty FROM {table} "
+        "WHERE delivery_date >= '2025-03-01' AND delivery_date < '2025-10-01' "
+        "GROUP BY 1 ORDER BY 2 DESC LIMIT 20"
+    ),
+    "quantity totals": "SELECT count(*), sum(order_qty), sum(delivery_qty), count(DISTINCT customer_id) FROM {table}",
+}
+
+
+def database_sql(sql: str, dialect: str) -> str:
+    # strftime(date, fmt) is DuckDB's argument order; SQLite takes (fmt, date), PostgreSQL uses to_char
+    if dialect == "sqlite":
+        return sql.replace("strftime(delivery_date, '%Y-%m')", "strftime('%Y-%m', delivery_date)")
+    if dialect == "postgresql":
+        return sql.replace("strftime(delivery_date, '%Y-%m')", "to_char(delivery_date, 'YYYY-MM')")
+    return sql
+
+
+def timed(func_, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func_()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(rows: int, database_url: str, repeat: int, reload: bool):
+    if analytics_engine._duckdb() is None:
+        raise SystemExit("The 'duckdb' package is required: pip install duckdb")
+    analytics_engine.ANALYTICS_PARQUET_DIR = os.path.join(tempfile.gettempdir(), "bench_analytics_store")
+
+    engine = create_engine(database_url)
+    model_class = get_sales_data_model(BENCH_WORKFLOW_ID)
+    ensure_rollup_table(engine)
+    for model in (User, Workflow, AnalyticsDirtyMonth, AnalyticsWatermark):
+        model.__table__.create(engine, checkfirst=True)
+    if reload or not inspect(engine).has_table(model_class.__tablename__):
+        model_class.__table__.drop(engine, checkfirst=True)
+        model_class.__table__.create(engine)
+        with Session(engine) as session:
+            ingest_data_frame(make_sales_frame(rows), session, 1, model_class)
+
+    with Session(engine) as session:
+        # Full export from scratch, then a one-month re-sync as after a typical ingest
+        session.execute(AnalyticsWatermark.__table__.delete().where(AnalyticsWatermark.workflow_id == BENCH_WORKFLOW_ID))
+        session.commit()
+        start = time.perf_counter()
+        months = analytics_engine.sync_workflow(session, BENCH_WORKFLOW_ID)
+        full_export = time.perf_counter() - start
+
+        new_orders = make_sales_frame(1000, seed=99)
+        new_orders = new_orders.assign(order_id="NEW" + new_orders["order_id"], delivery_date="2025-06-15")
+        ingest_data_frame(new_orders, session, 1, model_class)
+        start = time.perf_counter()
+        analytics_engine.sync_workflow(session, BENCH_WORKFLOW_ID)
+        month_sync = time.perf_counter() - start
+
+        print(f"{rows:,} rows ({engine.dialect.name}): export {months} months {full_export:.2f}s, "
+              f"re-sync 1 month {month_sync:.2f}s")
+        con = analytics_engine.connect([BENCH_WORKFLOW_ID])
+        try:
+            for label, sql in QUERIES.items():
+                db_sql = text(database_sql(sql, engine.dialect.name).format(table=model_class.__tablename__))
+                db_seconds = timed(lambda: session.execute(db_sql).all(), repeat)
+                duck_seconds = timed(lambda: con.execute(sql.format(table="salesdata")).fetchall(), repeat)
+                print(f"  {label:>24} : database {db_seconds:.3f}s, duckdb {duck_seconds:.3f}s "
+                      f"({db_seconds / duck_seconds:.1f}x)")
+        finally:
+            con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DuckDB/Parquet analytics engine against the database.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--reload", action="store_true")
+    args = parser.parse_args()
+
+    default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_analytics_engine.db')}"
+    run(args.rows, os.getenv("BENCH_DATABASE_URL", default_url), args.repeat, args.reload)
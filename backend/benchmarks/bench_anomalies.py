@@ -0,0 +1,78 @@
+# backend/benchmarks/bench_anomalies.py
+"""
+Anomaly scan over many daily KPI series (analytics/anomaly_detector.py):
+  per-series : pandas rolling / ewm / weekday baselines computed series by series
+  matrix     : detect_series_anomalies, every series at once as a days x series matrix
+Synthetic rollup rows, no database needed.
+
+Run from the backend/ folder:
+    python -m benchmarks.bench_anomalies --series 5000 --days 150
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from analytics import anomaly_detector as detector
+
+
+def make_series_frame(series: int, days: int, seed: int = 7) -> pd.DataFrame:
+    """Long rollup frame (load_kpi_series layout) with one injected OTIF drop per 500 series."""
+    rng = np.random.default_rng(seed)
+    orders = rng.poisson(40, (days, series))
+    otif = rng.binomial(orders, 0.93)
+    otif[-1, ::500] = orders[-1, ::500] // 3
+    keys = np.tile(np.arange(series), days)
+    return pd.DataFrame({
+        "workflow_id": 1,
+        "dimension": "product",
+        "dim_key": [f"PROD_{key}" for key in keys],
+        "day": np.repeat(pd.date_range("2025-01-01", periods=days), series),
+        "order_count": orders.ravel(),
+        "on_time_count": otif.ravel(),
+        "in_full_count": otif.ravel(),
+        "otif_count": otif.ravel(),
+    })
+
+
+def per_series_scan(frame: pd.DataFrame, recent_days: int):
+    """The straightforward version: one groupby group (one series) at a time."""
+    found = 0
+    for _, group in frame.groupby(["workflow_id", "dimension", "dim_key"], sort=False):
+        rate = (group.set_index("day")["otif_count"] / group.set_index("day")["order_count"]).asfreq("D")
+        history = rate.shift(1)
+        rolling = (rate - history.rolling(detector.ROLLING_WINDOW, min_periods=detector.MIN_HISTORY).mean()) \
+            / history.rolling(detector.ROLLING_WINDOW, min_periods=detector.MIN_HISTORY).std()
+        ewma = (rate - history.ewm(span=detector.EWMA_SPAN).mean()) / history.ewm(span=detector.EWMA_SPAN).std()
+        weekday = rate.groupby(rate.index.dayofweek).transform(
+            lambda values: (values - values.shift(1).rolling(detector.WEEKDAY_WEEKS, min_periods=3).mean())
+            / values.shift(1).rolling(detector.WEEKDAY_WEEKS, min_periods=3).std())
+        hits = ((-pd.concat([rolling, ewma, weekday], axis=1)) >= detector.Z_THRESHOLD).sum(axis=1)
+        found += int((hits.tail(recent_days) >= detector.MIN_DETECTORS).sum())
+    return found
+
+
+def timed(func_, *args):
+    start = time.perf_counter()
+    result = func_(*args)
+    return result, time.perf_counter() - start
+
+
+def run(series: int, days: int):
+    frame = make_series_frame(series, days)
+    _, per_series_seconds = timed(per_series_scan, frame, detector.RECENT_DAYS)
+    anomalies, matrix_seconds = timed(detector.detect_series_anomalies, frame, ("otif_rate",), detector.RECENT_DAYS, 1000)
+    injected = {f"PROD_{key}" for key in range(0, series, 500)}
+    caught = injected & {anomaly["key"] for anomaly in anomalies[:len(injected)]}
+    print(f"{series:,} series x {days} days")
+    print(f"  per-series : {per_series_seconds:.3f}s")
+    print(f"      matrix : {matrix_seconds:.3f}s  ({per_series_seconds / matrix_seconds:.0f}x), "
+          f"{len(anomalies)} anomalies, {len(caught)}/{len(injected)} injected drops ranked first")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized KPI anomaly scan.")
+    parser.add_argument("--series", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=150)
+    args = parser.parse_args()
+    run(args.series, args.days)
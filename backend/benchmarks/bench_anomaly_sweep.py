@@ -0,0 +1,101 @@
+# backend/benchmarks/bench_anomaly_sweep.py
+"""
+Fleet-wide anomaly sweep over many workflows (services/anomaly_sweep.py):
+  per-workflow : load + score one workflow at a time (what per-request insights do),
+                 timed on a sample and extrapolated
+  sweep        : run_sweep with 1 shard and with --shards processes
+Synthetic KpiDailyRollup rows (a total plus --keys products and customers per workflow).
+
+Run from the backend/ folder:
+    python -m benchmarks.bench_anomaly_sweep --workflows 5000 --days 90 --shards 4
+Set BENCH_DATABASE_URL to benchmark PostgreSQL; defaults to a temp SQLite file.
+The synthetic rollups are kept between runs (use --reload to rebuild them).
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from datetime import date, timedelta
+from sqlalchemy import delete, func, insert, select
+from sqlmodel import Session, create_engine
+
+from analytics.anomaly_detector import detect_series_anomalies, load_kpi_series
+from models.anomaly_model import AnomalySweep, SweepAnomaly
+from models.user_model import User
+from models.workflow import Workflow
+from models.rollup_model import KpiDailyRollup, ROLLUP_TOTAL, ROLLUP_PRODUCT, ROLLUP_CUSTOMER
+from services.anomaly_sweep import run_sweep
+
+BENCH_FIRST_WORKFLOW_ID = 950000
+PER_WORKFLOW_SAMPLE = 200
+
+
+def load(engine, workflow_ids, days: int, keys: int):
+    rng = np.random.default_rng(7)
+    first_day = date(2025, 1, 1)
+    series = [(ROLLUP_TOTAL, "")] + [(ROLLUP_PRODUCT, f"PROD_{i}") for i in range(keys)] \
+        + [(ROLLUP_CUSTOMER, f"CUST_{i}") for i in range(keys)]
+    with Session(engine) as session:
+        session.execute(delete(KpiDailyRollup).where(KpiDailyRollup.workflow_id >= BENCH_FIRST_WORKFLOW_ID))
+        for position, workflow_id in enumerate(workflow_ids):
+            orders = rng.poisson(60, (days, len(series)))
+            otif = rng.binomial(orders, 0.92)
+            if position % 100 == 0:
+                otif[-1, 1] = orders[-1, 1] // 4 # one injected drop per 100 workflows
+            session.execute(insert(KpiDailyRollup.__table__), [
+                {"workflow_id": workflow_id, "day": first_day + timedelta(days=day), "dimension": dimension,
+                 "dim_key": dim_key, "order_count": int(orders[day, column]), "on_time_count": int(otif[day, column]),
+                 "in_full_count": int(otif[day, column]), "otif_count": int(otif[day, column]),
+                 "order_qty_sum": 0, "delivery_qty_sum": 0}
+                for day in range(days) for column, (dimension, dim_key) in enumerate(series)
+            ])
+            if position % 250 == 249:
+                session.commit()
+                print(f"loaded {position + 1}/{len(workflow_ids)} workflows", end="\r")
+        session.commit()
+    print()
+
+
+def per_workflow(engine, workflow_ids):
+    with Session(engine) as session:
+        for workflow_id in workflow_ids:
+            detect_series_anomalies(load_kpi_series(session, [workflow_id]))
+
+
+def run(workflows: int, days: int, keys: int, shards: int, database_url: str, reload: bool):
+    engine = create_engine(database_url)
+    for model in (User, Workflow, KpiDailyRollup, AnomalySweep, SweepAnomaly):
+        model.__table__.create(engine, checkfirst=True)
+    workflow_ids = list(range(BENCH_FIRST_WORKFLOW_ID, BENCH_FIRST_WORKFLOW_ID + workflows))
+    with Session(engine) as session:
+        loaded = session.execute(select(func.count(func.distinct(KpiDailyRollup.workflow_id))).where(
+            KpiDailyRollup.workflow_id >= BENCH_FIRST_WORKFLOW_ID)).scalar()
+    if reload or loaded != workflows:
+        load(engine, workflow_ids, days, keys)
+
+    sample = workflow_ids[:PER_WORKFLOW_SAMPLE]
+    start = time.perf_counter()
+    per_workflow(engine, sample)
+    per_workflow_seconds = (time.perf_counter() - start) * workflows / len(sample)
+
+    print(f"{workflows:,} workflows x {1 + 2 * keys} series x {days} days ({engine.dialect.name})")
+    print(f"  per-workflow : {per_workflow_seconds:.2f}s (extrapolated from {len(sample)})")
+    for shard_count in sorted({1, shards}):
+        with Session(engine) as session:
+            sweep = run_sweep(session, database_url, workflow_ids, shards=shard_count)
+        print(f"  sweep x{shard_count:<3}   : {sweep.seconds:.2f}s ({per_workflow_seconds / sweep.seconds:.1f}x), "
+              f"{sweep.series:,} series, {sweep.anomalies} anomalies, {sweep.alerts} alerts")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fleet-wide anomaly sweep.")
+    parser.add_argument("--workflows", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--keys", type=int, default=3, help="Products and customers per workflow.")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--reload", action="store_true")
+    args = parser.parse_args()
+
+    default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_anomaly_sweep.db')}"
+    run(args.workflows, args.days, args.keys, args.shards, os.getenv("BENCH_DATABASE_URL", default_url), args.reload)
@@ -0,0 +1,82 @@
+# backend/benchmarks/bench_ingestion.py
+"""
+Compares the old per-row ORM ingestion with the bulk path in services/ingestion.py.
+
+Run from the backend/ folder:
+    python -m benchmarks.bench_ingestion --rows 50000
+Set BENCH_DATABASE_URL to benchmark against PostgreSQL (COPY path); defaults to a temp SQLite file.
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlmodel import Session, create_engine
+
+from models.sales_data_model import get_sales_data_model
+from services.ingestion import ingest_data_frame
+
+
+def make_sales_frame(rows: int, seed: int = 7) -> pd.DataFrame:
+    """Synthetic attachment with the SalesDataMixin columns."""
+    rng = np.random.default_rng(seed)
+    order_qty = rng.integers(1, 500, rows)
+    return pd.DataFrame({
+        'order_id': [f"ORD{i:08d}" for i in range(rows)],
+        'product_id': rng.choice([f"PROD_{i}" for i in range(200)], rows),
+        'customer_id': rng.choice([f"CUST_{i}" for i in range(1000)], rows),
+        'order_qty': order_qty,
+        'delivery_qty': np.minimum(order_qty, order_qty - rng.integers(0, 3, rows)),
+        'delivery_date': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+        'on_time': rng.integers(0, 2, rows),
+        'in_full': rng.integers(0, 2, rows),
+    })
+
+
+def legacy_ingest_data_frame(df: pd.DataFrame, session: Session, merchant_id: int, SalesDataModel) -> int:
+    """The original implementation: model_validate + session.add for every row."""
+    inserted_count = 0
+    for record in df.to_dict(orient='records'):
+        try:
+            record['merchant_id'] = merchant_id
+            session.add(SalesDataModel.model_validate(record))
+            inserted_count += 1
+        except Exception:
+            pass
+    session.commit()
+    return inserted_count
+
+
+def run(rows: int, database_url: str):
+    engine = create_engine(database_url)
+    df = make_sales_frame(rows)
+    results = {}
+
+    for label, ingest, workflow_id in [
+        ("per-row ORM", legacy_ingest_data_frame, 900001),
+        ("bulk", ingest_data_frame, 900002),
+    ]:
+        SalesDataModel = get_sales_data_model(workflow_id)
+        SalesDataModel.__table__.drop(engine, checkfirst=True)
+        SalesDataModel.__table__.create(engine)
+
+        with Session(engine) as session:
+            start = time.perf_counter()
+            inserted = ingest(df, session, 1, SalesDataModel)
+            elapsed = time.perf_counter() - start
+
+        results[label] = rows / elapsed
+        print(f"{label:>12}: {inserted} rows in {elapsed:.2f}s -> {rows / elapsed:,.0f} rows/sec")
+        SalesDataModel.__table__.drop(engine, checkfirst=True)
+
+    print(f"{'speedup':>12}: {results['bulk'] / results['per-row ORM']:.1f}x ({engine.dialect.name})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sales data ingestion paths.")
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_ingestion.db')}"
+    run(args.rows, os.getenv("BENCH_DATABASE_URL", default_url))
@@ -0,0 +1,115 @@
+# backend/benchmarks/bench_kpis.py
+"""
+Query count and latency of get_all_kpis: the old six-statement version (four COUNTs
+plus two GROUP BYs), the single-scan conditional aggregates and combined top-N over raw
+rows, and the per-day KPI rollups that get_all_kpis now reads for workflow tables.
+
+Run from the backend/ folder:
+    python -m benchmarks.bench_kpis --rows 3000000
+Set BENCH_DATABASE_URL to benchmark PostgreSQL (GROUPING SETS path); defaults to a temp SQLite file.
+The synthetic table is kept between runs (use --reload to rebuild it).
+"""
+import argparse
+import os
+import tempfile
+import time
+from sqlalchemy import event, inspect
+from sqlmodel import Session, create_engine, select, func
+
+from analytics.kpi_calculator import get_all_kpis, calculate_delivery_kpis, calculate_top_n_kpis
+from benchmarks.bench_ingestion import make_sales_frame
+from models.sales_data_model import get_sales_data_model
+from services.ingestion import ingest_data_frame
+from services.kpi_rollups import ensure_rollup_table, rebuild_rollups
+
+BENCH_WORKFLOW_ID = 900100
+LOAD_CHUNK_ROWS = 500000
+
+
+def legacy_get_all_kpis(session: Session, model_class):
+    """The original implementation: one statement per number/ranking."""
+    total = session.exec(select(func.count(model_class.id))).one()
+    on_time = session.exec(select(func.count(model_class.id)).where(model_class.on_time == 1)).one()
+    in_full = session.exec(select(func.count(model_class.id)).where(model_class.in_full == 1)).one()
+    otif = session.exec(select(func.count(model_class.id)).where(
+        (model_class.on_time == 1) & (model_class.in_full == 1))).one()
+    products = session.exec(
+        select(model_class.product_id, func.sum(model_class.order_qty))
+        .group_by(model_class.product_id).order_by(func.sum(model_class.order_qty).desc()).limit(3)
+    ).all()
+    customers = session.exec(
+        select(model_class.customer_id, func.count(model_class.order_id))
+        .group_by(model_class.customer_id).order_by(func.count(model_class.order_id).desc()).limit(3)
+    ).all()
+    return total, on_time, in_full, otif, products, customers
+
+
+def raw_get_all_kpis(session: Session, model_class):
+    """Single-scan aggregates straight from the raw table (no rollups)."""
+    return calculate_delivery_kpis(session, model_class), calculate_top_n_kpis(session, model_class)
+
+
+def load(engine, model_class, rows: int):
+    model_class.__table__.drop(engine, checkfirst=True)
+    model_class.__table__.create(engine)
+    with Session(engine) as session:
+        for start in range(0, rows, LOAD_CHUNK_ROWS):
+            chunk = make_sales_frame(min(LOAD_CHUNK_ROWS, rows - start), seed=start)
+            chunk['order_id'] = [f"ORD{start + i:09d}" for i in range(len(chunk))]
+            ingest_data_frame(chunk, session, 1, model_class)
+            print(f"loaded {start + len(chunk):,} rows", end="\r")
+    print()
+
+
+def measure(engine, func_, model_class, repeat: int):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    timings = []
+    try:
+        for _ in range(repeat):
+            with Session(engine) as session:
+                start = time.perf_counter()
+                func_(session, model_class)
+                timings.append(time.perf_counter() - start)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return len(statements) // repeat, min(timings)
+
+
+def run(rows: int, database_url: str, repeat: int, reload: bool):
+    engine = create_engine(database_url)
+    model_class = get_sales_data_model(BENCH_WORKFLOW_ID)
+    existing = 0
+    if inspect(engine).has_table(model_class.__tablename__):
+        with Session(engine) as session:
+            existing = session.exec(select(func.count(model_class.id))).one()
+    if reload or existing != rows:
+        load(engine, model_class, rows)
+    else:
+        # Tables kept from before rollups existed
+        ensure_rollup_table(engine)
+        with Session(engine) as session:
+            rebuild_rollups(session, BENCH_WORKFLOW_ID)
+
+    old_queries, old_time = measure(engine, legacy_get_all_kpis, model_class, repeat)
+    new_queries, new_time = measure(engine, raw_get_all_kpis, model_class, repeat)
+    rollup_queries, rollup_time = measure(engine, get_all_kpis, model_class, repeat)
+    print(f"{rows:,} rows ({engine.dialect.name})")
+    print(f"  legacy : {old_queries} statements, {old_time:.3f}s")
+    print(f"  single : {new_queries} statements, {new_time:.3f}s  ({old_time / new_time:.1f}x faster)")
+    print(f"  rollup : {rollup_queries} statements, {rollup_time:.3f}s  ({old_time / rollup_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark KPI aggregation queries.")
+    parser.add_argument("--rows", type=int, default=3000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--reload", action="store_true")
+    args = parser.parse_args()
+
+    default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_kpis.db')}"
+    run(args.rows, os.getenv("BENCH_DATABASE_URL", default_url), args.repeat, args.reload)
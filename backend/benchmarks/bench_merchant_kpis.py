@@ -0,0 +1,105 @@
+# backend/benchmarks/bench_merchant_kpis.py
+"""
+Merchant-wide ("all workflows") insights for a merchant with many workflow tables:
+  per-workflow : get_all_kpis-style queries on every raw table (2 statements per workflow,
+                 rankings would still have to be merged in Python)
+  union all    : one UNION ALL of every raw table, aggregated in 2 statements
+  rollups      : get_merchant_kpis, the merged per-day rollups (2 statements)
+
+Run from the backend/ folder:
+    python -m benchmarks.bench_merchant_kpis --workflows 120 --rows 20000
+Set BENCH_DATABASE_URL to benchmark PostgreSQL; defaults to a temp SQLite file.
+The synthetic tables are kept between runs (use --reload to rebuild them).
+"""
+import argparse
+import os
+import tempfile
+from sqlalchemy import case, inspect, literal, union_all
+from sqlmodel import Session, create_engine, select, func
+
+from analytics.kpi_calculator import get_merchant_kpis, calculate_delivery_kpis, calculate_top_n_kpis, TOP_N
+from benchmarks.bench_ingestion import make_sales_frame
+from benchmarks.bench_kpis import measure
+from models.sales_data_model import get_sales_data_model
+from services.ingestion import ingest_data_frame
+from services.kpi_rollups import ensure_rollup_table
+
+BENCH_FIRST_WORKFLOW_ID = 910000
+
+
+# One model class per table: redefining a dynamic model re-registers its indexes
+_MODELS = {}
+
+
+def sales_model(workflow_id: int):
+    if workflow_id not in _MODELS:
+        _MODELS[workflow_id] = get_sales_data_model(workflow_id)
+    return _MODELS[workflow_id]
+
+
+def per_workflow_kpis(session: Session, workflow_ids):
+    for workflow_id in workflow_ids:
+        model_class = sales_model(workflow_id)
+        calculate_delivery_kpis(session, model_class)
+        calculate_top_n_kpis(session, model_class)
+
+
+def union_all_kpis(session: Session, workflow_ids):
+    rows = union_all(*[
+        select(m.on_time, m.in_full, m.order_qty, m.product_id, m.customer_id)
+        for m in (sales_model(workflow_id) for workflow_id in workflow_ids)
+    ]).subquery()
+    session.exec(select(
+        func.count(),
+        func.sum(case((rows.c.on_time == 1, 1), else_=0)),
+        func.sum(case((rows.c.in_full == 1, 1), else_=0)),
+        func.sum(case(((rows.c.on_time == 1) & (rows.c.in_full == 1), 1), else_=0)),
+    )).one()
+    products = select(literal("product"), rows.c.product_id, func.sum(rows.c.order_qty)).group_by(
+        rows.c.product_id).order_by(func.sum(rows.c.order_qty).desc()).limit(TOP_N).subquery()
+    customers = select(literal("customer"), rows.c.customer_id, func.count()).group_by(
+        rows.c.customer_id).order_by(func.count().desc()).limit(TOP_N).subquery()
+    session.exec(union_all(select(products), select(customers))).all()
+
+
+def load(engine, workflow_ids, rows: int):
+    ensure_rollup_table(engine)
+    with Session(engine) as session:
+        for position, workflow_id in enumerate(workflow_ids):
+            model_class = sales_model(workflow_id)
+            model_class.__table__.drop(engine, checkfirst=True)
+            model_class.__table__.create(engine)
+            chunk = make_sales_frame(rows, seed=position)
+            ingest_data_frame(chunk, session, 1, model_class)
+            print(f"loaded {position + 1}/{len(workflow_ids)} workflows", end="\r")
+    print()
+
+
+def run(workflows: int, rows: int, database_url: str, repeat: int, reload: bool):
+    engine = create_engine(database_url)
+    workflow_ids = list(range(BENCH_FIRST_WORKFLOW_ID, BENCH_FIRST_WORKFLOW_ID + workflows))
+    last_table = sales_model(workflow_ids[-1]).__tablename__
+    if reload or not inspect(engine).has_table(last_table):
+        load(engine, workflow_ids, rows)
+
+    results = [(label, *measure(engine, func_, workflow_ids, repeat)) for label, func_ in [
+        ("per-workflow", per_workflow_kpis),
+        ("union all", union_all_kpis),
+        ("rollups", get_merchant_kpis),
+    ]]
+    baseline = results[0][2]
+    print(f"{workflows} workflows x {rows:,} rows ({engine.dialect.name})")
+    for label, statements, seconds in results:
+        print(f"  {label:>12} : {statements} statements, {seconds:.3f}s  ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark merchant-wide KPI aggregation.")
+    parser.add_argument("--workflows", type=int, default=120)
+    parser.add_argument("--rows", type=int, default=20000, help="Rows per workflow table.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--reload", action="store_true")
+    args = parser.parse_args()
+
+    default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_merchant_kpis.db')}"
+    run(args.workflows, args.rows, os.getenv("BENCH_DATABASE_URL", default_url), args.repeat, args.reload)
@@ -0,0 +1,71 @@
+# backend/benchmarks/bench_reconcile.py
+"""
+Cost of keeping workflow jobs in sync: the old job_manager pass (remove + add every
+job) versus the diff-based reconcile in services/job_reconciler.py, both against a
+SQLAlchemyJobStore.
+
+Run from the backend/ folder:
+    python -m benchmarks.bench_reconcile --workflows 2000 --changed 20
+Set BENCH_DATABASE_URL to use PostgreSQL for the job store; defaults to a temp SQLite file.
+"""
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from services.job_reconciler import reconcile_workflow_jobs, workflow_job_id
+
+
+def noop_check(workflow_id: int, merchant_id: int = None):
+    """Stand-in for main.scheduled_workflow_check (jobs never fire during the benchmark)."""
+
+
+def make_workflows(count: int):
+    return [SimpleNamespace(id=i, user_id=i % 50, name=f"wf {i}", recheck_interval_minutes=60,
+                            is_active=True, source_type="gmail") for i in range(1, count + 1)]
+
+
+def legacy_pass(scheduler, workflows):
+    """What job_manager did before: unconditional remove + add for every workflow."""
+    for workflow in workflows:
+        job_id = workflow_job_id(workflow)
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+        scheduler.add_job(noop_check, 'interval', minutes=workflow.recheck_interval_minutes, id=job_id,
+                          name=workflow.name, kwargs={'workflow_id': workflow.id, 'merchant_id': workflow.user_id})
+
+
+def run(count: int, changed: int, database_url: str):
+    scheduler = BackgroundScheduler(jobstores={'default': SQLAlchemyJobStore(url=database_url, tablename='bench_jobs')})
+    scheduler.start(paused=True)
+    scheduler.remove_all_jobs()
+    workflows = make_workflows(count)
+
+    legacy_pass(scheduler, workflows)
+    start = time.perf_counter()
+    legacy_pass(scheduler, workflows)
+    legacy_seconds = time.perf_counter() - start
+
+    for workflow in workflows[:changed]:
+        workflow.recheck_interval_minutes = 30
+    result = reconcile_workflow_jobs(scheduler, noop_check, workflows, lambda w: True)
+
+    print(f"legacy full rebuild: {count * 2} job-store writes, {legacy_seconds:.2f}s, every next_run_time reset")
+    print(f"diff reconcile     : {result.writes} job-store writes, {result.seconds:.2f}s "
+          f"({result.unchanged} jobs untouched)")
+    scheduler.remove_all_jobs()
+    scheduler.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark scheduler job reconciliation.")
+    parser.add_argument("--workflows", type=int, default=2000)
+    parser.add_argument("--changed", type=int, default=20)
+    args = parser.parse_args()
+
+    default_url = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_reconcile.db')}"
+    run(args.workflows, args.changed, os.getenv("BENCH_DATABASE_URL", default_url))
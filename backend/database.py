@@ -1,5 +1,6 @@
 # backend/database.py
 import os
+from sqlalchemy import inspect, text
 from sqlmodel import create_engine, Session, SQLModel
 from dotenv import load_dotenv
 
@@ -7,13 +8,43 @@ from dotenv import load_dotenv
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# echo=True prints every SQL statement (useful for debug, very noisy during bulk ingestion)
+SQL_ECHO = os.getenv("SQL_ECHO", "true").lower() == "true"
+
 # The engine manages the connection to the DB
-engine = create_engine(DATABASE_URL, echo=True) # echo=True prints SQL queries (useful for debug)
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO)
+
+# Columns added to tables that already existed: create_all() never alters an existing table, so
+# ensure_columns() adds them to older databases. (table, column, SQL default or None for NULL)
+ADDED_COLUMNS = [
+    ("workflow", "source_type", "'gmail'"),
+    ("workflow", "source_config", None),
+    ("workflow", "data_version", "0"),
+    ("workflowlog", "rows_rejected", "0"),
+    ("workflowlog", "validation_report", None),
+]
 
 def create_db_and_tables():
     """Creates all tables defined in models/"""
     # This function looks at all classes that inherit from SQLModel and creates them in the DB
     SQLModel.metadata.create_all(engine)
+    ensure_columns()
+
+def ensure_columns():
+    """Adds any ADDED_COLUMNS missing from existing tables. Safe to run on every startup."""
+    inspector = inspect(engine)
+    if_not_exists = "IF NOT EXISTS " if engine.dialect.name == "postgresql" else ""
+    with engine.begin() as connection:
+        for table_name, column_name, default in ADDED_COLUMNS:
+            if column_name in {column["name"] for column in inspector.get_columns(table_name)}:
+                continue
+            column = SQLModel.metadata.tables[table_name].c[column_name]
+            ddl = (f"ALTER TABLE {table_name} ADD COLUMN {if_not_exists}{column_name} "
+                   f"{column.type.compile(dialect=engine.dialect)}")
+            if default is not None:
+                ddl += f" DEFAULT {default} NOT NULL"
+            print(f"Adding column {table_name}.{column_name}")
+            connection.execute(text(ddl))
 
 def get_session():
     """Dependency to get a database session"""
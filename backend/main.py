@@ -10,6 +10,7 @@ from datetime import datetime, date
 from apscheduler.schedulers.asyncio import AsyncIOScheduler 
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore 
 from apscheduler.jobstores.base import JobLookupError 
+from apscheduler.executors.pool import ThreadPoolExecutor as APSThreadPoolExecutor
 import os
 from dotenv import load_dotenv
 import json # <-- CRITICAL: Must be imported
@@ -23,20 +24,44 @@ from database import create_db_and_tables, get_session
 from models.user_model import User, UserCreate, UserLogin, Token 
 from models.sales_data_model import SalesData 
 from services.auth_utils import create_access_token, verify_password, get_password_hash, get_current_active_user  
-from services.gmail_monitor import find_and_download_attachment, TOKEN_FILE_PATH
-from services.data_processor import process_attachment_data
-from services.ingestion import ingest_data_frame
+from services.gmail_monitor import TOKEN_FILE_PATH
+from services.attachment_sources import get_attachment_source, SOURCE_GMAIL
+from services.etl_pipeline import ingest_attachment, attachment_content_hash, find_processed_attachment, record_processed_attachment
+from services.workflow_runner import build_search_query
+from services.mailbox_sync import MailboxSync, GmailMailBackend
+from services.job_dispatcher import etl_dispatcher
+from services.run_queue import (
+    enqueue_run, start_manual_run, complete_run, fail_run, process_run, requeue_stale_runs, due_runs,
+    RUN_KIND_CHECK, RUN_KIND_MESSAGE, RUN_KIND_MANUAL, RUN_QUEUED, RUN_DEAD, RUN_QUEUE_POLL_SECONDS,
+)
+from models.run_model import EtlRun
+from models.lease_model import SchedulerLease # Registers the table for create_all
+from services.leader_election import LeaseLeaderElector
+from services.job_reconciler import reconcile_workflow_jobs, sync_workflow_job, describe as describe_reconcile
+from services.metrics import metrics
+from services.cache import ResponseCache, shared_tier_from_env, data_version_key
+from models.mailbox_model import MailboxSyncState # Registers the table for create_all
+from models.attachment_model import ProcessedAttachment # Registers the table for create_all
+from models.rollup_model import KpiDailyRollup, KpiKeyRollup, KpiSketch # Registers the tables for create_all
+from models.analytics_model import AnalyticsDirtyMonth, AnalyticsWatermark # Registers the tables for create_all
+from services import analytics_engine
+from models.anomaly_model import KpiRunningStat, AnomalyEvent, AnomalySweep, SweepAnomaly # Registers the tables for create_all
+from services import anomaly_sweep
+from services.online_anomalies import link_anomaly_events, load_recent_anomalies
 from models.log_model import WorkflowLog
-from analytics.kpi_calculator import get_all_kpis 
-from analytics.anomaly_detector import detect_anomalies
-from services.llm_translator import generate_insight_summary, translate_natural_language_to_sql
+from analytics.kpi_calculator import get_all_kpis, get_merchant_kpis, calculate_heavy_hitters
+from analytics.kpi_trends import calculate_kpi_trend, calculate_merchant_kpi_trend
+from analytics.anomaly_detector import detect_anomalies, find_kpi_anomalies, METRICS as ANOMALY_METRICS
+from services.llm_translator import generate_insight_summary, SUMMARY_ERROR
+from services import query_cache
+from models.query_cache_model import NlQueryCacheEntry # Registers the table for create_all
 # Import the Workflow model
 from models.workflow import Workflow # ADDED
 # Import the new router
 from routers import workflows # ADDED: Assuming an empty __init__.py exists in routers/
 # Imports needed for SQL translation metadata
 from models.sales_data_model import SalesData 
-from models.sales_data_model import get_sales_data_model # NEW IMPORT
+from models.sales_data_model import get_sales_data_model, ensure_sales_table # NEW IMPORT
 from sqlmodel import inspect
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
@@ -116,80 +141,49 @@ scheduler = AsyncIOScheduler()
 # ---------------------------
 
 # NEW FUNCTION: The core scheduled task
-def scheduled_workflow_check(workflow_id: int):
-    """Checks all active workflows and triggers ETL if a new email is detected."""
+def scheduled_workflow_check(workflow_id: int, merchant_id: Optional[int] = None):
+    """Hands one workflow's check to the bounded ETL pool (the run itself is in services/workflow_runner.py)."""
+    # This name stays because stored jobs reference it. The run is recorded in the durable
+    # queue first, so a crash or a failed attempt is retried instead of lost.
     with next(get_session()) as session:
-        # 1. Fetch workflow and dynamic model
-       workflow = session.get(Workflow, workflow_id) # <<< FIX: Uses passed ID
-    if not workflow or not workflow.is_active:
-            print(f"SCHEDULER: Job failed. Workflow ID {workflow_id} not found or inactive.")
+        workflow = session.get(Workflow, workflow_id)
+        if workflow is None:
+            print(f"SCHEDULER: Workflow ID {workflow_id} no longer exists. Nothing to enqueue.")
             return
+        run = enqueue_run(session, workflow_id, workflow.user_id, kind=RUN_KIND_CHECK)
+        dispatch_run(run)
 
-    SalesDataModel = get_sales_data_model(workflow_id) 
-        
-        # CRITICAL: Ensure the table exists before use (Multitenancy safety)
-    SalesDataModel.metadata.create_all(session.get_bind())
-        
-    print(f"SCHEDULER: Checking workflow ID {workflow_id}: {workflow.name}")
-            # --- Build Search Query ---
-    search_query = f"subject:{workflow.trigger_subject}"
-    if workflow.trigger_sender:
-                search_query += f" from:{workflow.trigger_sender}"
-            
-            # --- Find New Attachment ---
-            # NOTE: We now expect 3 return values
-    raw_data, file_name, message_id = find_and_download_attachment(search_query=search_query)
+# Whether this process executes queued runs itself. Set to false when separate
+# `python -m services.run_queue` workers drain the queue; the scheduler then only enqueues.
+RUN_QUEUE_LOCAL_WORKERS = os.getenv("RUN_QUEUE_LOCAL_WORKERS", "true").lower() == "true"
 
-    if raw_data is None or message_id is None:
-        # Log INFO if no new email found, and RETURN
-        new_log = WorkflowLog(
-            merchant_id=workflow.user_id, 
-            status="INFO",
-            workflow_id=workflow.id,
-            message=f"No email found matching '{search_query}'. Skipping."
-        )
-        session.add(new_log)
-        session.commit()
-        return# Skip to next workflow  # noqa: F702
+def dispatch_run(run: EtlRun):
+    """Hands a queued run to the local bounded pool; the worker claims it atomically before running."""
+    if RUN_QUEUE_LOCAL_WORKERS:
+        etl_dispatcher.submit(run.merchant_id, f"run_{run.id}", process_run, run.id)
 
-            # --- IDEMPOTENCY CHECK ---
-    if workflow.last_processed_email_id == message_id:
-        print(f"SCHEDULER: Workflow {workflow.id} skipped. Email already processed.")
-        return # Skip to next workflow
-            
-            # --- ETL Logic (Same as manual trigger) ---
-    df = process_attachment_data(raw_data, file_name)
-    if df is None or df.empty:
-                 # Log FAILURE and continue
-                 print(f"SCHEDULER: ERROR - Data processing failed for workflow {workflow.id}.")
-                 return
-                 
-    rows_inserted = ingest_data_frame(df, session, workflow.user_id, SalesDataModel) 
-            
-            # --- Update Log and Workflow Status/ID ---
-    new_log = WorkflowLog(
-                merchant_id=workflow.user_id, 
-                status="SUCCESS",
-                workflow_id=workflow.id,
-                source_filename=file_name,
-                rows_inserted=rows_inserted,
-                message=f"Ingestion successful. Processed {df.shape[0]} rows."
-            )
-    session.add(new_log)
-            
-            # UPDATE WORKFLOW STATE
-    workflow.last_run_status = "AUTO-SUCCESS"
-    workflow.last_run_timestamp = datetime.utcnow()
-    workflow.last_processed_email_id = message_id # <<< CRUCIAL IDEMPOTENCY UPDATE
-    session.add(workflow)
-    session.commit()
-    print(f"SCHEDULER: Workflow {workflow.id} SUCCESS: {rows_inserted} rows inserted.")
+def run_queue_pump():
+    """Re-queues runs of crashed workers and dispatches due runs (retries after backoff, runs left by a restart)."""
+    with next(get_session()) as session:
+        requeue_stale_runs(session)
+        for run in due_runs(session):
+            dispatch_run(run)
 
 # Job store setup using your PostgreSQL database
 jobstores = {
     'default': SQLAlchemyJobStore(url=os.getenv("DATABASE_URL"))
 }
-scheduler = AsyncIOScheduler(jobstores=jobstores)
+# Scheduler jobs only dispatch (or do light bookkeeping) on these threads, never on the event loop;
+# the ETL work itself runs on etl_dispatcher's pool with global and per-merchant caps.
+executors = {
+    'default': APSThreadPoolExecutor(int(os.getenv("SCHEDULER_THREADS", "10")))
+}
+job_defaults = {
+    'coalesce': True, # several missed intervals collapse into one run
+    'max_instances': 1,
+    'misfire_grace_time': int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS", "300")),
+}
+scheduler = AsyncIOScheduler(jobstores=jobstores, executors=executors, job_defaults=job_defaults)
 
 # Core ETL logic (Now called by the scheduler for a SINGLE workflow)
 def run_etl_for_workflow(workflow_id: int):
@@ -208,46 +202,80 @@ def run_etl_for_workflow(workflow_id: int):
         # ... Log success, Update workflow.last_processed_email_id, session.commit() ...
 
 # NEW HELPER: Job creation/update logic
+def workflow_needs_polling(workflow: Workflow) -> bool:
+    """Active, with a valid interval, and not already covered by the shared mailbox sync."""
+    if not workflow.is_active or workflow.recheck_interval_minutes < 1:
+        return False
+    return not (MAILBOX_SYNC_ENABLED and workflow.source_type == SOURCE_GMAIL)
+
 def create_dynamic_job(workflow: Workflow):
-    """Adds or updates a job for a single workflow based on its interval."""
-    # Job ID must be unique (use f"wf_{user_id}_{workflow_id}")
-    job_id = f"wf_{workflow.user_id}_{workflow.id}"
+    """Adds, updates or removes the job of a single workflow, writing only if something changed."""
+    result = sync_workflow_job(scheduler, scheduled_workflow_check, workflow, workflow_needs_polling(workflow))
+    summary = describe_reconcile(result)
+    if summary:
+        print(f"SCHEDULER: Workflow {workflow.id} job: {summary}")
+
+def remove_dynamic_job(workflow: Workflow):
+    """Drops a workflow's job (e.g. when the workflow is deleted)."""
+    sync_workflow_job(scheduler, scheduled_workflow_check, workflow, polling=False)
     
-    # If interval is 0 or less, skip/remove job
-    if workflow.recheck_interval_minutes < 1:
-        try:
-            scheduler.remove_job(job_id)
-            print(f"SCHEDULER: Removed job {job_id}. Interval is invalid.")
-        except JobLookupError:
-            pass # Job didn't exist anyway
-        return
+# --- SHARED MAILBOX SYNC ---
+# One historyId-based sync for the whole mailbox instead of one search per workflow per interval
+MAILBOX_SYNC_ENABLED = os.getenv("MAILBOX_SYNC_ENABLED", "false").lower() == "true"
+MAILBOX_SYNC_INTERVAL_SECONDS = int(os.getenv("MAILBOX_SYNC_INTERVAL_SECONDS", "60"))
+mailbox_sync = MailboxSync(GmailMailBackend())
+
+def process_workflow_message(workflow_id: int, message_id: str, merchant_id: Optional[int] = None):
+    """One-off job: ETL for a message that mailbox sync matched to a workflow."""
+    with next(get_session()) as session:
+        workflow = session.get(Workflow, workflow_id)
+        if workflow is None:
+            return
+        run = enqueue_run(session, workflow_id, workflow.user_id, kind=RUN_KIND_MESSAGE, message_id=message_id)
+        dispatch_run(run)
 
-    try:
-        # Try to remove any existing job with this ID first
-        scheduler.remove_job(job_id)
-    except JobLookupError:
-        pass
-        
-    # Add the new job
+def enqueue_workflow_message(workflow: Workflow, message):
+    """Schedules an immediate ETL run for a (workflow, message) match."""
     scheduler.add_job(
-        scheduled_workflow_check, # The existing function that checks one workflow's email
-        'interval', 
-        minutes=workflow.recheck_interval_minutes, 
-        id=job_id,
-        name=workflow.name,
-        # Pass the specific workflow ID as an argument
-        kwargs={'workflow_id': workflow.id}
+        process_workflow_message,
+        id=f"msg_{workflow.id}_{message.message_id}",
+        name=f"{workflow.name} <- {message.message_id}",
+        kwargs={'workflow_id': workflow.id, 'message_id': message.message_id, 'merchant_id': workflow.user_id},
+        replace_existing=True,
+        misfire_grace_time=None, # run even if the scheduler was down when it was due
     )
-    print(f"SCHEDULER: Scheduled job {job_id} for every {workflow.recheck_interval_minutes} minutes.")
-    
+
+def enqueue_workflow_catch_up(workflow: Workflow):
+    """Queues a check run, whose search picks up the mail the sync's new baseline skipped."""
+    with next(get_session()) as session:
+        run = enqueue_run(session, workflow.id, workflow.user_id, kind=RUN_KIND_CHECK)
+    dispatch_run(run)
+
+def mailbox_sync_job():
+    """Pulls new mail since the last historyId and enqueues ETL runs for matching workflows."""
+    with next(get_session()) as session:
+        mailbox_sync.sync(session, on_match=enqueue_workflow_message, on_gap=enqueue_workflow_catch_up)
+
+def analytics_sync_job():
+    """Exports changed months to the Parquet analytics mirror so queries rarely have to sync inline."""
+    with next(get_session()) as session:
+        workflow_ids = session.exec(select(Workflow.id)).all()
+        analytics_engine.ensure_fresh(session, workflow_ids)
+
+def anomaly_sweep_job():
+    """Scores every workflow's KPI series in one sharded pass and stores the alert candidates."""
+    with next(get_session()) as session:
+        anomaly_sweep.run_sweep(session, os.getenv("DATABASE_URL"))
+
 # NOTE: The faulty manage_workflow_jobs function has been permanently removed here.
                     
 def job_manager():
-    """Runs periodically to update/create jobs for all active workflows."""
+    """Safety net: reconciles all workflow jobs with the Workflow table (router changes apply immediately)."""
     with next(get_session()) as session:
         active_workflows = session.exec(select(Workflow).where(Workflow.is_active == True)).all()
-        for workflow in active_workflows:
-            create_dynamic_job(workflow)               
+        result = reconcile_workflow_jobs(scheduler, scheduled_workflow_check, active_workflows, workflow_needs_polling)
+        print(f"SCHEDULER: Reconciled {len(active_workflows)} workflows: "
+              f"{describe_reconcile(result) or f'no changes ({result.seconds * 1000:.1f} ms)'}")               
             
 def to_primitive_dict(sqlmodel_object: Any) -> Dict[str, Any]:
     """Converts a SQLModel ORM object to a clean dictionary of primitives,
@@ -267,27 +295,108 @@ def to_primitive_dict(sqlmodel_object: Any) -> Dict[str, Any]:
             
     return primitive_data                 
             
+# --- SINGLE-INSTANCE SCHEDULER ---
+# Every process starts the scheduler paused; only the holder of the 'scheduler' lease resumes it.
+# RUN_SCHEDULER=false keeps a process out of the election entirely (pure API worker, see scheduler_main.py);
+# its scheduler stays paused and is only used to write workflow job changes to the job store.
+RUN_SCHEDULER = os.getenv("RUN_SCHEDULER", "true").lower() == "true"
+
+def on_elected():
+    """This process became the scheduler leader: register the housekeeping jobs and start firing."""
+    register_scheduler_jobs()
+    scheduler.resume()
+
+def on_demoted():
+    """Lease lost (or shutting down): stop firing jobs; runs already dispatched finish normally."""
+    if scheduler.running:
+        scheduler.pause()
+    print("SCHEDULER: Paused (scheduler lease lost or released).")
+
+scheduler_leader = LeaseLeaderElector("scheduler", on_elected=on_elected, on_demoted=on_demoted)
+
+def start_scheduler():
+    """Starts the (paused) scheduler in this event loop and joins the leader election."""
+    scheduler.start(paused=True)
+    scheduler_leader.start()
+
+def stop_scheduler():
+    scheduler_leader.stop()
+    if scheduler.running:
+        scheduler.shutdown()
+        print("SCHEDULER: Shutdown complete.")
+    etl_dispatcher.shutdown(wait=False)
+
 @app.on_event("startup")
 def on_startup():
-    """Creates database tables and starts the scheduler."""
+    """Creates database tables and starts the scheduler (if this process wins the election)."""
     create_db_and_tables()
+    warm_query_cache()
     
-    scheduler.start()
-    
+    if RUN_SCHEDULER:
+        start_scheduler()
+    else:
+        # Never fires jobs, but a started (paused) scheduler writes workflow job changes from the
+        # routers straight to the shared job store; a stopped one would only queue them in memory
+        scheduler.start(paused=True)
+        print("SCHEDULER: Disabled in this process (RUN_SCHEDULER=false). Workflow job changes go to the job store.")
+
+def warm_query_cache():
+    """Loads the most used stored NL -> SQL translations into this process's cache."""
+    try:
+        with next(get_session()) as session:
+            loaded = query_cache.warm_local(session, get_sales_schema_for_llm())
+        print(f"QUERY CACHE: {loaded} stored translation(s) loaded.")
+    except Exception as e:
+        print(f"QUERY CACHE: Warm-up skipped: {e}")
+
+def register_scheduler_jobs():
+    """Housekeeping jobs; only the leader adds them (replace_existing keeps this idempotent)."""
     # Start the manager job that runs less frequently to check for new workflows
     scheduler.add_job(job_manager, 'interval', minutes=5, id='workflow_manager', replace_existing=True)
     print("SCHEDULER: Manager job started, running every 5 minutes to manage individual workflow jobs.")
+
+    scheduler.add_job(run_queue_pump, 'interval', seconds=RUN_QUEUE_POLL_SECONDS, id='run_queue_pump', replace_existing=True)
+
+    if MAILBOX_SYNC_ENABLED:
+        scheduler.add_job(mailbox_sync_job, 'interval', seconds=MAILBOX_SYNC_INTERVAL_SECONDS,
+                          id='mailbox_sync', replace_existing=True, max_instances=1, coalesce=True)
+        print(f"SCHEDULER: Mailbox sync started, running every {MAILBOX_SYNC_INTERVAL_SECONDS} seconds.")
+    else:
+        try:
+            scheduler.remove_job('mailbox_sync')
+        except JobLookupError:
+            pass
+
+    if analytics_engine.analytics_enabled():
+        scheduler.add_job(analytics_sync_job, 'interval', seconds=analytics_engine.ANALYTICS_SYNC_INTERVAL_SECONDS,
+                          id='analytics_sync', replace_existing=True, max_instances=1, coalesce=True)
+        print(f"SCHEDULER: Analytics sync started, running every {analytics_engine.ANALYTICS_SYNC_INTERVAL_SECONDS} seconds.")
+    else:
+        try:
+            scheduler.remove_job('analytics_sync')
+        except JobLookupError:
+            pass
+
+    if anomaly_sweep.ANOMALY_SWEEP_ENABLED:
+        scheduler.add_job(anomaly_sweep_job, 'interval', minutes=anomaly_sweep.ANOMALY_SWEEP_INTERVAL_MINUTES,
+                          id='anomaly_sweep', replace_existing=True, max_instances=1, coalesce=True)
+        print(f"SCHEDULER: Anomaly sweep started, running every {anomaly_sweep.ANOMALY_SWEEP_INTERVAL_MINUTES} minutes.")
+    else:
+        try:
+            scheduler.remove_job('anomaly_sweep')
+        except JobLookupError:
+            pass
     
 @app.on_event("shutdown")
 def on_shutdown():
-    """Stops the scheduler when the application shuts down."""
-    if scheduler.running:
-        scheduler.shutdown()
-        print("SCHEDULER: Shutdown complete.")
+    """Stops the scheduler when the application shuts down (and hands the lease over)."""
+    stop_scheduler()
                   
+# Plain def (not async): FastAPI runs it in its threadpool, so the blocking ETL stays off the event loop
 @app.post("/api/v1/trigger-workflow/{workflow_id}") # MODIFIED PATH
-async def trigger_data_ingestion(
+def trigger_data_ingestion(
     workflow_id: int, # ADDED
+    force: bool = False, # Re-ingest even if this email/file was already processed
     current_user: User = Depends(get_current_active_user), 
     session: Session = Depends(get_session) 
 ):
@@ -306,17 +415,40 @@ async def trigger_data_ingestion(
             detail="Workflow not found or access denied."
         )
 
-    # 2. Use workflow filters for Gmail search
-    search_query = f"subject:{workflow.trigger_subject}"
-    if workflow.trigger_sender:
-        search_query += f" from:{workflow.trigger_sender}"
-        
-    #
-    raw_data, file_name, _ = find_and_download_attachment(search_query=search_query) # <<< FIXED UNPACKING
+    # 1.1 Record the run in the durable run queue as already running: manual runs execute inline
+    # (one attempt, the caller sees the error) but show up next to scheduled runs in /api/v1/runs
+    run = start_manual_run(session, workflow.id, current_user.id, worker_id="api")
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="A run of this workflow is already in progress. Try again when it finishes.")
+    try:
+        result = run_manual_ingestion(workflow, force, current_user, session)
+    except Exception as error:
+        fail_run(session, run, error.detail if isinstance(error, HTTPException) else repr(error))
+        raise
+    complete_run(session, run, messages_seen=1 if result["status"] == "success" else 0)
+    result["run_id"] = run.id
+    return result
+
+def run_manual_ingestion(workflow: Workflow, force: bool, current_user: User, session: Session) -> Dict[str, Any]:
+    """Body of the manual trigger: newest message from the workflow's source -> parse/validate/load."""
+    # 2. Use workflow filters (Gmail search) or the workflow's configured attachment source
+    search_query = build_search_query(workflow)
+    try:
+        source = get_attachment_source(workflow)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    fetched = source.fetch_latest(workflow)
+    if fetched is not None and fetched.error and workflow.source_type != SOURCE_GMAIL:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=fetched.error)
+    raw_data, file_name, message_id = None, None, None
+    if fetched is not None and fetched.attachments:
+        (raw_data, file_name), message_id = fetched.attachments[0], fetched.message_id
 
     if raw_data is None:
         # Check for service failure (same logic as before)
-        if not os.path.exists(TOKEN_FILE_PATH): 
+        if workflow.source_type == SOURCE_GMAIL and not os.path.exists(TOKEN_FILE_PATH): 
              raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Gmail Service failed to authenticate. Run Gmail Monitor script manually or check 'credentials.json' existence and path."
@@ -337,46 +469,128 @@ async def trigger_data_ingestion(
         session.commit()
         return {"status": "info", "message": f"Workflow '{workflow.name}' skipped. No new email."}
 
-    # 3. Process/Extract Data into DataFrame
-    df = process_attachment_data(raw_data, file_name)
+    # 2.1 Idempotency: same email, or an identical file in a new email, is skipped unless forced
+    content_hash = attachment_content_hash(raw_data)
+    if not force:
+        duplicate_reason = None
+        if message_id and workflow.last_processed_email_id == message_id:
+            duplicate_reason = "Email already processed"
+        elif find_processed_attachment(session, workflow.id, content_hash):
+            duplicate_reason = f"Attachment '{file_name}' is identical to one already ingested"
+        if duplicate_reason:
+            session.add(WorkflowLog(
+                merchant_id=current_user.id,
+                status="INFO",
+                workflow_id=workflow.id,
+                source_filename=file_name,
+                message=f"{duplicate_reason}. Skipping ingestion."
+            ))
+            workflow.last_run_status = "INFO: Duplicate"
+            workflow.last_run_timestamp = datetime.utcnow()
+            session.add(workflow)
+            session.commit()
+            return {"status": "info", "message": f"Workflow '{workflow.name}' skipped. {duplicate_reason}."}
+
+    # 3. Get the specific SalesData Model for this workflow ID
+    SalesDataModel = get_sales_data_model(workflow_id)
+    # Ensure table (and its order-line unique key) exists before we try to insert into it
+    ensure_sales_table(SalesDataModel, session.get_bind())
+
+    # 4. Parse, Validate (vectorized) and Ingest (Load) only the accepted rows.
+    # Large attachments are streamed and committed chunk by chunk.
+    summary = ingest_attachment(session, current_user.id, SalesDataModel, raw_data, file_name)
 
-    if df is None or df.empty: #
+    if summary is None or summary.rows_processed == 0: #
         # Handle logging for failure if needed...
         raise HTTPException(status_code=400, detail="Data processing failed or attachment was empty.")
-        raise HTTPException(status_code=501, detail="Manual trigger disabled. Use scheduler or implement full idempotency logic here.")
 
-    # NEW: 3.1 Get the specific SalesData Model for this workflow ID
-    SalesDataModel = get_sales_data_model(workflow_id)
-    # Ensure table exists before we try to insert into it
-    SalesDataModel.metadata.create_all(session.get_bind())
-    
-    # 4. Ingestion (Load)
-    rows_inserted = ingest_data_frame(df, session, current_user.id, SalesDataModel) 
+    rows_inserted = summary.rows_inserted
     # 5. Log Success to History and Update Workflow Status
     new_log = WorkflowLog(
         merchant_id=current_user.id, 
-        status="SUCCESS",
+        status="SUCCESS" if summary.error is None else "PARTIAL",
         workflow_id=workflow.id, # Link log to workflow
         source_filename=file_name,
         rows_inserted=rows_inserted,
-        message=f"Ingestion successful. Processed {df.shape[0]} rows."
+        rows_rejected=summary.rows_rejected,
+        validation_report=summary.validation_report,
+        message=(f"Ingestion successful. Processed {summary.rows_processed} rows, rejected {summary.rows_rejected}."
+                 if summary.error is None else
+                 f"Ingestion stopped after {summary.chunks} chunk(s): {summary.error}")
     )
     session.add(new_log)
+    session.flush()
+    flagged = link_anomaly_events(session, workflow.id, new_log.id)
+    if flagged:
+        new_log.message += f" {flagged} KPI anomal{'y' if flagged == 1 else 'ies'} flagged."
     
-    # Update workflow status
-    workflow.last_run_status = "SUCCESS"
+    # Update workflow status. A file that stopped part-way leaves the email cursor where it was
+    # (as in automatic runs), so the email is picked up again
+    partial = summary.error is not None
+    workflow.last_run_status = "PARTIAL" if partial else "SUCCESS"
     workflow.last_run_timestamp = datetime.utcnow()
+    if message_id and not partial:
+        workflow.last_processed_email_id = message_id
+    if summary.error is None and not find_processed_attachment(session, workflow.id, content_hash):
+        record_processed_attachment(session, workflow.id, content_hash, file_name, message_id, rows_inserted)
     session.add(workflow) 
     session.commit() # Commit all changes (log and workflow update)
 
     # 6. Return summary
     return {
-        "status": "success",
-        "message": f"Workflow '{workflow.name}' executed. Data from {file_name} loaded.",
-        "rows_processed": df.shape[0],
-        "rows_inserted": rows_inserted
+        "status": "partial" if partial else "success",
+        "message": (f"Workflow '{workflow.name}' stopped part-way through {file_name}: {summary.error}" if partial
+                    else f"Workflow '{workflow.name}' executed. Data from {file_name} loaded."),
+        "rows_processed": summary.rows_processed,
+        "rows_inserted": rows_inserted,
+        "rows_rejected": summary.rows_rejected,
+        "rejection_counts": summary.validation_report.get("rule_counts", {})
     }
 
+# NEW ENDPOINT: Scheduler/pipeline metrics (queue wait, run time, coalesced runs, ...)
+@app.get("/api/v1/metrics")
+def get_metrics(current_user: User = Depends(get_current_active_user)):
+    """Returns this process's counters, gauges and timing summaries."""
+    return metrics.snapshot()
+
+# NEW ENDPOINT: ETL run queue (queued/running/succeeded/dead runs) for the current user
+@app.get("/api/v1/runs", response_model=List[EtlRun])
+def get_user_runs(
+    status_filter: Optional[str] = None,
+    workflow_id: Optional[int] = None,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """Lists the 50 most recent runs, optionally filtered by status or workflow."""
+    query = select(EtlRun).where(EtlRun.merchant_id == current_user.id)
+    if status_filter:
+        query = query.where(EtlRun.status == status_filter)
+    if workflow_id is not None:
+        query = query.where(EtlRun.workflow_id == workflow_id)
+    return session.exec(query.order_by(EtlRun.created_at.desc()).limit(50)).all()
+
+@app.post("/api/v1/runs/{run_id}/retry", response_model=EtlRun)
+def retry_dead_run(
+    run_id: int,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """Moves a dead-lettered run back into the queue with a fresh attempt budget."""
+    run = session.get(EtlRun, run_id)
+    if not run or run.merchant_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Run not found or access denied.")
+    if run.status != RUN_DEAD:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Run is {run.status}, not dead.")
+    if run.kind == RUN_KIND_MANUAL:
+        # Manual runs execute inline in the request; workers never pick them up
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Manual runs cannot be retried. Trigger the workflow again.")
+    run.status, run.attempts, run.available_at, run.last_error = RUN_QUEUED, 0, datetime.utcnow(), None
+    session.add(run)
+    session.commit()
+    session.refresh(run)
+    dispatch_run(run)
+    return run
+
 # NEW ENDPOINT: Get History for the current user
 @app.get("/api/v1/history", response_model=List[WorkflowLog])
 def get_user_history(
@@ -394,6 +608,22 @@ def get_user_history(
     return logs
 # backend/main.py (Add the new route below trigger_data_ingestion)
 
+# Insights payloads (KPIs + anomaly + Gemini summary) per (merchant, workflow or 'all', data version)
+INSIGHTS_CACHE_TTL_SECONDS = int(os.getenv("INSIGHTS_CACHE_TTL_SECONDS", "3600"))
+INSIGHTS_CACHE_MAX_ENTRIES = int(os.getenv("INSIGHTS_CACHE_MAX_ENTRIES", "1024"))
+INSIGHTS_ANOMALY_LIMIT = 10 # ranked anomalies included in the insights payload
+insights_cache = ResponseCache(
+    "insights", INSIGHTS_CACHE_MAX_ENTRIES, INSIGHTS_CACHE_TTL_SECONDS,
+    shared=shared_tier_from_env("insights", INSIGHTS_CACHE_TTL_SECONDS),
+)
+
+class UncachedInsights(Exception):
+    """Carries an insights payload whose AI summary failed: returned, but not cached."""
+
+    def __init__(self, payload: Dict[str, Any]):
+        super().__init__("AI summary failed")
+        self.payload = payload
+
 @app.get("/api/v1/insights")
 def get_insights(
     # NEW: Optional query parameter for workflow_id
@@ -403,31 +633,158 @@ def get_insights(
 ):
     """
     Retrieves all calculated KPIs and runs anomaly detection, optionally scoped to a single workflow.
+    Served from insights_cache until the workflow's data version changes.
     """
     # 1. Determine the correct data model to query from
     if workflow_id is not None:
         # Use the dynamic model for a specific workflow's table (e.g., sales_data_1)
         SalesDataModel = get_sales_data_model(workflow_id)
         # Optional: Ensure table exists, though it should be created on workflow creation
-        SalesDataModel.metadata.create_all(session.get_bind())
+        ensure_sales_table(SalesDataModel, session.get_bind())
+        workflow_ids = [workflow_id]
     else:
-        # Use the default model (SalesData) for aggregated data across the merchant
-        SalesDataModel = SalesData
-        
-    # 2. Calculate all KPIs, passing the determined Model Class
-    kpis = get_all_kpis(session, SalesDataModel)
+        # Merchant-wide: every workflow table of this user, through their merged KPI rollups
+        SalesDataModel = None
+        workflow_ids = session.exec(select(Workflow.id).where(Workflow.user_id == current_user.id)).all()
+
+    def compute_insights() -> Dict[str, Any]:
+        # 2. Calculate all KPIs, passing the determined Model Class
+        if SalesDataModel is not None:
+            kpis = get_all_kpis(session, SalesDataModel)
+        else:
+            kpis = get_merchant_kpis(session, workflow_ids)
+
+        # 3. Anomalies flagged at ingest time (stored, see services/online_anomalies.py) and AI Summary
+        anomaly_result = detect_anomalies(kpis, load_recent_anomalies(session, workflow_ids, limit=INSIGHTS_ANOMALY_LIMIT))
+        ai_summary = generate_insight_summary(anomaly_result)
+
+        # 4. Compile final response structure
+        payload = {
+            "status": "success",
+            "kpis": kpis,
+            "anomaly": anomaly_result,
+            "ai_summary_text": ai_summary 
+        }
+        if ai_summary == SUMMARY_ERROR:
+            # A transient LLM failure must not be served until the next ingestion
+            raise UncachedInsights(payload)
+        return payload
+
+    version = data_version_key(session, current_user.id, workflow_id)
+    cache_key = f"{current_user.id}:{workflow_id if workflow_id is not None else 'all'}:{version}"
+    try:
+        return insights_cache.get_or_compute(cache_key, compute_insights)
+    except UncachedInsights as uncached:
+        return uncached.payload
+
+# NEW ENDPOINT: KPI time series for the Insights charts
+@app.get("/api/v1/insights/trend")
+def get_insights_trend(
+    workflow_id: Optional[int] = None,
+    granularity: str = "day", # day | week | month
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    product_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """
+    On-time / in-full / OTIF rates and volumes bucketed by delivery_date, returned as
+    columnar JSON: {"buckets": [...], "otif_rate": [...], ...}, one array per metric.
+    """
+    if workflow_id is not None:
+        workflow = session.get(Workflow, workflow_id)
+        if not workflow or workflow.user_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Workflow not found or access denied.")
+        SalesDataModel = get_sales_data_model(workflow_id)
+        ensure_sales_table(SalesDataModel, session.get_bind())
+
+    try:
+        if workflow_id is not None:
+            trend = calculate_kpi_trend(session, SalesDataModel, granularity, start_date, end_date, product_id, customer_id)
+        else:
+            # Merchant-wide: merged rollups of all of this user's workflows
+            workflow_ids = session.exec(select(Workflow.id).where(Workflow.user_id == current_user.id)).all()
+            trend = calculate_merchant_kpi_trend(session, workflow_ids, granularity, start_date, end_date, product_id, customer_id)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    return {"status": "success", "workflow_id": workflow_id, **trend}
+
+# NEW ENDPOINT: Top products / customers over a month range, from the heavy-hitter sketches
+@app.get("/api/v1/insights/top")
+def get_insights_top(
+    dimension: str = "product", # product (by ordered quantity) | customer (by order count)
+    n: int = 3,
+    workflow_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    exact: bool = False,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """
+    Top-n ranking for one workflow or, without workflow_id, all of the user's workflows.
+    Sketch answers carry per-key error bounds; exact=true recomputes from the day rollups.
+    """
+    if workflow_id is not None:
+        workflow = session.get(Workflow, workflow_id)
+        if not workflow or workflow.user_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Workflow not found or access denied.")
+        workflow_ids = [workflow_id]
+    else:
+        workflow_ids = session.exec(select(Workflow.id).where(Workflow.user_id == current_user.id)).all()
+
+    try:
+        top = calculate_heavy_hitters(session, workflow_ids, dimension, n, start_date, end_date, exact)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    return {"status": "success", "workflow_id": workflow_id, **top}
+
+# NEW ENDPOINT: Ranked KPI anomalies across every daily series (totals, products, customers)
+@app.get("/api/v1/insights/anomalies")
+def get_insights_anomalies(
+    workflow_id: Optional[int] = None,
+    metric: Optional[str] = None, # otif_rate | on_time_rate | in_full_rate | order_count (default: otif_rate + order_count)
+    end_date: Optional[date] = None,
+    recent_days: int = 7,
+    limit: int = 50,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """
+    Anomalies of the recent_days up to end_date (default: the latest day with data), scored
+    against each series' own history, strongest first.
+    """
+    if metric is not None and metric not in ANOMALY_METRICS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"metric must be one of {', '.join(ANOMALY_METRICS)}")
+    if not 1 <= recent_days <= 90 or not 1 <= limit <= 500:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="recent_days must be 1-90 and limit 1-500")
+    if workflow_id is not None:
+        workflow = session.get(Workflow, workflow_id)
+        if not workflow or workflow.user_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Workflow not found or access denied.")
+        workflow_ids = [workflow_id]
+    else:
+        workflow_ids = session.exec(select(Workflow.id).where(Workflow.user_id == current_user.id)).all()
+
+    anomaly_metrics = (metric,) if metric else ("otif_rate", "order_count")
+    anomalies = find_kpi_anomalies(session, workflow_ids, anomaly_metrics, end_date, recent_days, limit)
+    return {"status": "success", "workflow_id": workflow_id, "anomalies": anomalies}
+
+# NEW ENDPOINT: Alert candidates of the latest fleet-wide anomaly sweep, for this merchant
+@app.get("/api/v1/insights/alerts")
+def get_insights_alerts(
+    limit: int = 50,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """New high-severity anomalies found by the most recent sweep (services/anomaly_sweep.py)."""
+    alerts = anomaly_sweep.latest_alerts(session, current_user.id, max(1, min(limit, 500)))
+    return {"status": "success", "alerts": [to_primitive_dict(alert) for alert in alerts]}
 
-    # 3. Run Anomaly Detection and AI Summary
-    anomaly_result = detect_anomalies(kpis)
-    ai_summary = generate_insight_summary(anomaly_result)
-    
-    # 4. Compile final response structure
-    return {
-        "status": "success",
-        "kpis": kpis,
-        "anomaly": anomaly_result,
-        "ai_summary_text": ai_summary 
-    }
 # --- Placeholder Root Route ---
 # backend/main.py (Add the new route below existing routes)
 class ChatInput(SQLModel):
@@ -468,17 +825,12 @@ def chat_with_gemini(
 class QueryInput(SQLModel):
     query: str
 
-# Helper function to get schema for the LLM
+# Helper function to get schema for the LLM (built once per process)
 def get_sales_schema_for_llm():
-    mapper = inspect(SalesData)
-    schema = []
-    for column in mapper.columns:
-        # Simple list of name and type for LLM context
-        schema.append({
-            "name": column.key,
-            "type": str(column.type).split("(")[0] 
-        })
-    return schema
+    return query_cache.sales_schema_for_llm()
+
+class QueryCachePrewarmInput(SQLModel):
+    questions: Optional[List[str]] = None # default: query_cache.DEFAULT_PREWARM_QUESTIONS
 
 @app.post("/api/v1/query-data")
 def get_query_data(
@@ -492,29 +844,64 @@ def get_query_data(
     # 1. Get Schema Context
     sales_schema = get_sales_schema_for_llm()
 
-    # 2. Translate Query (LLM call)
-    raw_sql = translate_natural_language_to_sql(data.query, sales_schema)
+    # 2. Translate Query (translation cache, LLM call on a miss)
+    translation = query_cache.translate_cached(session, data.query, sales_schema)
+    raw_sql = translation.sql
 
     # Safety Check: Ensure the query is a SELECT statement (Security!)
     if not raw_sql.upper().startswith("SELECT"):
         raise HTTPException(status_code=400, detail="Invalid query type. Only SELECT statements are allowed.")
 
+    # 3a. Columnar engine: the merchant's own workflows, from the Parquet mirror
+    if analytics_engine.analytics_enabled():
+        workflow_ids = session.exec(select(Workflow.id).where(Workflow.user_id == current_user.id)).all()
+        duckdb_sql, parameters = query_cache.positional_parameters(raw_sql, translation.parameters)
+        try:
+            results = analytics_engine.run_query(session, workflow_ids, duckdb_sql, parameters)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Analytics query failed: {e}")
+        return {"status": "success", "query": raw_sql, "parameters": jsonable_encoder(translation.parameters),
+                "translation": translation.source, "engine": "duckdb", "results": jsonable_encoder(results)}
+
     # 3. Execute Translated Query
     try:
         # --- FIX: Use text() to explicitly wrap the raw SQL string ---
-        result = session.exec(text(raw_sql)).all() 
+        result = session.exec(text(raw_sql), params=query_cache.bound_parameters(raw_sql, translation.parameters)).all() 
         
         # Since the result structure can vary (tuples for SUM/COUNT), 
         # map results to a list of dicts if possible.
         return {
             "status": "success",
             "query": raw_sql,
+            "parameters": jsonable_encoder(translation.parameters),
+            "translation": translation.source,
             "results": [row._asdict() if hasattr(row, '_asdict') else row for row in result]
         }
     except Exception as e:
         # Convert exception object to string for display
         raise HTTPException(status_code=500, detail=f"Database execution failed: {e}")
 
+# NEW ENDPOINT: NL -> SQL translation cache hit rates and entry counts
+@app.get("/api/v1/query-cache/stats")
+def get_query_cache_stats(
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    return query_cache.cache_stats(session)
+
+# NEW ENDPOINT: Translate common questions ahead of time, so dashboards hit the cache
+@app.post("/api/v1/query-cache/prewarm")
+def prewarm_query_cache(
+    data: QueryCachePrewarmInput,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    questions = data.questions or query_cache.DEFAULT_PREWARM_QUESTIONS
+    if len(questions) > query_cache.QUERY_CACHE_PREWARM_MAX:
+        raise HTTPException(status_code=422,
+                            detail=f"At most {query_cache.QUERY_CACHE_PREWARM_MAX} questions can be pre-warmed per request.")
+    return {"status": "success", "results": query_cache.prewarm(session, get_sales_schema_for_llm(), questions)}
+
 # ----------------------------------------------------
 # ROUTE 1: All Workflows Raw Data Dump (/api/v1/data/raw/all) - MUST BE FIRST
 # ----------------------------------------------------
@@ -556,7 +943,7 @@ def get_raw_sales_data(
     session: Session = Depends(get_session)
 ):
     SalesDataModel = get_sales_data_model(workflow_id)
-    SalesDataModel.metadata.create_all(session.get_bind())
+    ensure_sales_table(SalesDataModel, session.get_bind())
 
     data = session.exec(select(SalesDataModel)).all()
     
@@ -0,0 +1,21 @@
+# backend/models/analytics_model.py
+from sqlmodel import Field, SQLModel, Index
+from datetime import date, datetime
+from typing import Optional
+
+class AnalyticsDirtyMonth(SQLModel, table=True):
+    """A workflow month whose rows changed since its Parquet partition was last exported."""
+    __table_args__ = (Index("uq_analyticsdirtymonth_month", "workflow_id", "month", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(nullable=False)
+    month: date = Field(nullable=False) # first day of the month
+    generation: int = Field(default=1) # bumped on every re-mark, so an export only clears the marks it saw
+    marked_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+class AnalyticsWatermark(SQLModel, table=True):
+    """Workflow.data_version the Parquet mirror of a workflow is known to reflect."""
+    workflow_id: int = Field(primary_key=True)
+    data_version: int = Field(default=0)
+    exported_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    months_exported: int = Field(default=0) # by the last sync
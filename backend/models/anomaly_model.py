@@ -0,0 +1,86 @@
+# backend/models/anomaly_model.py
+from sqlmodel import Field, SQLModel, Index, Column, JSON
+from datetime import date, datetime
+from typing import List, Optional
+
+class KpiRunningStat(SQLModel, table=True):
+    """
+    Running statistics of one daily KPI series (workflow / dimension / key / metric), updated
+    at ingest: Welford count / mean / M2 over every day seen, plus an EWMA mean and variance.
+    The last day's observation can be replaced (prev_* hold the state before it was added).
+    """
+    __table_args__ = (
+        Index("uq_kpirunningstat_series", "workflow_id", "dimension", "dim_key", "metric", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(nullable=False)
+    dimension: str = Field(nullable=False) # 'total', 'product' or 'customer'
+    dim_key: str = Field(default="", nullable=False)
+    metric: str = Field(nullable=False) # see analytics/anomaly_detector.METRICS
+    count: int = Field(default=0)
+    mean: float = Field(default=0.0)
+    m2: float = Field(default=0.0) # sum of squared deviations (Welford)
+    ewma_mean: float = Field(default=0.0)
+    ewma_var: float = Field(default=0.0)
+    last_day: Optional[date] = None
+    last_value: Optional[float] = None
+    prev_ewma_mean: float = Field(default=0.0)
+    prev_ewma_var: float = Field(default=0.0)
+
+class AnomalyEvent(SQLModel, table=True):
+    """A day of a KPI series flagged at ingest time, linked to the WorkflowLog of the run that flagged it."""
+    __table_args__ = (
+        Index("uq_anomalyevent_series_day", "workflow_id", "dimension", "dim_key", "metric", "day", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(nullable=False)
+    workflow_log_id: Optional[int] = Field(default=None, index=True) # set once the run writes its log
+    dimension: str = Field(nullable=False)
+    dim_key: str = Field(default="", nullable=False)
+    metric: str = Field(nullable=False)
+    day: date = Field(nullable=False)
+    value: float
+    expected: float
+    z_score: float
+    direction: str # 'drop' or 'spike'
+    severity: str # 'low', 'medium' or 'high'
+    detectors: List[str] = Field(default_factory=list, sa_column=Column(JSON, nullable=False))
+    orders: int = Field(default=0)
+    detected_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+class AnomalySweep(SQLModel, table=True):
+    """One fleet-wide anomaly sweep over every workflow's KPI series (services/anomaly_sweep.py)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    started_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    finished_at: Optional[datetime] = None
+    end_date: Optional[date] = None # latest day in the data; the sweep scored the days just before it
+    workflows: int = Field(default=0)
+    series: int = Field(default=0)
+    anomalies: int = Field(default=0)
+    alerts: int = Field(default=0)
+    shards: int = Field(default=1)
+    seconds: float = Field(default=0.0)
+    status: str = Field(default="running") # 'running', 'success' or 'failed'
+
+class SweepAnomaly(SQLModel, table=True):
+    """An anomaly found by a sweep; alert marks the high-severity ones the previous sweep had not alerted on."""
+    __table_args__ = (Index("ix_sweepanomaly_sweep_alert", "sweep_id", "alert"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sweep_id: int = Field(nullable=False, index=True)
+    workflow_id: int = Field(nullable=False)
+    merchant_id: Optional[int] = None
+    dimension: str = Field(nullable=False)
+    dim_key: str = Field(default="", nullable=False)
+    metric: str = Field(nullable=False)
+    day: date = Field(nullable=False)
+    value: float
+    expected: float
+    z_score: float
+    direction: str
+    severity: str
+    detectors: List[str] = Field(default_factory=list, sa_column=Column(JSON, nullable=False))
+    orders: int = Field(default=0)
+    alert: bool = Field(default=False)
@@ -0,0 +1,16 @@
+# backend/models/attachment_model.py
+from sqlmodel import Field, SQLModel, UniqueConstraint
+from datetime import datetime
+from typing import Optional
+
+class ProcessedAttachment(SQLModel, table=True):
+    """Content hash of every attachment a workflow has ingested (file-level idempotency)."""
+    __table_args__ = (UniqueConstraint("workflow_id", "content_hash", name="uq_processed_attachment_hash"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(index=True, nullable=False, foreign_key="workflow.id")
+    content_hash: str = Field(nullable=False) # SHA-256 hex digest of the raw attachment bytes
+    source_filename: Optional[str] = None
+    message_id: Optional[str] = None
+    rows_inserted: int = Field(default=0)
+    processed_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
@@ -0,0 +1,12 @@
+# backend/models/lease_model.py
+from sqlmodel import Field, SQLModel
+from datetime import datetime
+from typing import Optional
+
+class SchedulerLease(SQLModel, table=True):
+    """Leader lease (one row per role): the holder runs the scheduler until expires_at unless it renews."""
+    name: str = Field(primary_key=True) # e.g. 'scheduler'
+    holder: Optional[str] = None # host:pid of the current leader
+    acquired_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+    expires_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
@@ -1,7 +1,7 @@
 # backend/models/log_model.py
-from sqlmodel import Field, SQLModel
+from sqlmodel import Field, SQLModel, Column, JSON
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Dict, Any
 
 class WorkflowLog(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -13,4 +13,7 @@ class WorkflowLog(SQLModel, table=True):
     status: str # E.g., 'SUCCESS', 'FAILURE', 'INFO'
     source_filename: Optional[str] = None
     rows_inserted: int = Field(default=0)
+    rows_rejected: int = Field(default=0)
+    # Per-rule rejection counts plus a small sample of rejected rows (see services/data_validator.py)
+    validation_report: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
     message: str
\ No newline at end of file
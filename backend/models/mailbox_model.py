@@ -0,0 +1,11 @@
+# backend/models/mailbox_model.py
+from sqlmodel import Field, SQLModel
+from datetime import datetime
+from typing import Optional
+
+class MailboxSyncState(SQLModel, table=True):
+    """Last Gmail historyId seen by the shared mailbox sync (one row per mailbox)."""
+    mailbox: str = Field(primary_key=True) # Gmail userId, normally 'me'
+    last_history_id: Optional[str] = None
+    last_synced_at: Optional[datetime] = None
+    messages_seen: int = Field(default=0)
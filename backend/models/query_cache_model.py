@@ -0,0 +1,21 @@
+# backend/models/query_cache_model.py
+from sqlmodel import Field, SQLModel, Index
+from datetime import datetime
+from typing import Optional
+
+class NlQueryCacheEntry(SQLModel, table=True):
+    """
+    A cached natural-language -> SQL translation (services/query_cache.py), keyed by the
+    normalized question plus the fingerprint of the schema and prompt it was translated against.
+    """
+    __table_args__ = (Index("uq_nlquerycacheentry_key", "cache_key", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    cache_key: str = Field(nullable=False) # sha256 of normalized_query + schema_fingerprint
+    schema_fingerprint: str = Field(nullable=False, index=True)
+    normalized_query: str = Field(nullable=False)
+    sql: str = Field(nullable=False) # may contain the :start_date / :end_date bind parameters
+    parameterized: bool = Field(default=False) # the question had a relative date range
+    hits: int = Field(default=0) # lookups served from this table (in-process LRU hits are not counted)
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
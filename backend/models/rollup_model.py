@@ -0,0 +1,56 @@
+# backend/models/rollup_model.py
+from sqlmodel import Field, SQLModel, Index, Column, JSON
+from datetime import date
+from typing import Any, Dict, Optional
+
+# Rollup grains: one 'total' row per day, plus one row per product and per customer per day
+ROLLUP_TOTAL = "total"
+ROLLUP_PRODUCT = "product"
+ROLLUP_CUSTOMER = "customer"
+
+class KpiDailyRollup(SQLModel, table=True):
+    """Per-day KPI counters of one workflow table, maintained at ingest time (see services/kpi_rollups.py)."""
+    __table_args__ = (
+        Index("uq_kpidailyrollup_grain", "workflow_id", "dimension", "day", "dim_key", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(nullable=False)
+    day: date = Field(nullable=False) # delivery_date of the order lines
+    dimension: str = Field(nullable=False) # 'total', 'product' or 'customer'
+    dim_key: str = Field(default="", nullable=False) # product_id / customer_id ('' for totals)
+    order_count: int = Field(default=0)
+    on_time_count: int = Field(default=0)
+    in_full_count: int = Field(default=0)
+    otif_count: int = Field(default=0)
+    order_qty_sum: int = Field(default=0)
+    delivery_qty_sum: int = Field(default=0)
+
+class KpiKeyRollup(SQLModel, table=True):
+    """All-time counters per product / customer of one workflow, re-summed from KpiDailyRollup (top-N rankings)."""
+    __table_args__ = (
+        Index("uq_kpikeyrollup_grain", "workflow_id", "dimension", "dim_key", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(nullable=False)
+    dimension: str = Field(nullable=False) # 'product' or 'customer'
+    dim_key: str = Field(nullable=False)
+    order_count: int = Field(default=0)
+    on_time_count: int = Field(default=0)
+    in_full_count: int = Field(default=0)
+    otif_count: int = Field(default=0)
+    order_qty_sum: int = Field(default=0)
+    delivery_qty_sum: int = Field(default=0)
+
+class KpiSketch(SQLModel, table=True):
+    """Mergeable top-k summary (analytics/heavy_hitters.py) of one workflow, dimension and month."""
+    __table_args__ = (
+        Index("uq_kpisketch_grain", "workflow_id", "dimension", "bucket", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(nullable=False)
+    dimension: str = Field(nullable=False) # 'product' (by order_qty) or 'customer' (by order count)
+    bucket: date = Field(nullable=False) # first day of the month
+    summary: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON, nullable=False)) # TopKSummary.to_json()
@@ -0,0 +1,24 @@
+# backend/models/run_model.py
+from sqlmodel import Field, SQLModel, Index
+from datetime import datetime
+from typing import Optional
+
+class EtlRun(SQLModel, table=True):
+    """One queued/attempted ETL run (see services/run_queue.py). Survives restarts and is shared by all workers."""
+    __table_args__ = (Index("ix_etlrun_status_available", "status", "available_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    workflow_id: int = Field(index=True, nullable=False, foreign_key="workflow.id")
+    merchant_id: int = Field(index=True, nullable=False, foreign_key="user.id")
+    kind: str = Field(default="check") # 'check' (poll the source), 'message' (one known message), 'manual'
+    message_id: Optional[str] = None # only for kind='message'
+    status: str = Field(default="queued") # queued -> running -> succeeded | queued (retry) | dead
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    available_at: datetime = Field(default_factory=datetime.utcnow, nullable=False) # not claimable before this (backoff)
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    worker_id: Optional[str] = None
+    messages_seen: int = Field(default=0)
+    last_error: Optional[str] = None
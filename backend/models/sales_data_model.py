@@ -1,7 +1,13 @@
 # backend/models/sales_data_model.py
-from sqlmodel import Field, SQLModel
+from sqlmodel import Field, SQLModel, Index
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import text
 from datetime import date, datetime
-from typing import Optional, ClassVar 
+from typing import Optional, ClassVar, List, Set, Type
+
+
+# Natural key of an order line. Re-sent files upsert on this instead of duplicating rows.
+SALES_NATURAL_KEY: List[str] = ['merchant_id', 'order_id', 'product_id']
 
 
 # 1. Define Mixin (inherits from SQLModel for Pydantic features)
@@ -31,7 +37,11 @@ def get_sales_data_model(workflow_id: int):
     # inside the function. This correctly triggers SQLModel's metaclass logic.
     class DynamicSalesData(SalesDataMixin, table=True):
         __tablename__ = table_name
-        __table_args__ = {'extend_existing': True}
+        __table_args__ = (
+            Index(f"uq_{table_name}_order_line", *SALES_NATURAL_KEY, unique=True),
+            Index(f"ix_{table_name}_delivery_date", "delivery_date"), # day-bucket rollup refreshes
+            {'extend_existing': True},
+        )
         
         # Explicitly re-declare the fields required for ORM mapping/table creation
         id: Optional[int] = Field(default=None, primary_key=True)
@@ -41,4 +51,44 @@ def get_sales_data_model(workflow_id: int):
     DynamicSalesData.__name__ = f'SalesData_{workflow_id}'
     DynamicSalesData.__qualname__ = DynamicSalesData.__name__
     
-    return DynamicSalesData
\ No newline at end of file
+    return DynamicSalesData
+
+def workflow_id_for_model(SalesDataModel: Type) -> Optional[int]:
+    """The workflow behind a sales_data_{id} model, or None for the shared SalesData table."""
+    prefix, _, suffix = SalesDataModel.__tablename__.rpartition("_")
+    if prefix == "sales_data" and suffix.isdigit():
+        return int(suffix)
+    return None
+
+# Tables already checked in this process (avoids an inspector round trip per run)
+_ENSURED_TABLES: Set[str] = set()
+
+def ensure_sales_table(SalesDataModel: Type, bind) -> None:
+    """
+    Creates the workflow table if missing and makes sure the natural-key unique index exists.
+    Tables created before the index existed may hold duplicate order lines; those are
+    collapsed (keeping the newest row) so the index can be built.
+    """
+    table = SalesDataModel.__table__
+    if table.name in _ENSURED_TABLES:
+        return
+
+    table.create(bind, checkfirst=True)
+    for index in table.indexes:
+        if not index.unique:
+            # Plain indexes added after the table was first created
+            index.create(bind, checkfirst=True)
+            continue
+        try:
+            index.create(bind, checkfirst=True)
+        except IntegrityError:
+            print(f"WARNING: Duplicate order lines found in {table.name}. Keeping newest row per key.")
+            key_list = ", ".join(SALES_NATURAL_KEY)
+            with bind.begin() as connection:
+                connection.execute(text(
+                    f"DELETE FROM {table.name} WHERE id NOT IN "
+                    f"(SELECT MAX(id) FROM {table.name} GROUP BY {key_list})"
+                ))
+            index.create(bind, checkfirst=True)
+
+    _ENSURED_TABLES.add(table.name)
@@ -1,8 +1,20 @@
 #backend/models/workflow.py (MODIFIED)
-from typing import Optional
-from sqlmodel import SQLModel, Field
+from typing import Optional, Dict, Any
+from sqlmodel import SQLModel, Field, Column, JSON
+from pydantic import field_validator
 from datetime import datetime 
 
+from services.attachment_sources import SOURCE_TYPES
+
+def _known_source_type(value: Optional[str]) -> Optional[str]:
+    """Rejects unknown attachment sources at the API boundary instead of at run time."""
+    if value is None:
+        return value
+    value = value.lower()
+    if value not in SOURCE_TYPES:
+        raise ValueError(f"source_type must be one of {', '.join(SOURCE_TYPES)}")
+    return value
+
 # --- Base model for the database table (Requires user_id) ---
 class WorkflowBase(SQLModel):
     name: str = Field(index=True)
@@ -14,12 +26,16 @@ class WorkflowBase(SQLModel):
     recheck_interval_minutes: int = Field(default=60) # How often to run the job (in minutes)
     target_table: str = Field(default="fact_orders") 
     is_active: bool = Field(default=True)
+    # Where attachments come from: "gmail" (default), "directory" or "memory" (see services/attachment_sources.py)
+    source_type: str = Field(default="gmail")
+    source_config: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON)) # e.g. {"path": "/data/drop", "pattern": "*.csv"}
 
 class Workflow(WorkflowBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     last_run_status: Optional[str] = Field(default=None) 
     last_run_timestamp: Optional[datetime] = Field(default=None)
     last_processed_email_id: Optional[str] = Field(default=None)
+    data_version: int = Field(default=0) # bumped after every ingestion that wrote rows (insights cache keys)
 
 # --- Pydantic model for the incoming POST request payload (Excludes user_id) ---
 class WorkflowCreate(SQLModel):
@@ -30,6 +46,10 @@ class WorkflowCreate(SQLModel):
     is_active: bool = Field(default=True)
     # CRITICAL ADDITION: Must match the data model structure
     recheck_interval_minutes: Optional[int] = Field(default=60) # <<< MODIFIED
+    source_type: str = Field(default="gmail")
+    source_config: Optional[Dict[str, Any]] = None
+
+    _check_source_type = field_validator("source_type")(_known_source_type)
 # --- Pydantic model for the PATCH request payload ---
 class WorkflowUpdate(SQLModel):
     name: Optional[str] = None
@@ -37,6 +57,10 @@ class WorkflowUpdate(SQLModel):
     trigger_sender: Optional[str] = None 
     is_active: Optional[bool] = None 
     recheck_interval_minutes: Optional[int] = None
+    source_type: Optional[str] = None
+    source_config: Optional[Dict[str, Any]] = None
+
+    _check_source_type = field_validator("source_type")(_known_source_type)
 
 # --- Pydantic model for the response output ---
 class WorkflowRead(WorkflowBase):
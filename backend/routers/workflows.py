@@ -8,6 +8,7 @@ from models.workflow import Workflow, WorkflowCreate, WorkflowRead, WorkflowUpda
 from models.user_model import User
 from services.auth_utils import get_current_active_user
 from models.sales_data_model import get_sales_data_model # NEW IMPORT
+from services.attachment_sources import check_api_source
 import main # <<< MODIFIED: Simple direct import of main.py
 
 router = APIRouter(prefix="/api/v1", tags=["workflows"])
@@ -24,6 +25,13 @@ def get_user_workflow(workflow_id: int, user: User, session: Session):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Workflow not found or access denied.")
     return workflow
 
+def check_workflow_source(workflow: Workflow, user: User):
+    """Only Gmail, or a drop folder inside the user's own directory root, can be configured here."""
+    try:
+        check_api_source(workflow.source_type, workflow.source_config, user.id)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error))
+
 # --- CRUD Endpoints ---
 
 @router.get("/workflows", response_model=List[WorkflowRead])
@@ -37,6 +45,21 @@ def read_workflows(
     ).all()
     return workflows
 
+@router.post("/workflows", response_model=WorkflowRead, status_code=status.HTTP_201_CREATED)
+def create_workflow(
+    workflow_data: WorkflowCreate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Create a workflow for the current user and schedule it right away."""
+    db_workflow = Workflow.model_validate(workflow_data, update={"user_id": current_user.id})
+    check_workflow_source(db_workflow, current_user)
+    session.add(db_workflow)
+    session.commit()
+    session.refresh(db_workflow)
+    main.create_dynamic_job(db_workflow)
+    return db_workflow
+
 @router.patch("/workflows/{workflow_id}", response_model=WorkflowRead)
 def update_workflow(
     workflow_id: int,
@@ -49,6 +72,7 @@ def update_workflow(
     
     for key, value in workflow_update.model_dump(exclude_unset=True).items():
         setattr(db_workflow, key, value)
+    check_workflow_source(db_workflow, current_user)
     
     session.add(db_workflow)
     session.commit()
@@ -68,6 +92,7 @@ def update_workflow(
     
     for key, value in workflow_update.model_dump(exclude_unset=True).items():
         setattr(db_workflow, key, value)
+    check_workflow_source(db_workflow, current_user)
     
     session.add(db_workflow)
     session.commit()
@@ -83,6 +108,7 @@ def delete_workflow(
 ):
     """Delete a workflow."""
     db_workflow = get_user_workflow(workflow_id, current_user, session)
+    main.remove_dynamic_job(db_workflow) # Stop polling now instead of at the next job_manager pass
     session.delete(db_workflow)
     session.commit()
     return {"ok": True}
\ No newline at end of file
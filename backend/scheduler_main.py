@@ -0,0 +1,33 @@
+# backend/scheduler_main.py
+"""
+Dedicated scheduler process, so the API can run with many uvicorn workers/replicas
+without duplicating ETL work:
+
+    RUN_SCHEDULER=false uvicorn main:app --workers 8     # API only
+    python scheduler_main.py                              # scheduler (+ local ETL pool)
+
+Several scheduler_main processes may run for failover: the 'scheduler' lease lets
+exactly one of them fire jobs, and a standby takes over when the leader's lease
+expires. Extra ETL capacity comes from `python -m services.run_queue` workers.
+"""
+import asyncio
+import signal
+
+import main
+
+
+async def run():
+    main.create_db_and_tables()
+    main.start_scheduler()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    main.stop_scheduler()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
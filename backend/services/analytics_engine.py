@@ -0,0 +1,312 @@
+# backend/services/analytics_engine.py
+"""
+Optional columnar analytics backend: ANALYTICS_ENGINE=duckdb (requires `pip install duckdb`).
+
+Each workflow's sales rows are mirrored to Parquet under ANALYTICS_PARQUET_DIR,
+partitioned as workflow_id=<id>/month=<YYYY-MM>/data.parquet, and analytical SELECTs
+(ad-hoc /api/v1/query-data queries, and the raw-row KPIs and trends of workflows that are
+not served from the rollups) run on those files through an in-process DuckDB connection
+instead of the OLTP database that ingestion writes to. KPI code builds its statements
+against sales_view() and runs them with run_statement.
+
+Consistency watermark: ingestion marks every month it touched (AnalyticsDirtyMonth,
+in the same transaction as the rows). sync_workflow re-exports only those months and
+records the Workflow.data_version it read beforehand in AnalyticsWatermark. Readers
+call ensure_fresh first, which syncs any workflow whose watermark is behind its
+data_version, so results are never older than the last committed ingestion.
+
+Queries only see the calling merchant's partitions: the DuckDB connection is limited
+to those directories (enable_external_access=false + allowed_directories, locked).
+
+    python -m services.analytics_engine --sync-all     # (re)export every workflow
+"""
+import argparse
+import glob
+import os
+import shutil
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import pandas as pd
+from sqlalchemy import Column, MetaData, Table, delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session
+
+from models.analytics_model import AnalyticsDirtyMonth, AnalyticsWatermark
+from models.sales_data_model import SalesData, get_sales_data_model
+from models.workflow import Workflow
+from services.kpi_sketches import month_start, next_month
+from services.metrics import metrics
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "sql").lower() # 'sql' (OLTP database) or 'duckdb'
+ANALYTICS_PARQUET_DIR = os.path.abspath(os.getenv("ANALYTICS_PARQUET_DIR", "analytics_store"))
+ANALYTICS_SYNC_INTERVAL_SECONDS = int(os.getenv("ANALYTICS_SYNC_INTERVAL_SECONDS", "300"))
+# DuckDB threads per query connection
+ANALYTICS_DUCKDB_THREADS = int(os.getenv("ANALYTICS_DUCKDB_THREADS", "4"))
+
+# Schema of the 'salesdata' view when a merchant has nothing exported yet
+EMPTY_SALESDATA_SQL = (
+    "CREATE TABLE salesdata (id BIGINT, order_id VARCHAR, product_id VARCHAR, customer_id VARCHAR, "
+    "order_qty BIGINT, delivery_qty BIGINT, delivery_date DATE, on_time BIGINT, in_full BIGINT, "
+    "insertion_timestamp TIMESTAMP, merchant_id BIGINT, workflow_id BIGINT, month VARCHAR)"
+)
+
+_MISSING_WARNED = False
+_DIRTY_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+_TABLES_READY: Set[str] = set()
+# One export per workflow at a time within this process
+_SYNC_LOCKS: Dict[int, threading.Lock] = {}
+_SYNC_LOCKS_GUARD = threading.Lock()
+# DuckDB speaks PostgreSQL's SQL closely enough; '?' placeholders are what it binds
+_DUCKDB_DIALECT = postgresql.dialect(paramstyle="qmark")
+_SALES_VIEW: Optional[Table] = None
+
+
+def _duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        return None
+    return duckdb
+
+
+def analytics_enabled() -> bool:
+    """True if the DuckDB backend is selected and importable (otherwise analytics stay on the OLTP database)."""
+    global _MISSING_WARNED
+    if ANALYTICS_ENGINE != "duckdb":
+        return False
+    if _duckdb() is None:
+        if not _MISSING_WARNED:
+            _MISSING_WARNED = True
+            print("ANALYTICS: ANALYTICS_ENGINE=duckdb but the 'duckdb' package is not installed. Using the database.")
+        return False
+    return True
+
+
+def _ensure_tables(connection):
+    url = str(connection.engine.url)
+    if url not in _TABLES_READY:
+        AnalyticsDirtyMonth.__table__.create(connection, checkfirst=True)
+        AnalyticsWatermark.__table__.create(connection, checkfirst=True)
+        _TABLES_READY.add(url)
+
+
+def mark_dirty_months(session: Session, workflow_id: int, days: Iterable[date]):
+    """Records the months a batch touched. Called inside the ingest transaction (does not commit)."""
+    months = sorted({month_start(day) for day in days})
+    if not months:
+        return
+    connection = session.connection()
+    _ensure_tables(connection)
+    table = AnalyticsDirtyMonth.__table__
+    dialect = connection.dialect.name
+    rows = [{"workflow_id": workflow_id, "month": month, "generation": 1, "marked_at": datetime.utcnow()}
+            for month in months]
+
+    if dialect in _DIRTY_INSERTS:
+        stmt = _DIRTY_INSERTS[dialect](table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["workflow_id", "month"],
+            set_={"generation": table.c.generation + 1, "marked_at": stmt.excluded.marked_at},
+        )
+        session.execute(stmt, rows)
+        return
+    existing = set(session.execute(
+        select(table.c.month).where(table.c.workflow_id == workflow_id, table.c.month.in_(months))
+    ).scalars())
+    for row in rows:
+        if row["month"] in existing:
+            session.execute(table.update().where(table.c.workflow_id == workflow_id, table.c.month == row["month"])
+                            .values(generation=table.c.generation + 1, marked_at=row["marked_at"]))
+        else:
+            session.execute(table.insert().values(**row))
+
+
+def workflow_dir(workflow_id: int) -> str:
+    return os.path.join(ANALYTICS_PARQUET_DIR, f"workflow_id={workflow_id}")
+
+
+def _partition_path(workflow_id: int, month: date) -> str:
+    return os.path.join(workflow_dir(workflow_id), f"month={month:%Y-%m}", "data.parquet")
+
+
+def _export_month(session: Session, SalesDataModel, workflow_id: int, month: date, con) -> int:
+    """Rewrites one month's partition from the database (removes it if the month is now empty)."""
+    frame = pd.read_sql(
+        select(SalesDataModel.__table__).where(
+            SalesDataModel.delivery_date >= month, SalesDataModel.delivery_date < next_month(month)
+        ),
+        session.connection(),
+    )
+    path = _partition_path(workflow_id, month)
+    if frame.empty:
+        if os.path.exists(path):
+            os.remove(path)
+        return 0
+
+    frame["delivery_date"] = pd.to_datetime(frame["delivery_date"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    con.register("month_rows", frame)
+    try:
+        con.execute(
+            "COPY (SELECT * REPLACE (CAST(delivery_date AS DATE) AS delivery_date) FROM month_rows) "
+            f"TO '{temp_path}' (FORMAT PARQUET)"
+        )
+    finally:
+        con.unregister("month_rows")
+    os.replace(temp_path, path) # readers see the old or the new file, never a partial one
+    return len(frame)
+
+
+def _sync_lock(workflow_id: int) -> threading.Lock:
+    with _SYNC_LOCKS_GUARD:
+        return _SYNC_LOCKS.setdefault(workflow_id, threading.Lock())
+
+
+def sync_workflow(session: Session, workflow_id: int) -> int:
+    """
+    Brings a workflow's Parquet mirror up to date: every dirty month, or everything on the
+    first sync. Advances the watermark to the data_version read before exporting. Commits.
+    Returns the number of months exported.
+    """
+    duckdb = _duckdb()
+    connection = session.connection()
+    _ensure_tables(connection)
+
+    with _sync_lock(workflow_id), metrics.timer("analytics_sync_seconds"):
+        version = session.execute(select(Workflow.data_version).where(Workflow.id == workflow_id)).scalar() or 0
+        watermark = session.get(AnalyticsWatermark, workflow_id)
+        dirty = session.execute(
+            select(AnalyticsDirtyMonth.id, AnalyticsDirtyMonth.month, AnalyticsDirtyMonth.generation)
+            .where(AnalyticsDirtyMonth.workflow_id == workflow_id)
+        ).all()
+        if watermark is not None and watermark.data_version >= version and not dirty:
+            return 0
+
+        SalesDataModel = get_sales_data_model(workflow_id)
+        if watermark is None:
+            # First export: every month in the table, from a clean directory
+            shutil.rmtree(workflow_dir(workflow_id), ignore_errors=True)
+            days = session.execute(select(SalesDataModel.delivery_date).distinct()).scalars().all()
+            months = {month_start(date.fromisoformat(day) if isinstance(day, str) else day) for day in days}
+        else:
+            months = set()
+        months |= {month if isinstance(month, date) else date.fromisoformat(month) for _, month, _ in dirty}
+
+        con = duckdb.connect()
+        try:
+            rows = sum(_export_month(session, SalesDataModel, workflow_id, month, con) for month in sorted(months))
+        finally:
+            con.close()
+
+        # Clear exactly the marks we exported; a month re-marked meanwhile has a newer generation and stays dirty
+        for dirty_id, _, generation in dirty:
+            session.execute(delete(AnalyticsDirtyMonth).where(
+                AnalyticsDirtyMonth.id == dirty_id, AnalyticsDirtyMonth.generation == generation))
+        if watermark is None:
+            watermark = AnalyticsWatermark(workflow_id=workflow_id)
+        watermark.data_version = version
+        watermark.exported_at = datetime.utcnow()
+        watermark.months_exported = len(months)
+        session.add(watermark)
+        session.commit()
+
+    metrics.increment("analytics_months_exported", len(months))
+    print(f"ANALYTICS: Workflow {workflow_id} synced {len(months)} month(s), {rows} rows (data version {version}).")
+    return len(months)
+
+
+def ensure_fresh(session: Session, workflow_ids: Iterable[int]) -> List[int]:
+    """Syncs every workflow whose watermark is behind its data_version. Returns the ones synced."""
+    workflow_ids = list(workflow_ids)
+    if not workflow_ids:
+        return []
+    _ensure_tables(session.connection())
+    stale = session.execute(
+        select(Workflow.id)
+        .outerjoin(AnalyticsWatermark, AnalyticsWatermark.workflow_id == Workflow.id)
+        .where(Workflow.id.in_(workflow_ids))
+        .where((AnalyticsWatermark.workflow_id.is_(None)) | (AnalyticsWatermark.data_version < Workflow.data_version))
+    ).scalars().all()
+    for workflow_id in stale:
+        sync_workflow(session, workflow_id)
+    return list(stale)
+
+
+def connect(workflow_ids: Iterable[int]):
+    """
+    DuckDB connection with a 'salesdata' view over the given workflows' Parquet files and
+    no other file access (settings locked, so a query cannot lift the restriction).
+    """
+    duckdb = _duckdb()
+    con = duckdb.connect(config={"threads": ANALYTICS_DUCKDB_THREADS})
+    directories = [workflow_dir(workflow_id) + os.sep for workflow_id in workflow_ids
+                   if glob.glob(os.path.join(workflow_dir(workflow_id), "*", "*.parquet"))]
+    try:
+        con.execute("SET allowed_directories = $1", [directories])
+        con.execute("SET enable_external_access = false")
+        con.execute("SET lock_configuration = true")
+        if directories:
+            patterns = ", ".join(f"'{os.path.join(directory, '*', '*.parquet')}'" for directory in directories)
+            con.execute(f"CREATE VIEW salesdata AS SELECT * FROM read_parquet([{patterns}], "
+                        "hive_partitioning = true, union_by_name = true)")
+        else:
+            con.execute(EMPTY_SALESDATA_SQL)
+    except Exception:
+        con.close()
+        raise
+    return con
+
+
+def _fetch(session: Session, workflow_ids: Iterable[int], sql: str,
+           parameters: Optional[List[Any]]) -> Tuple[List[str], List[tuple]]:
+    workflow_ids = list(workflow_ids)
+    ensure_fresh(session, workflow_ids)
+    con = connect(workflow_ids)
+    try:
+        with metrics.timer("analytics_query_seconds"):
+            cursor = con.execute(sql, parameters or [])
+            return [column[0] for column in cursor.description], cursor.fetchall()
+    finally:
+        con.close()
+
+
+def run_query(session: Session, workflow_ids: Iterable[int], sql: str,
+              parameters: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+    """Runs a SELECT against the 'salesdata' view of the given workflows (freshened first)."""
+    columns, rows = _fetch(session, workflow_ids, sql, parameters)
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def sales_view() -> Table:
+    """The 'salesdata' view as a SQLAlchemy table, for statements passed to run_statement."""
+    global _SALES_VIEW
+    if _SALES_VIEW is None:
+        _SALES_VIEW = Table("salesdata", MetaData(),
+                            *[Column(column.name, column.type) for column in SalesData.__table__.columns])
+    return _SALES_VIEW
+
+
+def run_statement(session: Session, workflow_ids: Iterable[int], stmt) -> List[tuple]:
+    """run_query for a SQLAlchemy SELECT built against sales_view(); rows come back as tuples."""
+    compiled = stmt.compile(dialect=_DUCKDB_DIALECT)
+    parameters = [compiled.params[name] for name in compiled.positiontup]
+    return _fetch(session, workflow_ids, str(compiled), parameters)[1]
+
+
+if __name__ == "__main__":
+    from database import get_session
+
+    parser = argparse.ArgumentParser(description="Export workflow sales data to the Parquet analytics mirror.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--workflow-id", type=int, action="append", help="Workflow to sync (repeatable).")
+    target.add_argument("--sync-all", action="store_true", help="Sync every workflow.")
+    args = parser.parse_args()
+
+    if _duckdb() is None:
+        raise SystemExit("The 'duckdb' package is required: pip install duckdb")
+    with next(get_session()) as session:
+        workflow_ids = args.workflow_id or session.execute(select(Workflow.id).order_by(Workflow.id)).scalars().all()
+        for workflow_id in workflow_ids:
+            sync_workflow(session, workflow_id)
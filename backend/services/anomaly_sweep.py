@@ -0,0 +1,197 @@
+# backend/services/anomaly_sweep.py
+"""
+Fleet-wide anomaly sweep: every workflow of every merchant, scored in one pass.
+
+Workflow ids are split into ANOMALY_SWEEP_SHARDS shards (workflow_id % shards). Each shard runs
+in its own process: it loads its workflows' day rollups with one set-based query per
+ANOMALY_SWEEP_BATCH workflows and scores all of their series as a single matrix
+(analytics/anomaly_detector.detect_series_anomalies). The parent stores the findings as one
+AnomalySweep with its SweepAnomaly rows; high-severity findings that the previous sweep did
+not alert on are marked as alert candidates.
+
+    python -m services.anomaly_sweep                 # one sweep now
+    python -m services.anomaly_sweep --shards 8
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from sqlalchemy import delete, func, insert, select
+from sqlmodel import Session, create_engine
+
+from analytics.anomaly_detector import HISTORY_DAYS, RECENT_DAYS, detect_series_anomalies, load_kpi_series
+from models.anomaly_model import AnomalySweep, SweepAnomaly
+from models.rollup_model import KpiDailyRollup, ROLLUP_TOTAL
+from models.workflow import Workflow
+from services.metrics import metrics
+
+ANOMALY_SWEEP_ENABLED = os.getenv("ANOMALY_SWEEP_ENABLED", "false").lower() == "true"
+ANOMALY_SWEEP_INTERVAL_MINUTES = int(os.getenv("ANOMALY_SWEEP_INTERVAL_MINUTES", "60"))
+ANOMALY_SWEEP_SHARDS = int(os.getenv("ANOMALY_SWEEP_SHARDS", str(min(os.cpu_count() or 1, 8))))
+ANOMALY_SWEEP_BATCH = int(os.getenv("ANOMALY_SWEEP_BATCH", "1000")) # workflows per query inside a shard
+ANOMALY_SWEEP_KEEP = int(os.getenv("ANOMALY_SWEEP_KEEP", "24")) # sweeps (and their rows) kept
+SWEEP_METRICS = ("otif_rate", "on_time_rate", "in_full_rate", "order_count")
+ALERT_SEVERITIES = ("high",)
+
+AlertKey = Tuple[int, str, str, str, str] # (workflow_id, dimension, dim_key, metric, day)
+
+
+def _sweep_shard(database_url: str, workflow_ids: List[int], end_date: date,
+                 recent_days: int, history_days: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """Process-pool worker: scores one shard. Returns (series scored, anomalies)."""
+    # Own engine: connections must not be shared with the parent process
+    engine = create_engine(database_url)
+    series = 0
+    found: List[Dict[str, Any]] = []
+    try:
+        with Session(engine) as session:
+            for start in range(0, len(workflow_ids), ANOMALY_SWEEP_BATCH):
+                frame = load_kpi_series(session, workflow_ids[start:start + ANOMALY_SWEEP_BATCH],
+                                        end_date, history_days + recent_days)
+                if frame.empty:
+                    continue
+                series += len(frame[["workflow_id", "dimension", "dim_key"]].drop_duplicates())
+                found += detect_series_anomalies(frame, SWEEP_METRICS, recent_days, limit=len(frame))
+    finally:
+        engine.dispose()
+    return series, found
+
+
+def _previous_alerts(session: Session) -> Set[AlertKey]:
+    """Alert-worthy findings of the last successful sweep (alerted then or earlier)."""
+    previous = session.execute(
+        select(AnomalySweep.id).where(AnomalySweep.status == "success").order_by(AnomalySweep.id.desc()).limit(1)
+    ).scalar()
+    if previous is None:
+        return set()
+    rows = session.execute(select(
+        SweepAnomaly.workflow_id, SweepAnomaly.dimension, SweepAnomaly.dim_key, SweepAnomaly.metric, SweepAnomaly.day,
+    ).where(SweepAnomaly.sweep_id == previous, SweepAnomaly.severity.in_(ALERT_SEVERITIES))).all()
+    return {(workflow_id, dimension, dim_key, metric, str(day)) for workflow_id, dimension, dim_key, metric, day in rows}
+
+
+def run_sweep(session: Session, database_url: str, workflow_ids: Optional[Sequence[int]] = None,
+              shards: int = ANOMALY_SWEEP_SHARDS, recent_days: int = RECENT_DAYS,
+              history_days: int = HISTORY_DAYS) -> AnomalySweep:
+    """
+    Sweeps the given workflows (default: every workflow) and stores the results. Commits.
+    shards=1 runs in this process.
+    """
+    owners_stmt = select(Workflow.id, Workflow.user_id)
+    if workflow_ids is not None:
+        owners_stmt = owners_stmt.where(Workflow.id.in_(list(workflow_ids)))
+    owners: Dict[int, Optional[int]] = dict(session.execute(owners_stmt).all())
+    workflow_ids = sorted(owners) if workflow_ids is None else sorted(workflow_ids)
+    shards = max(1, min(shards, len(workflow_ids) or 1))
+
+    sweep = AnomalySweep(workflows=len(workflow_ids), shards=shards)
+    session.add(sweep)
+    session.commit()
+    session.refresh(sweep)
+    started = time.perf_counter()
+
+    try:
+        end_date = session.execute(
+            select(func.max(KpiDailyRollup.day)).where(KpiDailyRollup.dimension == ROLLUP_TOTAL)
+        ).scalar()
+        results: List[Tuple[int, List[Dict[str, Any]]]] = []
+        if end_date is not None and workflow_ids:
+            end_date = date.fromisoformat(end_date) if isinstance(end_date, str) else end_date
+            shard_ids = [[workflow_id for workflow_id in workflow_ids if workflow_id % shards == shard]
+                         for shard in range(shards)]
+            arguments = [(database_url, ids, end_date, recent_days, history_days) for ids in shard_ids if ids]
+            if shards == 1:
+                results = [_sweep_shard(*args) for args in arguments]
+            else:
+                # Spawned, not forked: the API process runs this from scheduler threads, and a
+                # forked child would inherit their held locks and open connections.
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=shards, mp_context=context) as pool:
+                    results = list(pool.map(_sweep_shard, *zip(*arguments)))
+
+        previous_alerts = _previous_alerts(session)
+        rows = []
+        for _, anomalies in results:
+            for anomaly in anomalies:
+                key = (anomaly["workflow_id"], anomaly["dimension"], anomaly["key"], anomaly["metric"], anomaly["day"])
+                rows.append({
+                    "sweep_id": sweep.id,
+                    "workflow_id": anomaly["workflow_id"],
+                    "merchant_id": owners.get(anomaly["workflow_id"]),
+                    "dimension": anomaly["dimension"],
+                    "dim_key": anomaly["key"],
+                    "metric": anomaly["metric"],
+                    "day": date.fromisoformat(anomaly["day"]),
+                    "value": anomaly["value"],
+                    "expected": anomaly["expected"],
+                    "z_score": anomaly["z_score"],
+                    "direction": anomaly["direction"],
+                    "severity": anomaly["severity"],
+                    "detectors": anomaly["detectors"],
+                    "orders": anomaly["orders"],
+                    "alert": anomaly["severity"] in ALERT_SEVERITIES and key not in previous_alerts,
+                })
+        if rows:
+            session.execute(insert(SweepAnomaly.__table__), rows)
+
+        sweep.end_date = end_date
+        sweep.series = sum(series for series, _ in results)
+        sweep.anomalies = len(rows)
+        sweep.alerts = sum(row["alert"] for row in rows)
+        sweep.status = "success"
+    except Exception:
+        session.rollback()
+        sweep.status = "failed"
+        raise
+    finally:
+        sweep.seconds = round(time.perf_counter() - started, 3)
+        sweep.finished_at = datetime.utcnow()
+        session.add(sweep)
+        session.commit()
+
+    _prune_sweeps(session)
+    metrics.observe("anomaly_sweep_seconds", sweep.seconds)
+    metrics.increment("anomaly_sweep_alerts", sweep.alerts)
+    print(f"ANOMALY SWEEP: {sweep.workflows} workflows, {sweep.series} series in {sweep.seconds:.2f}s "
+          f"({shards} shard(s)): {sweep.anomalies} anomalies, {sweep.alerts} new alert(s).")
+    return sweep
+
+
+def _prune_sweeps(session: Session):
+    """Keeps the last ANOMALY_SWEEP_KEEP sweeps."""
+    kept = session.execute(select(AnomalySweep.id).order_by(AnomalySweep.id.desc()).limit(ANOMALY_SWEEP_KEEP)).scalars().all()
+    if len(kept) < ANOMALY_SWEEP_KEEP:
+        return
+    oldest_kept = min(kept)
+    session.execute(delete(SweepAnomaly).where(SweepAnomaly.sweep_id < oldest_kept))
+    session.execute(delete(AnomalySweep).where(AnomalySweep.id < oldest_kept))
+    session.commit()
+
+
+def latest_alerts(session: Session, merchant_id: Optional[int] = None, limit: int = 100) -> List[SweepAnomaly]:
+    """Alert candidates of the most recent successful sweep (optionally one merchant's), strongest first."""
+    latest = session.execute(
+        select(AnomalySweep.id).where(AnomalySweep.status == "success").order_by(AnomalySweep.id.desc()).limit(1)
+    ).scalar()
+    if latest is None:
+        return []
+    stmt = select(SweepAnomaly).where(SweepAnomaly.sweep_id == latest, SweepAnomaly.alert == True)
+    if merchant_id is not None:
+        stmt = stmt.where(SweepAnomaly.merchant_id == merchant_id)
+    return sorted(session.execute(stmt).scalars(), key=lambda anomaly: -abs(anomaly.z_score))[:limit]
+
+
+if __name__ == "__main__":
+    from database import DATABASE_URL, engine
+
+    parser = argparse.ArgumentParser(description="Run one fleet-wide KPI anomaly sweep.")
+    parser.add_argument("--shards", type=int, default=ANOMALY_SWEEP_SHARDS)
+    args = parser.parse_args()
+
+    AnomalySweep.__table__.create(engine, checkfirst=True)
+    SweepAnomaly.__table__.create(engine, checkfirst=True)
+    with Session(engine) as session:
+        run_sweep(session, DATABASE_URL, shards=args.shards)
@@ -0,0 +1,247 @@
+# backend/services/attachment_parser.py
+import gzip
+import io
+import os
+import zipfile
+import pandas as pd
+from typing import Dict, Iterator, List, Optional, Tuple, BinaryIO
+
+
+# Columns the pipeline actually uses (SalesDataMixin); everything else is skipped at read time
+KNOWN_COLUMNS = [
+    'order_id', 'product_id', 'customer_id', 'order_qty',
+    'delivery_qty', 'delivery_date', 'on_time', 'in_full',
+]
+# IDs are kept as text (no numeric inference, leading zeros survive)
+KNOWN_DTYPES = {'order_id': str, 'product_id': str, 'customer_id': str}
+
+# Optional faster engines. Missing packages just fall back to pandas defaults.
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "calamine")
+except ImportError:
+    EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "openpyxl")
+
+try:
+    import pyarrow  # noqa: F401
+    import pyarrow.ipc
+    import pyarrow.parquet
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+FORMAT_CSV = 'csv'
+FORMAT_XLSX = 'xlsx'
+FORMAT_XLS = 'xls'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+FORMAT_ARROW_STREAM = 'arrow_stream'
+FORMAT_GZIP = 'gzip'
+FORMAT_ZIP = 'zip'
+
+EXTENSION_FORMATS = {
+    '.csv': FORMAT_CSV, '.txt': FORMAT_CSV,
+    '.xlsx': FORMAT_XLSX, '.xlsm': FORMAT_XLSX, '.xls': FORMAT_XLS,
+    '.parquet': FORMAT_PARQUET, '.pq': FORMAT_PARQUET,
+    '.arrow': FORMAT_ARROW, '.feather': FORMAT_ARROW, '.ipc': FORMAT_ARROW,
+    '.gz': FORMAT_GZIP, '.zip': FORMAT_ZIP,
+}
+
+
+def normalize_column(name) -> str:
+    """Same rule as clean_sales_frame: lower case, spaces to underscores."""
+    return str(name).lower().replace(' ', '_')
+
+
+def sniff_format(head: bytes, file_name: str = '') -> Optional[str]:
+    """Detects the container/format from magic bytes, falling back to the file extension."""
+    if head.startswith(b'PK\x03\x04'):
+        return FORMAT_ZIP # xlsx is a zip too; _open_zip tells them apart
+    if head.startswith(b'\xd0\xcf\x11\xe0'):
+        return FORMAT_XLS
+    if head.startswith(b'\x1f\x8b'):
+        return FORMAT_GZIP
+    if head.startswith(b'PAR1'):
+        return FORMAT_PARQUET
+    if head.startswith(b'ARROW1'):
+        return FORMAT_ARROW
+    if head.startswith(b'\xff\xff\xff\xff'):
+        return FORMAT_ARROW_STREAM
+
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension in EXTENSION_FORMATS:
+        return EXTENSION_FORMATS[extension]
+
+    # No magic bytes and no known extension: accept it as CSV if it looks like text
+    try:
+        head.decode('utf-8')
+        return FORMAT_CSV
+    except UnicodeDecodeError:
+        return None
+
+
+def _open_zip(stream: BinaryIO, file_name: str) -> Tuple[BinaryIO, str, str]:
+    """Resolves a zip to either an xlsx workbook or the first data file inside the archive."""
+    archive = zipfile.ZipFile(stream)
+    names = archive.namelist()
+    if '[Content_Types].xml' in names and any(name.startswith('xl/') for name in names):
+        stream.seek(0)
+        return stream, FORMAT_XLSX, file_name
+
+    members = [name for name in names if not name.endswith('/') and not name.startswith('__MACOSX')]
+    if not members:
+        raise ValueError(f"Zip attachment '{file_name}' contains no files")
+    return archive.open(members[0]), None, members[0]
+
+
+def open_attachment(raw_data: bytes, file_name: str) -> Tuple[BinaryIO, str]:
+    """
+    Returns (readable stream, format) for an attachment, unwrapping gzip/zip containers
+    without materializing the decompressed bytes.
+    """
+    stream: BinaryIO = io.BytesIO(raw_data)
+    name = file_name or ''
+
+    # Up to two wrapper levels (e.g. a zip containing a .csv.gz)
+    for _ in range(3):
+        head = stream.read(8)
+        stream.seek(0)
+        detected = sniff_format(head, name)
+
+        if detected == FORMAT_GZIP:
+            stream = gzip.GzipFile(fileobj=stream)
+            name = name[:-3] if name.lower().endswith('.gz') else name
+            continue
+        if detected == FORMAT_ZIP:
+            stream, inner_format, name = _open_zip(stream, name)
+            if inner_format:
+                return stream, inner_format
+            continue
+        if detected is None:
+            raise ValueError(f"Unsupported file type: {file_name}")
+        return stream, detected
+
+    raise ValueError(f"Too many nested archives in attachment: {file_name}")
+
+
+def _read_options(header) -> Dict:
+    """usecols/dtype keyed by the file's own column names (all columns if none is recognised)."""
+    usecols = [name for name in header if normalize_column(name) in KNOWN_COLUMNS] or None
+    dtype = {name: KNOWN_DTYPES[normalize_column(name)] for name in header if normalize_column(name) in KNOWN_DTYPES}
+    return {'usecols': usecols, 'dtype': dtype}
+
+
+def _csv_read_options(stream: BinaryIO) -> Dict:
+    """Reads just the header to build usecols/dtype keyed by the file's own column names."""
+    header = pd.read_csv(stream, nrows=0).columns
+    stream.seek(0)
+    return _read_options(header)
+
+
+def _excel_read_options(stream: BinaryIO, engine: Optional[str]) -> Dict:
+    """Same as _csv_read_options for the first sheet of a workbook."""
+    header = pd.read_excel(stream, engine=engine, nrows=0).columns
+    stream.seek(0)
+    return _read_options(header)
+
+
+def _known_excel_column(name) -> bool:
+    return normalize_column(name) in KNOWN_COLUMNS
+
+
+def _arrow_columns(names: List[str]) -> Optional[List[str]]:
+    selected = [name for name in names if normalize_column(name) in KNOWN_COLUMNS]
+    return selected or None
+
+
+def read_attachment(raw_data: bytes, file_name: str) -> pd.DataFrame:
+    """Reads a whole attachment into one DataFrame using the fastest available reader."""
+    stream, file_format = open_attachment(raw_data, file_name)
+
+    if file_format == FORMAT_CSV:
+        options = _csv_read_options(stream)
+        if HAS_PYARROW:
+            options['engine'] = 'pyarrow'
+        return pd.read_csv(stream, **options)
+
+    if file_format in (FORMAT_XLSX, FORMAT_XLS):
+        engine = EXCEL_ENGINE if file_format == FORMAT_XLSX or EXCEL_ENGINE == 'calamine' else None
+        return pd.read_excel(stream, engine=engine, **_excel_read_options(stream, engine))
+
+    if file_format == FORMAT_PARQUET:
+        if not HAS_PYARROW:
+            raise ValueError("Parquet attachments require pyarrow")
+        schema_names = pyarrow.parquet.ParquetFile(stream).schema_arrow.names
+        stream.seek(0)
+        return pd.read_parquet(stream, columns=_arrow_columns(schema_names))
+
+    if file_format in (FORMAT_ARROW, FORMAT_ARROW_STREAM):
+        if not HAS_PYARROW:
+            raise ValueError("Arrow attachments require pyarrow")
+        reader = pyarrow.ipc.open_file(stream) if file_format == FORMAT_ARROW else pyarrow.ipc.open_stream(stream)
+        table = reader.read_all()
+        columns = _arrow_columns(table.column_names)
+        return (table.select(columns) if columns else table).to_pandas()
+
+    raise ValueError(f"Unsupported file type: {file_format}")
+
+
+def _iter_xlsx_rows(stream: BinaryIO, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Walks the first sheet with openpyxl's read-only row iterator, chunk_size rows at a time."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f"unnamed_{i}" for i, name in enumerate(header)]
+        keep = [i for i, name in enumerate(columns) if _known_excel_column(name)] or list(range(len(columns)))
+        kept_columns = [columns[i] for i in keep]
+
+        batch: List[tuple] = []
+        for row in rows:
+            batch.append(tuple(row[i] if i < len(row) else None for i in keep))
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame(batch, columns=kept_columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=kept_columns)
+    finally:
+        workbook.close()
+
+
+def iter_attachment(raw_data: bytes, file_name: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Streaming counterpart of read_attachment: yields raw frames of at most chunk_size rows."""
+    stream, file_format = open_attachment(raw_data, file_name)
+
+    if file_format == FORMAT_CSV:
+        yield from pd.read_csv(stream, chunksize=chunk_size, **_csv_read_options(stream))
+    elif file_format == FORMAT_XLSX:
+        yield from _iter_xlsx_rows(stream, chunk_size)
+    elif file_format == FORMAT_PARQUET:
+        if not HAS_PYARROW:
+            raise ValueError("Parquet attachments require pyarrow")
+        parquet_file = pyarrow.parquet.ParquetFile(stream)
+        columns = _arrow_columns(parquet_file.schema_arrow.names)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    elif file_format in (FORMAT_ARROW, FORMAT_ARROW_STREAM):
+        if not HAS_PYARROW:
+            raise ValueError("Arrow attachments require pyarrow")
+        if file_format == FORMAT_ARROW:
+            reader = pyarrow.ipc.open_file(stream)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        else:
+            batches = pyarrow.ipc.open_stream(stream)
+        for batch in batches:
+            columns = _arrow_columns(batch.schema.names)
+            frame = (batch.select(columns) if columns else batch).to_pandas()
+            for start in range(0, len(frame), chunk_size):
+                yield frame.iloc[start:start + chunk_size]
+    else:
+        # Legacy binary Excel has no row iterator; read once and slice
+        df = read_attachment(raw_data, file_name)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
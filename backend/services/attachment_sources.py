@@ -0,0 +1,235 @@
+# backend/services/attachment_sources.py
+"""
+Where a workflow's attachments come from. Gmail is the production source; the
+directory/maildir drop folder and the in-memory source let the whole
+fetch -> parse -> ingest path run offline (load tests, soak tests, local dev).
+
+Every source hands out FetchedMessage objects oldest first, with message ids that
+sort in delivery order, so the workflow's last_processed_email_id works as a cursor
+no matter where the files come from.
+"""
+import email
+import fnmatch
+import itertools
+import os
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from email import policy
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+SOURCE_GMAIL = "gmail"
+SOURCE_DIRECTORY = "directory"
+SOURCE_MEMORY = "memory"
+SOURCE_TYPES = (SOURCE_GMAIL, SOURCE_DIRECTORY, SOURCE_MEMORY)
+# Directory sources are confined to <root>/<merchant_id>/ (tenants cannot point a workflow at
+# arbitrary server paths). Unset: workflows created through the API cannot use directory sources.
+ATTACHMENT_DIRECTORY_ROOT = os.getenv("ATTACHMENT_DIRECTORY_ROOT")
+
+
+@dataclass
+class FetchedMessage:
+    """One email (or dropped file) and all of its attachments, in the order ingestion must follow."""
+    message_id: str
+    internal_date: int = 0 # epoch millis
+    attachments: List[Tuple[bytes, str]] = field(default_factory=list) # (data, file_name) in MIME order
+    error: Optional[str] = None
+
+
+class AttachmentSource(ABC):
+    """A place a workflow can pull attachments from."""
+
+    @abstractmethod
+    def fetch_new(self, workflow, since_message_id: Optional[str],
+                  max_messages: Optional[int] = None) -> Iterator[FetchedMessage]:
+        """
+        Messages for this workflow newer than since_message_id, oldest first.
+        Without a cursor only the newest message is returned (a first run never replays history).
+        """
+
+    def fetch_latest(self, workflow) -> Optional[FetchedMessage]:
+        """The newest message for this workflow, or None."""
+        return next(iter(self.fetch_new(workflow, None)), None)
+
+
+def _select_new(entries: List[Tuple[str, str]], since_message_id: Optional[str],
+                max_messages: Optional[int]) -> List[Tuple[str, str]]:
+    """Cursor logic shared by the local sources: entries are (sortable message_id, payload) pairs."""
+    entries = sorted(entries)
+    if since_message_id is None:
+        return entries[-1:]
+    entries = [entry for entry in entries if entry[0] > since_message_id]
+    return entries[:max_messages] if max_messages else entries
+
+
+class GmailAttachmentSource(AttachmentSource):
+    """Messages matching the workflow's trigger_subject/trigger_sender in the connected Gmail account."""
+
+    def __init__(self, user_id: str = 'me'):
+        self.user_id = user_id
+
+    def fetch_new(self, workflow, since_message_id, max_messages=None):
+        # Imported lazily so the local sources work without the Google client libraries
+        from services.gmail_monitor import download_backlog, GMAIL_BACKLOG_MAX_MESSAGES
+        from services.workflow_runner import build_search_query
+
+        return download_backlog(build_search_query(workflow), since_message_id, user_id=self.user_id,
+                                max_messages=max_messages or GMAIL_BACKLOG_MAX_MESSAGES)
+
+    def fetch_message(self, message_id: str) -> FetchedMessage:
+        """A specific message, e.g. one matched by mailbox sync."""
+        from services.gmail_monitor import fetch_message_attachments
+        return fetch_message_attachments(message_id, self.user_id)
+
+
+class DirectoryAttachmentSource(AttachmentSource):
+    """
+    A drop folder on local disk. Each file matching `pattern` is one message with one
+    attachment. If the folder is a maildir (has new/ or cur/), each file is an RFC 822
+    email and every named MIME part becomes an attachment.
+    """
+
+    def __init__(self, path: str, pattern: str = '*'):
+        self.path = path
+        self.pattern = pattern
+
+    @property
+    def is_maildir(self) -> bool:
+        return any(os.path.isdir(os.path.join(self.path, sub)) for sub in ('new', 'cur'))
+
+    def _entries(self) -> List[Tuple[str, str]]:
+        folders = [os.path.join(self.path, sub) for sub in ('new', 'cur')] if self.is_maildir else [self.path]
+        entries = []
+        for folder in folders:
+            if not os.path.isdir(folder):
+                continue
+            for entry in os.scandir(folder):
+                if entry.name.startswith('.') or not entry.is_file() or not fnmatch.fnmatch(entry.name, self.pattern):
+                    continue
+                # Zero-padded mtime first, so ids sort (and compare against the cursor) by arrival
+                entries.append((f"{entry.stat().st_mtime_ns:020d}-{entry.name}", entry.path))
+        return entries
+
+    def _read(self, message_id: str, file_path: str) -> FetchedMessage:
+        internal_date = int(message_id.split('-', 1)[0]) // 1_000_000
+        try:
+            with open(file_path, 'rb') as handle:
+                raw = handle.read()
+        except OSError as error:
+            return FetchedMessage(message_id, internal_date, error=str(error))
+
+        if not self.is_maildir:
+            return FetchedMessage(message_id, internal_date, [(raw, os.path.basename(file_path))])
+
+        message = email.message_from_bytes(raw, policy=policy.default)
+        attachments = [
+            (part.get_payload(decode=True), part.get_filename())
+            for part in message.walk()
+            if part.get_filename() and not part.is_multipart()
+        ]
+        return FetchedMessage(message_id, internal_date, attachments)
+
+    def fetch_new(self, workflow, since_message_id, max_messages=None):
+        for message_id, file_path in _select_new(self._entries(), since_message_id, max_messages):
+            yield self._read(message_id, file_path)
+
+
+class InMemoryAttachmentSource(AttachmentSource):
+    """
+    Attachments held in memory, optionally produced by a generator function
+    (e.g. synthetic sales files for load tests). Thread-safe, so a producer can keep
+    adding messages while the scheduler consumes them.
+    """
+
+    def __init__(self, generator: Optional[Callable[[int], List[Tuple[bytes, str]]]] = None, count: int = 0):
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._messages: Dict[str, FetchedMessage] = {}
+        if generator is not None:
+            self.extend(generator(i) for i in range(count))
+
+    def add_message(self, attachments: List[Tuple[bytes, str]]) -> FetchedMessage:
+        with self._lock:
+            sequence = next(self._counter)
+            message = FetchedMessage(f"mem-{sequence:012d}", sequence, list(attachments))
+            self._messages[message.message_id] = message
+            return message
+
+    def extend(self, messages: Iterable[List[Tuple[bytes, str]]]):
+        for attachments in messages:
+            self.add_message(attachments)
+
+    def fetch_new(self, workflow, since_message_id, max_messages=None):
+        with self._lock:
+            entries = list(self._messages.items())
+        for _, message in _select_new(entries, since_message_id, max_messages):
+            yield message
+
+
+def merchant_directory_root(merchant_id: int) -> Optional[str]:
+    """The folder a merchant's directory sources must live in, or None if directory sources are disabled."""
+    if not ATTACHMENT_DIRECTORY_ROOT:
+        return None
+    return os.path.join(os.path.realpath(ATTACHMENT_DIRECTORY_ROOT), str(merchant_id))
+
+
+def _check_directory_path(path: str, merchant_id: int):
+    """Raises ValueError unless path resolves (symlinks included) inside the merchant's directory root."""
+    root = merchant_directory_root(merchant_id)
+    if root is None:
+        raise ValueError("Directory sources are disabled (ATTACHMENT_DIRECTORY_ROOT is not set)")
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([resolved, root]) != root:
+        raise ValueError(f"Directory source path must be inside {root}")
+
+
+def check_api_source(source_type: Optional[str], source_config: Optional[Dict], merchant_id: int):
+    """
+    Source settings a merchant may set through the API: Gmail, or a directory inside their own
+    directory root. In-memory sources are for load tests and are only configured in code.
+    Raises ValueError otherwise.
+    """
+    source_type = (source_type or SOURCE_GMAIL).lower()
+    config = source_config or {}
+    if source_type == SOURCE_GMAIL:
+        return
+    if source_type == SOURCE_DIRECTORY:
+        if not config.get('path'):
+            raise ValueError("Directory sources need source_config.path")
+        _check_directory_path(config['path'], merchant_id)
+        return
+    raise ValueError(f"Attachment source '{source_type}' cannot be configured through the API")
+
+
+# In-memory sources are referenced from Workflow.source_config by name
+_MEMORY_SOURCES: Dict[str, InMemoryAttachmentSource] = {}
+
+
+def register_memory_source(name: str, source: InMemoryAttachmentSource) -> InMemoryAttachmentSource:
+    """Makes an in-memory source available to workflows with source_config {"name": name}."""
+    _MEMORY_SOURCES[name] = source
+    return source
+
+
+def get_attachment_source(workflow) -> AttachmentSource:
+    """Builds the source configured on a workflow (source_type + source_config). Defaults to Gmail."""
+    source_type = (workflow.source_type or SOURCE_GMAIL).lower()
+    config = workflow.source_config or {}
+
+    if source_type == SOURCE_GMAIL:
+        return GmailAttachmentSource(config.get('user_id', 'me'))
+    if source_type == SOURCE_DIRECTORY:
+        if not config.get('path'):
+            raise ValueError(f"Workflow {workflow.id}: directory source needs source_config.path")
+        if ATTACHMENT_DIRECTORY_ROOT:
+            # Also enforced at run time, for workflows saved before the root was configured
+            _check_directory_path(config['path'], workflow.user_id)
+            return DirectoryAttachmentSource(os.path.join(merchant_directory_root(workflow.user_id), config['path']),
+                                             config.get('pattern', '*'))
+        return DirectoryAttachmentSource(config['path'], config.get('pattern', '*'))
+    if source_type == SOURCE_MEMORY:
+        name = config.get('name', 'default')
+        if name not in _MEMORY_SOURCES:
+            raise ValueError(f"Workflow {workflow.id}: in-memory source '{name}' is not registered")
+        return _MEMORY_SOURCES[name]
+    raise ValueError(f"Workflow {workflow.id}: unknown attachment source '{workflow.source_type}'")
@@ -0,0 +1,207 @@
+# backend/services/cache.py
+"""
+Two-tier response cache: a per-process LRU with TTL, plus an optional shared tier
+(Redis, when CACHE_REDIS_URL is set and the redis package is installed) so that a
+payload computed by one API worker is reused by all of them.
+
+Keys embed the data version they were computed from (Workflow.data_version, bumped
+after every ingestion that wrote rows), so new data invalidates by changing the key;
+superseded entries simply age out of the LRU / expire in Redis. Concurrent misses on
+the same key are coalesced: one caller computes, the others wait for its result.
+
+Hits, misses and their latencies are recorded in services.metrics as
+cache_<name>_hits / _shared_hits / _misses / _coalesced, the cache_<name>_hit_ratio
+gauge and the cache_<name>_hit_seconds / _miss_seconds timings.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from models.workflow import Workflow
+from services.metrics import metrics
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+# How long a coalesced caller waits for the computing caller before computing itself
+CACHE_COMPUTE_WAIT_SECONDS = float(os.getenv("CACHE_COMPUTE_WAIT_SECONDS", "60"))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisTier:
+    """Shared tier storing JSON values. Redis errors count as misses; they never fail a request."""
+
+    def __init__(self, client, prefix: str, ttl_seconds: float):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = int(ttl_seconds)
+
+    def get(self, key: str) -> Any:
+        try:
+            raw = self.client.get(f"{self.prefix}:{key}")
+        except Exception as error:
+            print(f"CACHE: Shared tier read failed: {error}")
+            return _MISSING
+        return _MISSING if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any):
+        try:
+            self.client.set(f"{self.prefix}:{key}", json.dumps(value, default=str), ex=self.ttl_seconds)
+        except Exception as error:
+            print(f"CACHE: Shared tier write failed: {error}")
+
+
+def shared_tier_from_env(prefix: str, ttl_seconds: float) -> Optional[RedisTier]:
+    """A RedisTier if CACHE_REDIS_URL is configured and redis is installed, else None (local tier only)."""
+    if not CACHE_REDIS_URL:
+        return None
+    try:
+        import redis
+    except ImportError:
+        print("CACHE: CACHE_REDIS_URL is set but the 'redis' package is not installed. Using the local tier only.")
+        return None
+    return RedisTier(redis.Redis.from_url(CACHE_REDIS_URL), prefix, ttl_seconds)
+
+
+class ResponseCache:
+    """Local LRU in front of an optional shared tier, with single-flight computation per key."""
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl_seconds: float = 3600,
+                 shared: Optional[RedisTier] = None):
+        self.name = name
+        self.local = LRUCache(max_entries, ttl_seconds)
+        self.shared = shared
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+
+    def _record(self, hit: bool, seconds: float):
+        with self._lock:
+            self._lookups += 1
+            self._hits += int(hit)
+            ratio = self._hits / self._lookups
+        metrics.observe(f"cache_{self.name}_{'hit' if hit else 'miss'}_seconds", seconds)
+        metrics.set_gauge(f"cache_{self.name}_hit_ratio", round(ratio, 4))
+
+    def _lookup(self, key: str) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            metrics.increment(f"cache_{self.name}_hits")
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not _MISSING:
+                self.local.set(key, value)
+                metrics.increment(f"cache_{self.name}_shared_hits")
+        return value
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Returns the cached value for key, computing (once, across concurrent callers) on a miss."""
+        start = time.perf_counter()
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self._record(True, time.perf_counter() - start)
+            return value
+
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+
+        if not leader:
+            # Someone else is computing this key: wait for it instead of recomputing
+            metrics.increment(f"cache_{self.name}_coalesced")
+            event.wait(CACHE_COMPUTE_WAIT_SECONDS)
+            value = self.local.get(key, _MISSING)
+            if value is not _MISSING:
+                self._record(True, time.perf_counter() - start)
+                return value
+
+        metrics.increment(f"cache_{self.name}_misses")
+        try:
+            value = compute()
+            self.local.set(key, value)
+            if self.shared is not None:
+                self.shared.set(key, value)
+        finally:
+            if leader:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+        self._record(False, time.perf_counter() - start)
+        return value
+
+    def clear(self):
+        self.local.clear()
+
+
+# --- Data versions (the invalidation side) ---
+
+def bump_data_version(session: Session, workflow_id: int):
+    """Marks a workflow's data as changed. Call after the ingested rows are committed."""
+    session.execute(
+        update(Workflow).where(Workflow.id == workflow_id).values(data_version=Workflow.data_version + 1)
+    )
+    session.commit()
+
+
+def data_version_key(session: Session, merchant_id: int, workflow_id: Optional[int] = None) -> str:
+    """
+    Version component of a cache key: the workflow's data_version, or for merchant-wide
+    results a digest of every (workflow id, data_version) pair the merchant owns.
+    """
+    if workflow_id is not None:
+        version = session.exec(select(Workflow.data_version).where(Workflow.id == workflow_id)).first()
+        return f"v{version or 0}"
+    pairs = session.exec(
+        select(Workflow.id, Workflow.data_version).where(Workflow.user_id == merchant_id).order_by(Workflow.id)
+    ).all()
+    digest = hashlib.sha1(",".join(f"{wid}:{version}" for wid, version in pairs).encode()).hexdigest()[:16]
+    return f"all-{digest}"
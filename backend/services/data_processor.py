@@ -1,7 +1,13 @@
 # backend/services/data_processor.py
 import pandas as pd
-import io
 import os
+from typing import Iterator
+
+from services.attachment_parser import read_attachment, iter_attachment
+
+
+# Rows per chunk in streaming mode. Peak memory of the pipeline scales with this, not the file size.
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "50000"))
 
 
 def create_dummy_dataframe():
@@ -19,9 +25,20 @@ def create_dummy_dataframe():
     return pd.DataFrame(data)
 
 
+def clean_sales_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Data Cleaning and Transformation (T in ETL), shared by the full and streaming readers."""
+    # 1. Standardize/Rename columns (CRUCIAL step for ingestion)
+    df.columns = df.columns.astype(str).str.lower().str.replace(' ', '_')
+
+    # 2. Types and missing values are left to validate_sales_frame: a bad or missing cell
+    # rejects (and reports) that row instead of failing the whole file or becoming 0
+    return df
+
+
 def process_attachment_data(raw_data: bytes, file_name: str):
     """
-    Reads raw attachment data (Excel/CSV) into a Pandas DataFrame,
+    Reads raw attachment data (Excel/CSV/Parquet/Arrow, optionally gzip/zip wrapped)
+    into a Pandas DataFrame,
     performing initial validation/cleaning.
     """
     if not raw_data:
@@ -32,40 +49,29 @@ def process_attachment_data(raw_data: bytes, file_name: str):
         return df
         
         
-    # Determine file type based on extension
-    file_extension = os.path.splitext(file_name)[1].lower()
-
     try:
-        data_io = io.BytesIO(raw_data)
-        
-        if file_extension in ['.xlsx', '.xls']:
-            df = pd.read_excel(data_io)
-        elif file_extension == '.csv':
-            # Use appropriate encoding if needed, or stick to utf-8 default
-            df = pd.read_csv(data_io)
-        else:
-            print(f"ERROR: Unsupported file type: {file_extension}")
-            return None
+        # Format is sniffed from the bytes (gzip/zip wrappers, Parquet/Arrow supported)
+        df = read_attachment(raw_data, file_name)
             
-        # --- Data Cleaning and Transformation (T in ETL) ---
-        
-        # 1. Standardize/Rename columns (CRUCIAL step for ingestion)
-        df.columns = df.columns.str.lower().str.replace(' ', '_')
-        
-        # 2. Basic Type Conversion (Ensure date and integer fields are correct)
-        # Assuming your attachment has columns like 'delivery_date', 'order_qty', 'revenue'
-        # NOTE: You MUST tailor these column names to your actual incoming files.
-        if 'delivery_date' in df.columns:
-            df['delivery_date'] = pd.to_datetime(df['delivery_date'], errors='coerce')
-        if 'order_qty' in df.columns:
-            df['order_qty'] = df['order_qty'].fillna(0).astype(int)
-
-        # 3. Drop rows with critical missing data (simple validation)
-        df = df.dropna(subset=['order_id', 'product_id'])
+        df = clean_sales_frame(df)
 
         print(f"SUCCESS: Data loaded into DataFrame. Shape: {df.shape}")
         return df
         
     except Exception as e:
         print(f"ERROR: Failed to process data file: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def iter_attachment_chunks(raw_data: bytes, file_name: str, chunk_size: int = INGEST_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Streaming counterpart of process_attachment_data: yields cleaned DataFrames of at most
+    chunk_size rows so a large attachment never has to be materialized as one frame.
+    Raises ValueError for unsupported file types; parse errors propagate to the caller.
+    """
+    chunks = iter_attachment(raw_data, file_name, chunk_size)
+
+    for chunk in chunks:
+        cleaned = clean_sales_frame(chunk)
+        if not cleaned.empty:
+            yield cleaned
@@ -0,0 +1,123 @@
+# backend/services/data_validator.py
+import os
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Dict, Any, List
+
+
+# Upper bound for a single delivery line; anything above is treated as a data-entry error
+MAX_DELIVERY_QTY = int(os.getenv("MAX_DELIVERY_QTY", "1000000"))
+# How many rejected rows are kept on the WorkflowLog as a sample
+REJECTED_SAMPLE_LIMIT = int(os.getenv("REJECTED_SAMPLE_LIMIT", "50"))
+
+KEY_COLUMNS = ['order_id', 'product_id', 'customer_id']
+QTY_COLUMNS = ['order_qty', 'delivery_qty']
+FLAG_COLUMNS = ['on_time', 'in_full']
+REQUIRED_COLUMNS = KEY_COLUMNS + QTY_COLUMNS + ['delivery_date'] + FLAG_COLUMNS
+
+
+@dataclass
+class ValidationResult:
+    """Outcome of validate_sales_frame: the rows to ingest, the rows to report, and why."""
+    accepted: pd.DataFrame
+    rejected: pd.DataFrame
+    rule_counts: Dict[str, int] = field(default_factory=dict)
+    missing_columns: List[str] = field(default_factory=list)
+
+    @property
+    def rejected_count(self) -> int:
+        return len(self.rejected)
+
+    def report(self) -> Dict[str, Any]:
+        """Compact, JSON-serialisable summary stored on the run's WorkflowLog."""
+        # Stringify so NaT/numpy types survive the JSON column; missing cells become null
+        sample = self.rejected.head(REJECTED_SAMPLE_LIMIT).astype(object).map(
+            lambda value: None if pd.isna(value) else str(value)
+        )
+        return {
+            "accepted": len(self.accepted),
+            "rejected": self.rejected_count,
+            "rule_counts": self.rule_counts,
+            "missing_columns": self.missing_columns,
+            "rejected_sample": sample.to_dict(orient='records'),
+        }
+
+
+def validate_sales_frame(df: pd.DataFrame) -> ValidationResult:
+    """
+    Checks the SalesDataMixin fields with column-level masks (no per-row Python)
+    and splits the frame into accepted and rejected parts in one pass.
+    Accepted rows come back with coerced types, ready for bulk ingestion.
+    """
+    missing_columns = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    frame = df.reindex(columns=list(df.columns) + missing_columns).copy()
+
+    rules: Dict[str, np.ndarray] = {}
+
+    # 1. Required keys must be present and non-blank
+    for column in KEY_COLUMNS:
+        values = frame[column]
+        blank = values.isna() | (values.astype(str).str.strip() == '')
+        rules[f"missing_{column}"] = blank.to_numpy()
+        frame[column] = values.astype(str).str.strip()
+
+    # 2. Quantities must be non-negative whole numbers
+    for column in QTY_COLUMNS:
+        numeric = pd.to_numeric(frame[column], errors='coerce')
+        rules[f"invalid_{column}"] = (numeric.isna() | (numeric % 1 != 0) | (numeric < 0)).to_numpy()
+        frame[column] = numeric
+
+    rules["delivery_qty_above_limit"] = (frame['delivery_qty'] > MAX_DELIVERY_QTY).to_numpy()
+
+    # 3. Flags are strictly 0/1
+    for column in FLAG_COLUMNS:
+        numeric = pd.to_numeric(frame[column], errors='coerce')
+        rules[f"invalid_{column}"] = (~numeric.isin([0, 1])).to_numpy()
+        frame[column] = numeric
+
+    # 4. Delivery date must parse
+    dates = pd.to_datetime(frame['delivery_date'], errors='coerce')
+    rules["invalid_delivery_date"] = dates.isna().to_numpy()
+    frame['delivery_date'] = dates
+
+    rule_names = list(rules)
+    rule_matrix = np.column_stack([rules[name] for name in rule_names]) if len(frame) else np.zeros((0, len(rule_names)), dtype=bool)
+    rejected_mask = rule_matrix.any(axis=1)
+
+    rule_counts = {name: int(count) for name, count in zip(rule_names, rule_matrix.sum(axis=0)) if count}
+
+    accepted = frame.loc[~rejected_mask].copy()
+    for column in QTY_COLUMNS + FLAG_COLUMNS:
+        accepted[column] = accepted[column].astype('int64')
+
+    # Rejected rows keep their original values; the first failing rule explains why
+    rejected = df.loc[rejected_mask].copy()
+    if rejected_mask.any():
+        first_rule = rule_matrix[rejected_mask].argmax(axis=1)
+        rejected['rejection_reason'] = np.array(rule_names)[first_rule]
+
+    if rule_counts:
+        print(f"VALIDATION: {int(rejected_mask.sum())} of {len(df)} rows rejected. Rule counts: {rule_counts}")
+
+    return ValidationResult(
+        accepted=accepted,
+        rejected=rejected,
+        rule_counts=rule_counts,
+        missing_columns=missing_columns,
+    )
+
+
+def merge_validation_reports(total: Dict[str, Any], report: Dict[str, Any]) -> Dict[str, Any]:
+    """Folds one chunk's report into a running total (streaming ingestion)."""
+    if not total:
+        return dict(report, rule_counts=dict(report["rule_counts"]), rejected_sample=list(report["rejected_sample"]))
+
+    total["accepted"] += report["accepted"]
+    total["rejected"] += report["rejected"]
+    for rule, count in report["rule_counts"].items():
+        total["rule_counts"][rule] = total["rule_counts"].get(rule, 0) + count
+    room = REJECTED_SAMPLE_LIMIT - len(total["rejected_sample"])
+    if room > 0:
+        total["rejected_sample"].extend(report["rejected_sample"][:room])
+    return total
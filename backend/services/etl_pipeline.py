@@ -0,0 +1,127 @@
+# backend/services/etl_pipeline.py
+import os
+import hashlib
+import zipfile
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, Iterator, Tuple, Type
+from sqlmodel import Session, select
+
+from models.attachment_model import ProcessedAttachment
+from models.sales_data_model import workflow_id_for_model
+from services.data_processor import process_attachment_data, iter_attachment_chunks, INGEST_CHUNK_SIZE
+from services.data_validator import validate_sales_frame, merge_validation_reports, ValidationResult
+from services.ingestion import ingest_data_frame
+from services.online_anomalies import score_batch
+from services.cache import bump_data_version
+
+
+# Attachments at or above this size are parsed/validated/inserted chunk by chunk
+STREAMING_THRESHOLD_BYTES = int(os.getenv("STREAMING_THRESHOLD_BYTES", str(20 * 1024 * 1024)))
+# Errors that mean the attachment itself is bad (a retry fails the same way). Anything else
+# (database, network) propagates, so the run fails and the run queue retries it.
+ATTACHMENT_ERRORS = (ValueError, KeyError, TypeError, IndexError, EOFError, zipfile.BadZipFile)
+
+
+@dataclass
+class IngestionSummary:
+    """Totals for one attachment, accumulated across chunks."""
+    rows_processed: int = 0
+    rows_inserted: int = 0
+    rows_rejected: int = 0
+    chunks: int = 0
+    validation_report: Dict[str, Any] = field(default_factory=dict)
+    # Set when a streaming run fails after some chunks were already committed
+    error: Optional[str] = None
+
+
+def attachment_content_hash(raw_data: bytes) -> str:
+    """SHA-256 of the raw attachment bytes; identical re-sent files hash the same."""
+    return hashlib.sha256(raw_data or b"").hexdigest()
+
+
+def find_processed_attachment(session: Session, workflow_id: int, content_hash: str) -> Optional[ProcessedAttachment]:
+    """Returns the earlier ingestion of this exact file for the workflow, if any."""
+    return session.exec(
+        select(ProcessedAttachment).where(
+            (ProcessedAttachment.workflow_id == workflow_id) & (ProcessedAttachment.content_hash == content_hash)
+        )
+    ).first()
+
+
+def record_processed_attachment(session: Session, workflow_id: int, content_hash: str, file_name: str,
+                                message_id: Optional[str], rows_inserted: int):
+    """Remembers a successfully ingested file. The caller commits together with its WorkflowLog."""
+    session.add(ProcessedAttachment(
+        workflow_id=workflow_id,
+        content_hash=content_hash,
+        source_filename=file_name,
+        message_id=message_id,
+        rows_inserted=rows_inserted,
+    ))
+
+
+def _validate_chunks(chunks: Iterator[pd.DataFrame]) -> Iterator[Tuple[pd.DataFrame, ValidationResult]]:
+    """Generator stage: cleaned chunk -> (chunk, validation result)."""
+    for chunk in chunks:
+        yield chunk, validate_sales_frame(chunk)
+
+
+def ingest_attachment(
+    session: Session,
+    merchant_id: int,
+    SalesDataModel: Type,
+    raw_data: bytes,
+    file_name: str,
+    streaming: Optional[bool] = None,
+    chunk_size: int = INGEST_CHUNK_SIZE,
+) -> Optional[IngestionSummary]:
+    """
+    Runs parse -> validate -> load for one attachment.
+    In streaming mode every chunk is committed on its own (ingest_data_frame commits),
+    so peak memory is bounded by chunk_size and progress is visible in the table.
+
+    Returns None if the attachment could not be parsed at all; summary.error is set if it
+    stopped part-way on bad data. Database and other unexpected errors are raised.
+    """
+    if streaming is None:
+        streaming = bool(raw_data) and len(raw_data) >= STREAMING_THRESHOLD_BYTES
+
+    if streaming:
+        chunks = iter_attachment_chunks(raw_data, file_name, chunk_size)
+    else:
+        df = process_attachment_data(raw_data, file_name)
+        if df is None:
+            return None
+        chunks = iter([df])
+
+    workflow_id = workflow_id_for_model(SalesDataModel)
+    summary = IngestionSummary()
+    touched_days = set() # scored once, after the last chunk
+    try:
+        for chunk, validation in _validate_chunks(chunks):
+            summary.rows_inserted += ingest_data_frame(validation.accepted, session, merchant_id, SalesDataModel,
+                                                       scored_days=touched_days)
+            summary.rows_processed += len(chunk)
+            summary.rows_rejected += validation.rejected_count
+            summary.chunks += 1
+            summary.validation_report = merge_validation_reports(summary.validation_report, validation.report())
+            if streaming:
+                print(f"INGEST: {file_name} chunk {summary.chunks} committed "
+                      f"({summary.rows_inserted} rows inserted so far).")
+    except ATTACHMENT_ERRORS as e:
+        session.rollback()
+        print(f"ERROR: Failed to process data file {file_name}: {e}")
+        if summary.chunks == 0:
+            return None
+        summary.error = str(e)
+
+    if touched_days and workflow_id is not None and summary.error is None:
+        # Every chunk is in: each day is scored once, on all of the file's orders for it
+        # (a file that stopped part-way is scored when the retry completes it)
+        score_batch(session, workflow_id, touched_days)
+        session.commit()
+    if summary.rows_inserted and workflow_id is not None:
+        # After the chunk commits: cached insights keyed on the old version are now stale
+        bump_data_version(session, workflow_id)
+    return summary
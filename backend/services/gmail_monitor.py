@@ -3,13 +3,20 @@
 import os
 import io
 import sys 
+import threading
+import httplib2
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from base64 import urlsafe_b64decode
 
+from services.attachment_sources import FetchedMessage
+
 # --- Import and Configuration Setup ---
 from dotenv import load_dotenv
 
@@ -35,70 +42,287 @@ CREDENTIALS_FILE_PATH = os.path.join(BACKEND_DIR, CREDENTIALS_FILENAME)
 TOKEN_FILE_PATH = os.path.join(BACKEND_DIR, TOKEN_FILENAME) 
 # -----------------------------
 
-def get_gmail_service():
-    """Initializes and returns the authorized Gmail API service."""
-    creds = None
+# Refresh the access token this long before it expires (avoids a 401 + retry mid-poll)
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("GMAIL_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+GMAIL_HTTP_TIMEOUT_SECONDS = int(os.getenv("GMAIL_HTTP_TIMEOUT_SECONDS", "60"))
+# Backlog mode: how many messages one poll may catch up on, and how many download in parallel
+GMAIL_BACKLOG_MAX_MESSAGES = int(os.getenv("GMAIL_BACKLOG_MAX_MESSAGES", "100"))
+GMAIL_DOWNLOAD_WORKERS = int(os.getenv("GMAIL_DOWNLOAD_WORKERS", "8"))
+
+# One download pool per process, shared by all polls: its threads (and the Gmail client each
+# one caches in GmailClientManager) outlive a single poll
+_download_pool = None
+_download_pool_lock = threading.Lock()
+
+
+def _get_download_pool() -> ThreadPoolExecutor:
+    global _download_pool
+    with _download_pool_lock:
+        if _download_pool is None:
+            _download_pool = ThreadPoolExecutor(max_workers=max(1, GMAIL_DOWNLOAD_WORKERS),
+                                                thread_name_prefix="gmail-download")
+        return _download_pool
+
+
+def _authorize_interactively():
+    """Runs the one-time console OAuth flow. Returns credentials, or None if credentials.json is missing."""
+    # --- START MANUAL AUTHORIZATION FLOW (Requires: credentials.json) ---
+    print("INFO: Initiating NEW Gmail API Authorization Flow...")
+    try:
+        # Use the absolute path for the credentials file
+        flow = InstalledAppFlow.from_client_secrets_file(
+            CREDENTIALS_FILE_PATH, SCOPES)
+    except FileNotFoundError:
+        print(f"\nFATAL ERROR: Credentials file '{CREDENTIALS_FILENAME}' not found.")
+        print(f"Please ensure it is located at: {CREDENTIALS_FILE_PATH}")
+        # Exiting cleanly to prevent the 500 error propagation
+        return None
+
+    # Set the redirect URI for console apps
+    flow.redirect_uri = 'urn:ietf:wg:oauth:2.0:oob'
     
-    # 1. Check for existing token.json file using the full path
-    if os.path.exists(TOKEN_FILE_PATH):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE_PATH, SCOPES)
-        
-    # 2. Handle token expiration or absence
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            print("INFO: Refreshing Gmail API token...")
-            creds.refresh(Request())
-        else:
-            # --- START MANUAL AUTHORIZATION FLOW (Requires: credentials.json) ---
-            print("INFO: Initiating NEW Gmail API Authorization Flow...")
-            try:
-                # Use the absolute path for the credentials file
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    CREDENTIALS_FILE_PATH, SCOPES)
-            except FileNotFoundError:
-                print(f"\nFATAL ERROR: Credentials file '{CREDENTIALS_FILENAME}' not found.")
-                print(f"Please ensure it is located at: {CREDENTIALS_FILE_PATH}")
-                # Exiting cleanly to prevent the 500 error propagation
-                return None
-
-            # Set the redirect URI for console apps
-            flow.redirect_uri = 'urn:ietf:wg:oauth:2.0:oob'
-            
-            auth_url, _ = flow.authorization_url(prompt='consent')
-            
-            print("\n----------------------------------------------------------------------")
-            print("🚨 MANUAL AUTHENTICATION REQUIRED 🚨")
-            print("1. Copy the following URL and open it in your web browser:")
-            print(f"\n   {auth_url}\n")
-            print("2. Sign in to your Gmail account and GRANT permission.")
-            print("3. Google will show you a code (the authorization code).")
-            code = input("4. PASTE the authorization code here and press Enter: ")
-            
-            # Exchange the code for the token
-            flow.fetch_token(code=code)
-            creds = flow.credentials
-            print("SUCCESS: Token retrieved and saved.")
-            # --- END MANUAL AUTHORIZATION FLOW ---
-            
-        # 3. Save the new/refreshed credentials using the full path
+    auth_url, _ = flow.authorization_url(prompt='consent')
+    
+    print("\n----------------------------------------------------------------------")
+    print("🚨 MANUAL AUTHENTICATION REQUIRED 🚨")
+    print("1. Copy the following URL and open it in your web browser:")
+    print(f"\n   {auth_url}\n")
+    print("2. Sign in to your Gmail account and GRANT permission.")
+    print("3. Google will show you a code (the authorization code).")
+    code = input("4. PASTE the authorization code here and press Enter: ")
+    
+    # Exchange the code for the token
+    flow.fetch_token(code=code)
+    print("SUCCESS: Token retrieved and saved.")
+    # --- END MANUAL AUTHORIZATION FLOW ---
+    return flow.credentials
+
+
+class GmailClientManager:
+    """
+    Process-wide Gmail client shared by the scheduler and the API routes.
+
+    Credentials are loaded once and refreshed only when they are close to expiry
+    (under a lock, so concurrent jobs never refresh twice). Each thread keeps its own
+    service object on top of a persistent httplib2 connection, because httplib2 is
+    not thread-safe; the discovery document comes from the bundled static copy.
+    """
+
+    def __init__(self, refresh_margin_seconds: int = TOKEN_REFRESH_MARGIN_SECONDS):
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._creds = None
+
+    def _needs_refresh(self, creds) -> bool:
+        if not creds.valid:
+            return True
+        # google-auth stores expiry as naive UTC
+        return creds.expiry is not None and creds.expiry - datetime.utcnow() < self.refresh_margin
+
+    def _save(self, creds):
         with open(TOKEN_FILE_PATH, 'w') as token:
             token.write(creds.to_json())
-            
-    # 4. Build and return the service object
-    service = build('gmail', 'v1', credentials=creds)
-    return service
+
+    def get_credentials(self):
+        """Returns valid credentials, touching token.json only on first use or refresh."""
+        with self._lock:
+            if self._creds is None:
+                creds = None
+                if os.path.exists(TOKEN_FILE_PATH):
+                    creds = Credentials.from_authorized_user_file(TOKEN_FILE_PATH, SCOPES)
+                if not creds or (not creds.valid and not creds.refresh_token):
+                    creds = _authorize_interactively()
+                    if creds is None:
+                        return None
+                    self._save(creds)
+                self._creds = creds
+
+            if self._needs_refresh(self._creds) and self._creds.refresh_token:
+                print("INFO: Refreshing Gmail API token...")
+                # Refreshes in place, so every thread's AuthorizedHttp sees the new token
+                self._creds.refresh(Request())
+                self._save(self._creds)
+
+            return self._creds
+
+    def get_service(self):
+        """Returns this thread's authorized Gmail service, building it once per thread."""
+        creds = self.get_credentials()
+        if creds is None:
+            return None
+
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT_SECONDS))
+            service = build('gmail', 'v1', http=http, cache_discovery=False, static_discovery=True)
+            self._local.service = service
+        return service
+
+    def reset(self):
+        """Drops cached credentials (e.g. after token.json was replaced by a manual re-auth)."""
+        with self._lock:
+            self._creds = None
+        self._local = threading.local()
+
+
+# Shared by scheduled jobs and the manual trigger endpoint
+gmail_client_manager = GmailClientManager()
+
+
+def get_gmail_service():
+    """Returns the authorized Gmail API service from the shared client manager."""
+    return gmail_client_manager.get_service()
+
+def _iter_attachment_parts(payload):
+    """Yields every MIME part that carries a named file, walking nested multipart/* parts in order."""
+    if payload.get('filename') and (payload.get('body', {}).get('attachmentId') or payload.get('body', {}).get('data')):
+        yield payload
+    for part in payload.get('parts', []) or []:
+        yield from _iter_attachment_parts(part)
+
+
+def _download_part(service, user_id, message_id, part):
+    """Returns the decoded bytes of one attachment part (small files come inline with the message)."""
+    body = part.get('body', {})
+    data = body.get('data')
+    if data is None:
+        data = service.users().messages().attachments().get(
+            userId=user_id, messageId=message_id, id=body['attachmentId']).execute()['data']
+    return urlsafe_b64decode(data)
+
+
+def _download_first_attachment(service, user_id, message_id):
+    """Fetches a message and downloads its first attachment. Returns (data, file_name, message_id)."""
+    # Get the full message details and find the attachment part
+    msg = service.users().messages().get(userId=user_id, id=message_id).execute()
+    
+    part = next(_iter_attachment_parts(msg['payload']), None)
+    if part is None:
+         print("INFO: Email found, but no attached file detected.")
+         return None, None, None
+         
+    # Download the attachment data
+    file_name = part['filename']
+    file_data = _download_part(service, user_id, message_id, part)
+    
+    print(f"SUCCESS: Found and downloaded attachment: {file_name}")
+    return file_data, file_name, message_id
+
+
+def fetch_message_attachments(message_id, user_id='me') -> FetchedMessage:
+    """Downloads every attachment of a message. Safe to call from worker threads."""
+    # Each worker thread gets its own service/connection from the client manager
+    service = get_gmail_service()
+    if service is None:
+        return FetchedMessage(message_id, error="Gmail service could not be initialized.")
+    try:
+        msg = service.users().messages().get(userId=user_id, id=message_id).execute()
+        attachments = [
+            (_download_part(service, user_id, message_id, part), part['filename'])
+            for part in _iter_attachment_parts(msg['payload'])
+        ]
+        return FetchedMessage(message_id, int(msg.get('internalDate', 0)), attachments)
+    except HttpError as error:
+        return FetchedMessage(message_id, error=f"HTTP error during download: {error}")
+
+
+def _message_epoch_seconds(service, message_id, user_id='me'):
+    """internalDate of a message in epoch seconds, or None if it no longer exists."""
+    try:
+        message = service.users().messages().get(userId=user_id, id=message_id, format='minimal').execute()
+    except HttpError as error:
+        if getattr(error, 'resp', None) is not None and error.resp.status == 404:
+            return None
+        raise
+    return int(message.get('internalDate', 0)) // 1000
+
+
+def list_messages_since(service, search_query, last_message_id, user_id='me', max_messages=GMAIL_BACKLOG_MAX_MESSAGES):
+    """
+    Ids of the messages matching search_query that are newer than last_message_id, oldest first.
+    A backlog longer than max_messages is cut to its *oldest* max_messages, so the cursor only
+    moves over mail that was returned and the next run continues from there.
+
+    Gmail lists newest first, so pages are read until the cursor message is reached. The listing
+    is bounded by the cursor's date (after:), so a cursor that no longer matches the query
+    (relabelled, subject edited) does not replay older mail. A cursor that was deleted behaves
+    like no cursor: only the newest message is returned.
+    """
+    query = search_query
+    if last_message_id is not None:
+        after = _message_epoch_seconds(service, last_message_id, user_id)
+        if after is None:
+            print(f"WARNING: Cursor message {last_message_id} no longer exists. Resuming from the newest message.")
+            last_message_id, max_messages = None, 1
+        else:
+            query = f"{search_query} after:{after}"
+
+    message_ids = []
+    page_token = None
+    while True:
+        response = service.users().messages().list(
+            userId=user_id, q=query, pageToken=page_token,
+            maxResults=500 if last_message_id is not None else min(500, max_messages),
+        ).execute()
+        for message in response.get('messages', []):
+            if message['id'] == last_message_id:
+                return message_ids[::-1][:max_messages]
+            message_ids.append(message['id'])
+        page_token = response.get('nextPageToken')
+        # Without a cursor only the newest messages are wanted
+        if not page_token or (last_message_id is None and len(message_ids) >= max_messages):
+            break
+    if last_message_id is None:
+        return message_ids[:max_messages][::-1]
+    return message_ids[::-1][:max_messages]
+
+
+def download_backlog(search_query, last_message_id, user_id='me', max_messages=GMAIL_BACKLOG_MAX_MESSAGES):
+    """
+    Downloads every matching message newer than last_message_id on the shared download pool
+    (GMAIL_DOWNLOAD_WORKERS threads per process).
+    Yields FetchedMessage objects oldest first, as soon as each one (and all older ones) is ready,
+    so ingestion of the first message overlaps with the download of the rest.
+    """
+    service = get_gmail_service()
+    if service is None:
+        print("ERROR: Gmail service could not be initialized.")
+        yield FetchedMessage("", error="Gmail service could not be initialized.")
+        return
+
+    # Without a cursor there is no backlog to recover: behave like the single-message search
+    if last_message_id is None:
+        max_messages = 1
+
+    try:
+        message_ids = list_messages_since(service, search_query, last_message_id, user_id, max_messages)
+    except HttpError as error:
+        print(f"An HTTP error occurred during message listing: {error}")
+        yield FetchedMessage("", error=f"HTTP error during listing: {error}")
+        return
+    if not message_ids:
+        print(f"INFO: No new emails found matching query: '{search_query}'")
+        return
+
+    print(f"INFO: Downloading {len(message_ids)} message(s) matching '{search_query}'.")
+    # map() preserves submission order; messages.list order is already oldest-first here.
+    # Closing this generator early cancels the downloads that have not started.
+    yield from _get_download_pool().map(lambda message_id: fetch_message_attachments(message_id, user_id), message_ids)
+
 
 def find_and_download_attachment(user_id='me', search_query=''):
     """
     Searches for an email, downloads the attachment, and returns its raw binary data.
     """
-    # NOTE: This call will trigger the authorization flow if token.json is missing or expired.
+    # NOTE: The first call triggers the authorization flow if token.json is missing.
+    # Later calls reuse the cached client; only the list/get requests below hit the network.
     service = get_gmail_service()
     
     if service is None:
         # Service failed to initialize, usually due to the sys.exit(1) in auth flow
         print("ERROR: Gmail service could not be initialized.")
-        return None, None
+        return None, None, None
         
     # --- Search and Download Logic ---
     try:
@@ -108,33 +332,12 @@ def find_and_download_attachment(user_id='me', search_query=''):
         messages = response.get('messages', [])
         if not messages:
             print(f"INFO: No emails found matching query: '{search_query}'")
-            return None, None
+            return None, None, None
             
         message_id = messages[0]['id']
         
-        # 2. Get the full message details and find the attachment part (logic unchanged)
-        msg = service.users().messages().get(userId=user_id, id=message_id).execute()
-        
-        attachment_id = None
-        file_name = None
-        for part in msg['payload']['parts']:
-             if part.get('filename') and part.get('body').get('attachmentId'):
-                attachment_id = part['body']['attachmentId']
-                file_name = part['filename']
-                break
-        
-        if not attachment_id:
-             print("INFO: Email found, but no attached file detected.")
-             return None, None
-             
-        # 3. Download the attachment data (logic unchanged)
-        att_data = service.users().messages().attachments().get(
-            userId=user_id, messageId=message_id, id=attachment_id).execute()
-        
-        file_data = urlsafe_b64decode(att_data['data'])
-        
-        print(f"SUCCESS: Found and downloaded attachment: {file_name}")
-        return file_data, file_name, message_id
+        # 2. + 3. Find the attachment part and download it
+        return _download_first_attachment(service, user_id, message_id)
             
     except HttpError as error:
         print(f"An HTTP error occurred during message retrieval: {error}")
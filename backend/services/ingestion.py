@@ -1,43 +1,209 @@
 # backend/services/ingestion.py
+import io
+import os
 import pandas as pd
-from sqlmodel import Session, select, SQLModel
-from typing import Type # <--- CRITICAL: Must be imported
-from database import get_session 
+from datetime import datetime
+from sqlmodel import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Type, List, Optional, Set # <--- CRITICAL: Must be imported
 
+from models.sales_data_model import SALES_NATURAL_KEY, workflow_id_for_model
+from services.kpi_rollups import stale_rollup_days, refresh_rollups
+from services.analytics_engine import mark_dirty_months
+from services.online_anomalies import score_batch
 
-# REMOVE THIS LINE: from models.sales_data_model import SalesData 
+
+# Rows per COPY/INSERT batch. Bounds statement size and memory on large attachments.
+BULK_INSERT_CHUNK_SIZE = int(os.getenv("BULK_INSERT_CHUNK_SIZE", "5000"))
+
+INT_COLUMNS = ['order_qty', 'delivery_qty', 'on_time', 'in_full', 'merchant_id']
+STR_COLUMNS = ['order_id', 'product_id', 'customer_id']
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE support in SQLAlchemy
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _insert_columns(SalesDataModel: Type) -> List[str]:
+    """Returns the table columns we write (everything except the autoincrement id)."""
+    return [column.name for column in SalesDataModel.__table__.columns if column.name != 'id']
+
+
+def prepare_bulk_frame(df: pd.DataFrame, merchant_id: int, SalesDataModel: Type) -> pd.DataFrame:
+    """
+    Shapes a cleaned DataFrame into exactly the columns/types of the target table.
+    Rows that the old per-row model_validate would have rejected (missing required
+    values, non-numeric quantities, unparseable dates) are dropped here in bulk.
+    """
+    columns = _insert_columns(SalesDataModel)
+    frame = df.reindex(columns=columns).copy()
+    frame['merchant_id'] = merchant_id
+
+    if 'insertion_timestamp' in frame.columns:
+        frame['insertion_timestamp'] = frame['insertion_timestamp'].fillna(datetime.utcnow())
+
+    for column in INT_COLUMNS:
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    if 'delivery_date' in frame.columns:
+        frame['delivery_date'] = pd.to_datetime(frame['delivery_date'], errors='coerce')
+
+    # Same rule as before: a row missing any non-nullable field is skipped
+    required = [c.name for c in SalesDataModel.__table__.columns if c.name != 'id' and not c.nullable]
+    frame = frame.dropna(subset=required)
+
+    for column in INT_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].astype('int64')
+    for column in STR_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].astype(str)
+    if 'delivery_date' in frame.columns:
+        frame['delivery_date'] = frame['delivery_date'].dt.date
+
+    return frame
+
+
+def _natural_key(table) -> Optional[List[str]]:
+    """Returns the order-line key if the table carries the unique index for it (workflow tables do)."""
+    for index in table.indexes:
+        if index.unique and [column.name for column in index.columns] == SALES_NATURAL_KEY:
+            return SALES_NATURAL_KEY
+    return None
+
+
+def _copy_frame(cursor, target_name: str, frame: pd.DataFrame):
+    """Streams the frame into target_name with COPY ... FROM STDIN, one CSV buffer per chunk."""
+    column_list = ", ".join(f'"{name}"' for name in frame.columns)
+    copy_sql = f'COPY "{target_name}" ({column_list}) FROM STDIN WITH (FORMAT csv)'
+
+    for start in range(0, len(frame), BULK_INSERT_CHUNK_SIZE):
+        buffer = io.StringIO()
+        frame.iloc[start:start + BULK_INSERT_CHUNK_SIZE].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+
+
+def _copy_into_postgres(session: Session, table, frame: pd.DataFrame, key: Optional[List[str]] = None) -> bool:
+    """
+    COPY path for PostgreSQL. With a natural key the rows are COPYed into a temp staging
+    table and merged with INSERT ... SELECT ... ON CONFLICT DO UPDATE.
+    Returns False if the driver has no COPY support (caller falls back to executemany).
+    """
+    raw_connection = session.connection().connection
+    cursor = raw_connection.cursor()
+    if not hasattr(cursor, 'copy_expert'):
+        # Non-psycopg2 driver: let the caller fall back to executemany
+        return False
+
+    if not key:
+        _copy_frame(cursor, table.name, frame)
+        return True
+
+    column_list = ", ".join(f'"{name}"' for name in frame.columns)
+    staging_name = f"staging_{table.name}"
+    updates = ", ".join(f'"{name}" = EXCLUDED."{name}"' for name in frame.columns if name not in key)
+
+    cursor.execute(f'DROP TABLE IF EXISTS "{staging_name}"')
+    cursor.execute(
+        f'CREATE TEMP TABLE "{staging_name}" ON COMMIT DROP AS '
+        f'SELECT {column_list} FROM "{table.name}" WITH NO DATA'
+    )
+    _copy_frame(cursor, staging_name, frame)
+    cursor.execute(
+        f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM "{staging_name}" '
+        f'ON CONFLICT ({", ".join(key)}) DO UPDATE SET {updates}'
+    )
+    return True
+
+
+def _executemany_upsert(session: Session, table, frame: pd.DataFrame, key: List[str], dialect: str):
+    """Chunked multi-row INSERT ... ON CONFLICT DO UPDATE on the natural key."""
+    upsert_stmt = UPSERT_INSERTS[dialect](table)
+    upsert_stmt = upsert_stmt.on_conflict_do_update(
+        index_elements=key,
+        set_={name: upsert_stmt.excluded[name] for name in frame.columns if name not in key},
+    )
+    for start in range(0, len(frame), BULK_INSERT_CHUNK_SIZE):
+        chunk = frame.iloc[start:start + BULK_INSERT_CHUNK_SIZE]
+        session.execute(upsert_stmt, chunk.to_dict(orient='records'))
+
+
+def _executemany_insert(session: Session, table, frame: pd.DataFrame):
+    """Chunked multi-row INSERT for dialects without a COPY fast path."""
+    insert_stmt = table.insert()
+    for start in range(0, len(frame), BULK_INSERT_CHUNK_SIZE):
+        chunk = frame.iloc[start:start + BULK_INSERT_CHUNK_SIZE]
+        session.execute(insert_stmt, chunk.to_dict(orient='records'))
+
+
+def bulk_insert_frame(session: Session, SalesDataModel: Type, frame: pd.DataFrame) -> int:
+    """
+    Writes an already-prepared frame using the fastest path for the session's dialect.
+    Workflow tables upsert on (merchant_id, order_id, product_id), so re-sent rows
+    update in place instead of duplicating. Returns the number of rows written.
+    """
+    if frame.empty:
+        return 0
+
+    table = SalesDataModel.__table__
+    dialect = session.get_bind().dialect.name
+    key = _natural_key(table)
+
+    if key:
+        # ON CONFLICT cannot touch the same row twice in one statement; last line in the file wins
+        frame = frame.drop_duplicates(subset=key, keep='last')
+
+    if dialect == 'postgresql' and _copy_into_postgres(session, table, frame, key):
+        return len(frame)
+
+    if key and dialect in UPSERT_INSERTS:
+        _executemany_upsert(session, table, frame, key, dialect)
+    else:
+        _executemany_insert(session, table, frame)
+    return len(frame)
 
 
 # CRITICAL FIX: The function must explicitly accept 4 arguments
-def ingest_data_frame(df: pd.DataFrame, session: Session, merchant_id: int, SalesDataModel: Type) -> int:
+def ingest_data_frame(df: pd.DataFrame, session: Session, merchant_id: int, SalesDataModel: Type,
+                      scored_days: Optional[Set] = None) -> int:
     """
-    Takes a cleaned Pandas DataFrame and loads it into the correct sales data table.
-    
+    Takes a cleaned Pandas DataFrame and bulk-loads it into the correct sales data table.
+    Uses COPY on PostgreSQL and chunked executemany INSERTs elsewhere, upserting on the
+    order-line key for workflow tables. For workflow tables the KPI rollups of every day
+    the batch touched are refreshed in the same transaction.
+
     Args:
         df: The cleaned data from the data_processor.
         session: The active SQLModel database session.
         merchant_id: The ID of the merchant (user) who owns the data.
         SalesDataModel: The dynamic SQLModel class (e.g., SalesData_1) for insertion. <--- NEW
-        
+        scored_days: If given, the touched days are added to it and anomaly scoring is left to the
+            caller (one score_batch after the last chunk of a streamed file, so a day split across
+            chunks is not scored on part of its orders first).
+
     Returns:
-        The total number of rows successfully inserted.
-    """
-    
-    inserted_count = 0
-    data_records = df.to_dict(orient='records')
-    
-    for record in data_records:
-        try:
-            record['merchant_id'] = merchant_id
-            
-            # Use the passed-in SalesDataModel for validation/mapping
-            sales_record = SalesDataModel.model_validate(record) 
-            
-            session.add(sales_record)
-            inserted_count += 1
-            
-        except Exception as e:
-            print(f"Skipping bad record during ingestion: {e}. Data: {record}")
-            
+        The total number of rows successfully inserted (or updated in place).
+    """
+    frame = prepare_bulk_frame(df, merchant_id, SalesDataModel)
+
+    skipped = len(df) - len(frame)
+    if skipped:
+        print(f"Skipping {skipped} bad record(s) during ingestion (missing or invalid required fields).")
+
+    workflow_id = workflow_id_for_model(SalesDataModel)
+    touched_days = set()
+    if workflow_id is not None and not frame.empty:
+        # Days the upsert may move rows away from, plus the days the batch writes into
+        touched_days = stale_rollup_days(session, SalesDataModel, frame)
+        touched_days.update(frame['delivery_date'])
+
+    inserted_count = bulk_insert_frame(session, SalesDataModel, frame)
+    if touched_days:
+        refresh_rollups(session, workflow_id, SalesDataModel, touched_days)
+        mark_dirty_months(session, workflow_id, touched_days)
+        if scored_days is None:
+            score_batch(session, workflow_id, touched_days)
+        else:
+            scored_days.update(touched_days)
     session.commit()
-    return inserted_count
\ No newline at end of file
+    return inserted_count
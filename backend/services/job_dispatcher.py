@@ -0,0 +1,122 @@
+# backend/services/job_dispatcher.py
+"""
+Runs scheduled ETL work off the event loop, on a bounded thread or process pool.
+
+APScheduler only *dispatches* here; the dispatcher enforces a global concurrency cap
+and a per-merchant cap, serves merchants round-robin (so one tenant with many
+workflows cannot starve the rest), and drops a run whose key is already queued or
+running (backed-up intervals collapse into one run).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Set, Tuple
+
+from services.metrics import metrics
+
+ETL_EXECUTOR = os.getenv("ETL_EXECUTOR", "thread").lower() # "thread" or "process"
+ETL_MAX_WORKERS = int(os.getenv("ETL_MAX_WORKERS", "4"))
+ETL_MAX_PER_MERCHANT = int(os.getenv("ETL_MAX_PER_MERCHANT", "2"))
+
+# (enqueued_at, key, func, args)
+_Task = Tuple[float, str, Callable[..., Any], Tuple[Any, ...]]
+
+
+class EtlDispatcher:
+    """
+    Fair, bounded executor for ETL jobs. `func` must be a module-level function when the
+    process pool is used (it is pickled to the worker).
+    """
+
+    def __init__(self, max_workers: int = ETL_MAX_WORKERS, max_per_merchant: int = ETL_MAX_PER_MERCHANT,
+                 executor: str = ETL_EXECUTOR):
+        self.max_workers = max(1, max_workers)
+        self.max_per_merchant = max(1, max_per_merchant)
+        self.executor_kind = executor
+        # Re-entrant: a future that finishes before add_done_callback runs its callback inline
+        self._lock = threading.RLock()
+        self._pool = None
+        # merchant -> pending tasks; OrderedDict order is the round-robin order
+        self._queues: "OrderedDict[Hashable, deque[_Task]]" = OrderedDict()
+        self._running: Dict[Hashable, int] = {}
+        self._running_total = 0
+        self._keys: Set[str] = set() # queued or running
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.executor_kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="etl")
+        return self._pool
+
+    def submit(self, merchant_id: Hashable, key: str, func: Callable[..., Any], *args) -> bool:
+        """Queues func(*args) for a merchant. Returns False if a run with the same key is already pending."""
+        with self._lock:
+            if key in self._keys:
+                metrics.increment("etl_jobs_coalesced")
+                return False
+            self._keys.add(key)
+            self._queues.setdefault(merchant_id, deque()).append((time.monotonic(), key, func, args))
+            metrics.increment("etl_jobs_submitted")
+            self._pump()
+        return True
+
+    def _pump(self):
+        """Starts queued tasks while there is capacity. Caller holds the lock."""
+        while self._running_total < self.max_workers:
+            merchant_id = next(
+                (m for m, queue in self._queues.items() if queue and self._running.get(m, 0) < self.max_per_merchant),
+                None,
+            )
+            if merchant_id is None:
+                break
+            queue = self._queues.pop(merchant_id)
+            enqueued_at, key, func, args = queue.popleft()
+            if queue:
+                self._queues[merchant_id] = queue # back of the line: round-robin between merchants
+
+            self._running[merchant_id] = self._running.get(merchant_id, 0) + 1
+            self._running_total += 1
+            metrics.observe("etl_queue_wait_seconds", time.monotonic() - enqueued_at)
+
+            started_at = time.monotonic()
+            future = self._get_pool().submit(func, *args)
+            future.add_done_callback(
+                lambda f, m=merchant_id, k=key, s=started_at: self._on_done(f, m, k, s)
+            )
+        self._update_gauges()
+
+    def _on_done(self, future, merchant_id: Hashable, key: str, started_at: float):
+        metrics.observe("etl_run_seconds", time.monotonic() - started_at)
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            metrics.increment("etl_jobs_failed")
+            print(f"SCHEDULER: ETL job {key} failed: {error!r}")
+        else:
+            metrics.increment("etl_jobs_completed")
+
+        with self._lock:
+            self._running[merchant_id] -= 1
+            if not self._running[merchant_id]:
+                del self._running[merchant_id]
+            self._running_total -= 1
+            self._keys.discard(key)
+            self._pump()
+
+    def _update_gauges(self):
+        metrics.set_gauge("etl_jobs_running", self._running_total)
+        metrics.set_gauge("etl_jobs_queued", sum(len(queue) for queue in self._queues.values()))
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._queues.clear()
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+# Shared by the scheduler jobs in main.py
+etl_dispatcher = EtlDispatcher()
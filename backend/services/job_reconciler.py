@@ -0,0 +1,127 @@
+# backend/services/job_reconciler.py
+"""
+Keeps the per-workflow APScheduler jobs in line with the Workflow table by diffing
+desired state against the job store and touching only jobs that changed. Unchanged
+jobs keep their next_run_time (a remove + add would reset it and write to the store).
+"""
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from services.metrics import metrics
+
+WORKFLOW_JOB_PREFIX = "wf_"
+
+
+def workflow_job_id(workflow) -> str:
+    """Job ID must be unique (f"wf_{user_id}_{workflow_id}")."""
+    return f"{WORKFLOW_JOB_PREFIX}{workflow.user_id}_{workflow.id}"
+
+
+@dataclass
+class JobSpec:
+    """What the polling job of one workflow should look like."""
+    job_id: str
+    name: str
+    interval_minutes: int
+    kwargs: Dict[str, int]
+
+    @classmethod
+    def for_workflow(cls, workflow) -> "JobSpec":
+        return cls(
+            job_id=workflow_job_id(workflow),
+            name=workflow.name,
+            interval_minutes=workflow.recheck_interval_minutes,
+            kwargs={'workflow_id': workflow.id, 'merchant_id': workflow.user_id},
+        )
+
+
+@dataclass
+class ReconcileResult:
+    added: List[str] = field(default_factory=list)
+    rescheduled: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    seconds: float = 0.0
+
+    @property
+    def writes(self) -> int:
+        return len(self.added) + len(self.rescheduled) + len(self.modified) + len(self.removed)
+
+
+def _apply(scheduler, func: Callable, spec: JobSpec, job, result: ReconcileResult):
+    """Creates or updates one job with the fewest job-store writes."""
+    if job is None:
+        scheduler.add_job(func, 'interval', minutes=spec.interval_minutes, id=spec.job_id,
+                          name=spec.name, kwargs=spec.kwargs, replace_existing=True)
+        result.added.append(spec.job_id)
+        return
+
+    if getattr(job.trigger, 'interval', None) != timedelta(minutes=spec.interval_minutes):
+        # New interval: the next run time has to move anyway
+        scheduler.reschedule_job(spec.job_id, trigger='interval', minutes=spec.interval_minutes)
+        result.rescheduled.append(spec.job_id)
+    if job.name != spec.name or dict(job.kwargs) != spec.kwargs:
+        # modify_job keeps next_run_time
+        scheduler.modify_job(spec.job_id, name=spec.name, kwargs=spec.kwargs)
+        result.modified.append(spec.job_id)
+    if spec.job_id not in result.rescheduled and spec.job_id not in result.modified:
+        result.unchanged += 1
+
+
+def _record(result: ReconcileResult, started_at: float):
+    result.seconds = time.perf_counter() - started_at
+    metrics.observe("scheduler_reconcile_seconds", result.seconds)
+    metrics.increment("scheduler_job_writes", result.writes)
+
+
+def reconcile_workflow_jobs(scheduler, func: Callable, workflows: Iterable,
+                            needs_polling: Callable[[object], bool]) -> ReconcileResult:
+    """
+    Full reconcile: one read of the job store, then add/update/remove only what differs.
+    `workflows` are the active workflows; wf_ jobs with no matching workflow are removed.
+    """
+    started_at = time.perf_counter()
+    result = ReconcileResult()
+
+    existing = {job.id: job for job in scheduler.get_jobs() if job.id.startswith(WORKFLOW_JOB_PREFIX)}
+    desired = {spec.job_id: spec for spec in (JobSpec.for_workflow(w) for w in workflows if needs_polling(w))}
+
+    for job_id, spec in desired.items():
+        _apply(scheduler, func, spec, existing.get(job_id), result)
+    for job_id in existing.keys() - desired.keys():
+        scheduler.remove_job(job_id)
+        result.removed.append(job_id)
+
+    _record(result, started_at)
+    metrics.set_gauge("scheduler_workflow_jobs", len(desired))
+    return result
+
+
+def sync_workflow_job(scheduler, func: Callable, workflow, polling: bool) -> ReconcileResult:
+    """Reconciles a single workflow's job (used right after create/update/delete)."""
+    started_at = time.perf_counter()
+    result = ReconcileResult()
+    job_id = workflow_job_id(workflow)
+    job = scheduler.get_job(job_id)
+
+    if polling:
+        _apply(scheduler, func, JobSpec.for_workflow(workflow), job, result)
+    elif job is not None:
+        scheduler.remove_job(job_id)
+        result.removed.append(job_id)
+    else:
+        result.unchanged += 1
+
+    _record(result, started_at)
+    return result
+
+
+def describe(result: ReconcileResult) -> Optional[str]:
+    """One-line log summary, or None when nothing changed."""
+    if not result.writes:
+        return None
+    return (f"{len(result.added)} added, {len(result.rescheduled)} rescheduled, {len(result.modified)} modified, "
+            f"{len(result.removed)} removed, {result.unchanged} unchanged in {result.seconds * 1000:.1f} ms")
@@ -0,0 +1,273 @@
+# backend/services/kpi_rollups.py
+"""
+Per-day KPI rollups (KpiDailyRollup) for the sales_data_{id} workflow tables, so
+/api/v1/insights reads a few rows per day instead of scanning the whole history.
+
+Maintenance is by day bucket: after a batch is written, every day it touched is
+deleted from the rollup and re-aggregated from the raw table (indexed on
+delivery_date) in the same transaction. That keeps upserts exact: a re-sent order
+line that changed its quantities or delivery date refreshes both its old and new day.
+The all-time per product / per customer rows (KpiKeyRollup, used by the top-N
+rankings) are then re-summed from the day rows for every key seen on those days,
+and the monthly heavy-hitter sketches of those days are rebuilt (services/kpi_sketches.py).
+
+Rebuild from raw data (e.g. for tables loaded before rollups existed):
+    python -m services.kpi_rollups --workflow-id 3
+    python -m services.kpi_rollups --all
+"""
+import argparse
+from datetime import date
+from typing import Iterable, List, Optional, Set, Tuple, Type
+import pandas as pd
+from sqlalchemy import case, delete, distinct, func, insert, inspect, literal, select
+from sqlmodel import Session
+
+from models.rollup_model import KpiDailyRollup, KpiKeyRollup, KpiSketch, ROLLUP_TOTAL, ROLLUP_PRODUCT, ROLLUP_CUSTOMER
+from models.sales_data_model import get_sales_data_model, ensure_sales_table
+from services.cache import bump_data_version
+from services.kpi_sketches import refresh_sketches, rebuild_sketches
+from services.metrics import metrics
+
+# Bound parameters per IN (...) list when looking up keys/days
+ROLLUP_LOOKUP_CHUNK = 5000
+
+COUNTER_COLUMNS = ["order_count", "on_time_count", "in_full_count", "otif_count", "order_qty_sum", "delivery_qty_sum"]
+ROLLUP_COLUMNS = ["workflow_id", "day", "dimension", "dim_key"] + COUNTER_COLUMNS
+KEY_ROLLUP_COLUMNS = ["workflow_id", "dimension", "dim_key"] + COUNTER_COLUMNS
+KEY_DIMENSIONS = (ROLLUP_PRODUCT, ROLLUP_CUSTOMER)
+
+# Binds whose rollup table has been checked in this process
+_ROLLUP_TABLE_READY: Set[str] = set()
+# Workflows known to have rollups (or no table yet) in this process; see ensure_workflow_rollups
+_ROLLUPS_CHECKED: Set[int] = set()
+
+
+def ensure_rollup_table(bind) -> None:
+    """Creates the rollup tables if missing (checked once per database per process)."""
+    url = str(bind.engine.url)
+    if url in _ROLLUP_TABLE_READY:
+        return
+    KpiDailyRollup.__table__.create(bind, checkfirst=True)
+    KpiKeyRollup.__table__.create(bind, checkfirst=True)
+    KpiSketch.__table__.create(bind, checkfirst=True)
+    _ROLLUP_TABLE_READY.add(url)
+
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _chunks(values: List, size: int = ROLLUP_LOOKUP_CHUNK):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _aggregate_select(SalesDataModel: Type, workflow_id: int, dimension: str, days=None):
+    """SELECT producing rollup rows for one grain straight from the raw table."""
+    # Same definitions as analytics/kpi_calculator.py: a flag counts only when it equals 1
+    on_time = _count_where(SalesDataModel.on_time == 1)
+    in_full = _count_where(SalesDataModel.in_full == 1)
+    otif = _count_where((SalesDataModel.on_time == 1) & (SalesDataModel.in_full == 1))
+    if dimension == ROLLUP_PRODUCT:
+        dim_key = SalesDataModel.product_id
+    elif dimension == ROLLUP_CUSTOMER:
+        dim_key = SalesDataModel.customer_id
+    else:
+        dim_key = literal("")
+
+    group_by = [SalesDataModel.delivery_date]
+    if dimension != ROLLUP_TOTAL:
+        group_by.append(dim_key)
+
+    stmt = select(
+        literal(workflow_id),
+        SalesDataModel.delivery_date,
+        literal(dimension),
+        dim_key,
+        func.count(),
+        on_time,
+        in_full,
+        otif,
+        func.coalesce(func.sum(SalesDataModel.order_qty), 0),
+        func.coalesce(func.sum(SalesDataModel.delivery_qty), 0),
+    ).group_by(*group_by)
+    if days is not None:
+        stmt = stmt.where(SalesDataModel.delivery_date.in_(days))
+    return stmt
+
+
+def _insert_aggregates(session: Session, SalesDataModel: Type, workflow_id: int, days=None):
+    table = KpiDailyRollup.__table__
+    for dimension in (ROLLUP_TOTAL, ROLLUP_PRODUCT, ROLLUP_CUSTOMER):
+        session.execute(
+            insert(table).from_select(ROLLUP_COLUMNS, _aggregate_select(SalesDataModel, workflow_id, dimension, days))
+        )
+
+
+def _day_rollup_keys(session: Session, workflow_id: int, days: List[date]) -> Set[Tuple[str, str]]:
+    """(dimension, dim_key) pairs with a product/customer rollup row on any of the days."""
+    return set(session.execute(
+        select(KpiDailyRollup.dimension, KpiDailyRollup.dim_key).distinct().where(
+            KpiDailyRollup.workflow_id == workflow_id,
+            KpiDailyRollup.dimension.in_(KEY_DIMENSIONS),
+            KpiDailyRollup.day.in_(days),
+        )
+    ).all())
+
+
+def _refresh_key_rollups(session: Session, workflow_id: int, keys: Optional[Set[Tuple[str, str]]] = None):
+    """Re-sums the all-time KpiKeyRollup rows of the given keys (all keys if None) from the day rollups."""
+    for dimension in KEY_DIMENSIONS:
+        if keys is None:
+            key_chunks = [None]
+        else:
+            key_chunks = list(_chunks(sorted(key for key_dimension, key in keys if key_dimension == dimension)))
+
+        for chunk in key_chunks:
+            target = [KpiKeyRollup.workflow_id == workflow_id, KpiKeyRollup.dimension == dimension]
+            source = [KpiDailyRollup.workflow_id == workflow_id, KpiDailyRollup.dimension == dimension]
+            if chunk is not None:
+                target.append(KpiKeyRollup.dim_key.in_(chunk))
+                source.append(KpiDailyRollup.dim_key.in_(chunk))
+            session.execute(delete(KpiKeyRollup).where(*target))
+            session.execute(insert(KpiKeyRollup.__table__).from_select(
+                KEY_ROLLUP_COLUMNS,
+                select(
+                    literal(workflow_id), literal(dimension), KpiDailyRollup.dim_key,
+                    *[func.sum(getattr(KpiDailyRollup, column)) for column in COUNTER_COLUMNS],
+                ).where(*source).group_by(KpiDailyRollup.dim_key),
+            ))
+
+
+def has_rollups(session: Session, workflow_id: int) -> bool:
+    """True once the workflow's rollups have been built (by ingest or a rebuild)."""
+    ensure_rollup_table(session.connection())
+    return session.execute(
+        select(KpiDailyRollup.id).where(KpiDailyRollup.workflow_id == workflow_id).limit(1)
+    ).first() is not None
+
+
+def stale_rollup_days(session: Session, SalesDataModel: Type, frame: pd.DataFrame) -> Set[date]:
+    """
+    Days currently holding rows that the batch is about to overwrite (call BEFORE the upsert).
+    Needed when a re-sent order line moves to another delivery date.
+    """
+    if frame.empty:
+        return set()
+    days: Set[date] = set()
+    merchant_id = int(frame["merchant_id"].iloc[0])
+    order_ids = frame["order_id"].unique().tolist()
+    for chunk in _chunks(order_ids):
+        days.update(session.execute(
+            select(distinct(SalesDataModel.delivery_date))
+            .where(SalesDataModel.merchant_id == merchant_id, SalesDataModel.order_id.in_(chunk))
+        ).scalars())
+    return days
+
+
+def refresh_rollups(session: Session, workflow_id: int, SalesDataModel: Type, days: Iterable[date]) -> int:
+    """
+    Recomputes the rollup rows of the given days from the raw table (the whole table if the
+    workflow has no rollups yet). Does not commit:
+    the caller commits together with the batch that touched those days.
+    Returns the number of day buckets refreshed.
+    """
+    days = sorted(set(days))
+    if not days:
+        return 0
+    ensure_rollup_table(session.connection())
+
+    with metrics.timer("kpi_rollup_refresh_seconds"):
+        if not has_rollups(session, workflow_id):
+            # First batch since rollups existed: older raw rows must be rolled up too
+            _insert_aggregates(session, SalesDataModel, workflow_id)
+            _refresh_key_rollups(session, workflow_id)
+            rebuild_sketches(session, workflow_id)
+            return len(days)
+        for chunk in _chunks(days):
+            # Products/customers on these days before and after the refresh need new all-time sums
+            keys = _day_rollup_keys(session, workflow_id, chunk)
+            session.execute(
+                delete(KpiDailyRollup)
+                .where(KpiDailyRollup.workflow_id == workflow_id, KpiDailyRollup.day.in_(chunk))
+            )
+            _insert_aggregates(session, SalesDataModel, workflow_id, chunk)
+            keys |= _day_rollup_keys(session, workflow_id, chunk)
+            _refresh_key_rollups(session, workflow_id, keys)
+        refresh_sketches(session, workflow_id, days)
+    metrics.increment("kpi_rollup_days_refreshed", len(days))
+    return len(days)
+
+
+def rebuild_rollups(session: Session, workflow_id: int) -> int:
+    """Drops and recomputes every rollup row of one workflow from its raw table, then commits."""
+    SalesDataModel = get_sales_data_model(workflow_id)
+    bind = session.get_bind()
+    ensure_rollup_table(bind)
+    if not inspect(bind).has_table(SalesDataModel.__tablename__):
+        return 0
+    ensure_sales_table(SalesDataModel, bind)
+
+    session.execute(delete(KpiDailyRollup).where(KpiDailyRollup.workflow_id == workflow_id))
+    _insert_aggregates(session, SalesDataModel, workflow_id)
+    _refresh_key_rollups(session, workflow_id)
+    rebuild_sketches(session, workflow_id)
+    session.commit()
+    days = session.execute(
+        select(func.count()).select_from(KpiDailyRollup)
+        .where(KpiDailyRollup.workflow_id == workflow_id, KpiDailyRollup.dimension == ROLLUP_TOTAL)
+    ).scalar_one()
+    if days:
+        bump_data_version(session, workflow_id)
+    return days
+
+
+def ensure_workflow_rollups(session: Session, workflow_ids: Iterable[int]) -> List[int]:
+    """
+    Builds rollups for workflow tables that hold data from before rollups existed, so merged
+    (merchant-wide) reads cover them. Checked once per workflow per process; afterwards
+    ingestion keeps them current. Returns the workflows that were rebuilt.
+    """
+    unchecked = [workflow_id for workflow_id in workflow_ids if workflow_id not in _ROLLUPS_CHECKED]
+    if not unchecked:
+        return []
+    ensure_rollup_table(session.connection())
+
+    covered = set(session.execute(
+        select(KpiDailyRollup.workflow_id)
+        .where(KpiDailyRollup.workflow_id.in_(unchecked), KpiDailyRollup.dimension == ROLLUP_TOTAL)
+        .group_by(KpiDailyRollup.workflow_id)
+    ).scalars())
+    sketched = set(session.execute(
+        select(KpiSketch.workflow_id).where(KpiSketch.workflow_id.in_(unchecked)).group_by(KpiSketch.workflow_id)
+    ).scalars())
+    rebuilt = []
+    for workflow_id in unchecked:
+        if workflow_id not in covered:
+            if rebuild_rollups(session, workflow_id):
+                rebuilt.append(workflow_id)
+        elif workflow_id not in sketched:
+            # Rolled up before monthly sketches existed
+            rebuild_sketches(session, workflow_id)
+            session.commit()
+        _ROLLUPS_CHECKED.add(workflow_id)
+    if rebuilt:
+        print(f"ROLLUP: Backfilled rollups for workflow(s) {rebuilt}.")
+    return rebuilt
+
+
+if __name__ == "__main__":
+    from database import get_session
+    from models.workflow import Workflow
+
+    parser = argparse.ArgumentParser(description="Recompute KPI rollups from the raw sales tables.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--workflow-id", type=int, action="append", help="Workflow to rebuild (repeatable).")
+    target.add_argument("--all", action="store_true", help="Rebuild every workflow.")
+    args = parser.parse_args()
+
+    with next(get_session()) as session:
+        workflow_ids = args.workflow_id or session.execute(select(Workflow.id).order_by(Workflow.id)).scalars().all()
+        for workflow_id in workflow_ids:
+            days = rebuild_rollups(session, workflow_id)
+            print(f"ROLLUP: Workflow {workflow_id}: rebuilt {days} day(s).")
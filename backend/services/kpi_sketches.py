@@ -0,0 +1,103 @@
+# backend/services/kpi_sketches.py
+"""
+Per workflow / dimension / month heavy-hitter summaries (KpiSketch), kept next to the
+KPI rollups so top products (by quantity) and top customers (by order count) over any
+month range and any set of workflows come from merging a few small summaries.
+
+A month's summary is rebuilt from that month's day rollups whenever a batch touches
+it (refresh_rollups calls refresh_sketches). Rebuilding instead of feeding the raw
+batch keeps them exact under upserts, which a streaming Space-Saving update cannot
+undo; each monthly summary is therefore exact for its top SKETCH_CAPACITY keys and
+only merges across months/workflows introduce error (reported as bounds).
+"""
+import os
+from datetime import date
+from typing import Iterable, List, Optional, Set
+from sqlalchemy import delete, func, insert, select
+from sqlmodel import Session
+
+from analytics.heavy_hitters import TopKSummary
+from models.rollup_model import KpiDailyRollup, KpiSketch, ROLLUP_TOTAL, ROLLUP_PRODUCT, ROLLUP_CUSTOMER
+
+# Keys kept per monthly summary; also the largest N a sketch-based top-N can answer
+SKETCH_CAPACITY = int(os.getenv("SKETCH_CAPACITY", "100"))
+
+# What each dimension is ranked by (a KpiDailyRollup column)
+SKETCH_VALUE_COLUMNS = {
+    ROLLUP_PRODUCT: KpiDailyRollup.order_qty_sum,
+    ROLLUP_CUSTOMER: KpiDailyRollup.order_count,
+}
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _as_date(value) -> date:
+    # SQLite hands back ISO strings from aggregate/DISTINCT selects
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def month_counts(session: Session, workflow_ids: List[int], dimension: str, first_month: Optional[date],
+                 last_month: Optional[date], limit: int):
+    """Exact (key, value) ranking of the months [first_month, last_month] (None = open) from the day rollups."""
+    value = func.sum(SKETCH_VALUE_COLUMNS[dimension])
+    stmt = select(KpiDailyRollup.dim_key, value).where(
+        KpiDailyRollup.workflow_id.in_(workflow_ids),
+        KpiDailyRollup.dimension == dimension,
+    )
+    if first_month is not None:
+        stmt = stmt.where(KpiDailyRollup.day >= first_month)
+    if last_month is not None:
+        stmt = stmt.where(KpiDailyRollup.day < next_month(last_month))
+    return session.execute(
+        stmt.group_by(KpiDailyRollup.dim_key).order_by(value.desc(), KpiDailyRollup.dim_key).limit(limit)
+    ).all()
+
+
+def refresh_sketches(session: Session, workflow_id: int, days: Iterable[date]) -> int:
+    """
+    Rebuilds the summaries of every month containing one of the days. Does not commit
+    (runs inside the ingest transaction, after the day rollups were refreshed).
+    """
+    months: Set[date] = {month_start(_as_date(day)) for day in days}
+    for month in sorted(months):
+        session.execute(delete(KpiSketch).where(KpiSketch.workflow_id == workflow_id, KpiSketch.bucket == month))
+        for dimension in SKETCH_VALUE_COLUMNS:
+            counts = month_counts(session, [workflow_id], dimension, month, month, SKETCH_CAPACITY + 1)
+            if not counts:
+                continue
+            summary = TopKSummary.from_counts(counts, SKETCH_CAPACITY)
+            session.execute(insert(KpiSketch.__table__).values(
+                workflow_id=workflow_id, dimension=dimension, bucket=month, summary=summary.to_json(),
+            ))
+    return len(months)
+
+
+def rebuild_sketches(session: Session, workflow_id: int) -> int:
+    """Drops and rebuilds every monthly summary of a workflow from its day rollups. Does not commit."""
+    session.execute(delete(KpiSketch).where(KpiSketch.workflow_id == workflow_id))
+    days = session.execute(
+        select(KpiDailyRollup.day).where(
+            KpiDailyRollup.workflow_id == workflow_id, KpiDailyRollup.dimension == ROLLUP_TOTAL
+        )
+    ).scalars().all()
+    return refresh_sketches(session, workflow_id, days)
+
+
+def load_sketches(session: Session, workflow_ids: List[int], dimension: str,
+                  first_month: Optional[date], last_month: Optional[date]) -> List[TopKSummary]:
+    """Monthly summaries of the workflows for the months [first_month, last_month] (None = open)."""
+    stmt = select(KpiSketch.summary).where(
+        KpiSketch.workflow_id.in_(workflow_ids),
+        KpiSketch.dimension == dimension,
+    )
+    if first_month is not None:
+        stmt = stmt.where(KpiSketch.bucket >= first_month)
+    if last_month is not None:
+        stmt = stmt.where(KpiSketch.bucket <= last_month)
+    return [TopKSummary.from_json(row) for row in session.execute(stmt).scalars().all()]
@@ -0,0 +1,131 @@
+# backend/services/leader_election.py
+"""
+Lease-based leader election on the SchedulerLease table, so exactly one process
+(API worker or dedicated scheduler_main.py) runs the scheduler.
+
+Every candidate heartbeats every TTL/3 seconds. The holder renews its lease; the
+others take it over only once it has expired (holder crashed or lost the database).
+Acquire/renew is one conditional UPDATE, so two candidates can never both win.
+Lease times use each host's UTC clock: keep SCHEDULER_LEASE_TTL_SECONDS well above
+the expected clock skew between hosts.
+"""
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from database import engine
+from models.lease_model import SchedulerLease
+from services.metrics import metrics
+
+SCHEDULER_LEASE_TTL_SECONDS = int(os.getenv("SCHEDULER_LEASE_TTL_SECONDS", "30"))
+
+
+class LeaseLeaderElector:
+    def __init__(self, name: str = "scheduler", ttl_seconds: int = SCHEDULER_LEASE_TTL_SECONDS,
+                 on_elected: Optional[Callable[[], None]] = None, on_demoted: Optional[Callable[[], None]] = None,
+                 holder_id: Optional[str] = None, bind=engine):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.holder_id = holder_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.bind = bind
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def try_acquire(self) -> bool:
+        """Takes or renews the lease. Returns True if this process holds it afterwards."""
+        now = datetime.utcnow()
+        with Session(self.bind) as session:
+            result = session.execute(
+                update(SchedulerLease)
+                .where(
+                    SchedulerLease.name == self.name,
+                    or_(SchedulerLease.holder == self.holder_id, SchedulerLease.expires_at < now),
+                )
+                .values(holder=self.holder_id, heartbeat_at=now, expires_at=now + self.ttl)
+            )
+            if result.rowcount == 1:
+                session.commit()
+                return True
+            session.rollback()
+
+            if session.get(SchedulerLease, self.name) is not None:
+                return False # held by someone else
+            # First start ever: create the row; a concurrent insert makes one of us lose cleanly
+            session.add(SchedulerLease(name=self.name, holder=self.holder_id, acquired_at=now,
+                                       heartbeat_at=now, expires_at=now + self.ttl))
+            try:
+                session.commit()
+                return True
+            except IntegrityError:
+                session.rollback()
+                return False
+
+    def release(self):
+        """Gives the lease up at once (clean shutdown) so another candidate need not wait for the TTL."""
+        with Session(self.bind) as session:
+            session.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder_id)
+                .values(expires_at=datetime.utcnow())
+            )
+            session.commit()
+
+    def _mark_acquired(self):
+        with Session(self.bind) as session:
+            session.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder_id)
+                .values(acquired_at=datetime.utcnow())
+            )
+            session.commit()
+
+    def heartbeat(self):
+        """One election round: acquire/renew and fire the callbacks on a change of role."""
+        try:
+            leader = self.try_acquire()
+        except Exception as error:
+            # Cannot reach the database: assume someone else will take over once our lease expires
+            print(f"LEADER: Heartbeat failed: {error}")
+            leader = False
+
+        if leader and not self.is_leader:
+            self.is_leader = True
+            self._mark_acquired()
+            print(f"LEADER: {self.holder_id} acquired the '{self.name}' lease.")
+            if self.on_elected:
+                self.on_elected()
+        elif not leader and self.is_leader:
+            self.is_leader = False
+            print(f"LEADER: {self.holder_id} lost the '{self.name}' lease.")
+            if self.on_demoted:
+                self.on_demoted()
+        metrics.set_gauge(f"{self.name}_is_leader", int(self.is_leader))
+
+    def _loop(self):
+        interval = self.ttl.total_seconds() / 3
+        while not self._stop.wait(interval):
+            self.heartbeat()
+
+    def start(self):
+        """Runs the first election round now, then heartbeats on a daemon thread."""
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._loop, name=f"{self.name}-lease", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.is_leader:
+            self.is_leader = False
+            if self.on_demoted:
+                self.on_demoted()
+            self.release()
@@ -1,10 +1,14 @@
 # backend/services/llm_translator.py
 import os
 import json
+import hashlib
 from google import genai
 from google.genai.errors import APIError
 from typing import Dict, Any, List
 
+from services.cache import ResponseCache, shared_tier_from_env
+from services.metrics import metrics
+
 
 # Initialize Gemini Client (Will use the key from .env automatically)
 try:
@@ -15,46 +19,94 @@ except Exception as e:
     client = None
 
 
-def generate_insight_summary(anomaly_data: Dict[str, Any]) -> str:
-    """
-    Task 5.1: Converts anomaly data into a human-readable business summary.
-    """
-    if not client:
-        return "AI Insight Service Offline: Missing API Key."
+# --- Insight summaries ---
+# Summaries are cached by a hash of the canonical anomaly payload (identical anomalies are
+# summarized once, concurrent identical requests share one Gemini call), and NORMAL payloads
+# get a fixed text without calling Gemini at all.
+LLM_SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("LLM_SUMMARY_CACHE_TTL_SECONDS", "86400"))
+LLM_SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("LLM_SUMMARY_CACHE_MAX_ENTRIES", "2048"))
+summary_cache = ResponseCache(
+    "llm_summary", LLM_SUMMARY_CACHE_MAX_ENTRIES, LLM_SUMMARY_CACHE_TTL_SECONDS,
+    shared=shared_tier_from_env("llm_summary", LLM_SUMMARY_CACHE_TTL_SECONDS),
+)
+
+# Returned when the Gemini call fails; callers caching whole payloads must not store it
+SUMMARY_ERROR = "AI Insight Service Error: Could not generate summary."
+NORMAL_SUMMARY = ("All key delivery metrics are within their historical norms. "
+                  "No anomalies were detected in the latest data, so no action is needed right now.")
+
+
+def canonical_payload(anomaly_data: Dict[str, Any]) -> str:
+    """Key-order-independent JSON of a payload (also what the prompt embeds)."""
+    return json.dumps(anomaly_data, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def summary_cache_key(anomaly_data: Dict[str, Any]) -> str:
+    return hashlib.sha256(canonical_payload(anomaly_data).encode()).hexdigest()
 
+
+def _request_insight_summary(payload: str) -> str:
+    """One Gemini call. Raises on failure, so errors are never cached."""
     # Construct the prompt based on the structured data
     prompt = f"""
     You are an expert Supply Chain Analyst. Your task is to provide a concise, professional,
     and urgent narrative summary (max 3 sentences) of the latest supply chain anomaly.
     Focus on the metric, the change, and the potential business impact.
 
-    Anomaly Data: {json.dumps(anomaly_data)}
+    Anomaly Data: {payload}
 
     Generate the summary:
     """
-    
-    try:
+    with metrics.timer("llm_summary_seconds"):
         response = client.models.generate_content(
             model='gemini-2.5-flash',
             contents=prompt
         )
-        return response.text.strip()
-    except APIError as e:
-        print(f"Gemini API Error (Summary): {e}")
-        return "AI Insight Service Error: Could not generate summary."
+    return response.text.strip()
 
 
-def translate_natural_language_to_sql(user_query: str, table_schema: List[Dict[str, str]]) -> str:
+def generate_insight_summary(anomaly_data: Dict[str, Any]) -> str:
     """
-    Task 5.2: Converts a user's natural language query into a secure SQL SELECT statement.
-    The response MUST be a single, valid SQL query string enclosed in triple backticks.
+    Task 5.1: Converts anomaly data into a human-readable business summary.
     """
+    if not anomaly_data.get("flagged"):
+        metrics.increment("llm_summary_templated")
+        return NORMAL_SUMMARY
     if not client:
-        return "SELECT 'AI Query Service Offline' AS status;"
+        return "AI Insight Service Offline: Missing API Key."
+
+    payload = canonical_payload(anomaly_data)
+    try:
+        return summary_cache.get_or_compute(summary_cache_key(anomaly_data), lambda: _request_insight_summary(payload))
+    except APIError as e:
+        print(f"Gemini API Error (Summary): {e}")
+    except Exception as e:
+        # Network failures and the like: the insights still render, without a summary
+        print(f"Gemini request failed (Summary): {e}")
+    metrics.increment("llm_summary_errors")
+    return SUMMARY_ERROR
+
 
+# --- NL -> SQL ---
+# Bumped whenever the translation prompt changes: it is part of the schema fingerprint that keys
+# cached translations (services/query_cache.py), so old translations stop matching.
+SQL_TRANSLATION_MODEL = 'gemini-2.5-flash'
+SQL_PROMPT_VERSION = 2
+# Stands in for a relative date phrase ('last week', 'past 30 days', ...) in a normalized question
+DATE_RANGE_PLACEHOLDER = "{date_range}"
+
+
+def request_sql_translation(user_query: str, table_schema: List[Dict[str, str]]) -> str:
+    """One Gemini call. Raises on failure, so errors are never cached."""
     # The schema provides the context needed for the model to write correct SQL
     schema_context = json.dumps(table_schema, indent=2)
-    
+    date_rule = ""
+    if DATE_RANGE_PLACEHOLDER in user_query:
+        user_query = user_query.replace(DATE_RANGE_PLACEHOLDER, "within the requested date range")
+        date_rule = """
+    5. Filter the requested date range with delivery_date BETWEEN :start_date AND :end_date.
+       Write the bind parameters :start_date and :end_date exactly like that, never literal dates."""
+
     prompt = f"""
     You are a SQL query generation model. Your goal is to convert a user's plain English request
     into a single, valid PostgreSQL SELECT statement that queries the 'salesdata' table.
@@ -66,22 +118,37 @@ def translate_natural_language_to_sql(user_query: str, table_schema: List[Dict[s
     1. Only generate the SQL query itself (e.g., SELECT ...). DO NOT include ANY other text or explanation.
     2. Enclose the final SQL query in triple backticks (```sql).
     3. Use standard SQL functions (e.g., SUM, WHERE, GROUP BY).
-    4. For date queries like 'yesterday' or '17th Nov', translate them to standard date comparisons (e.g., '2025-11-17').
+    4. For date queries like 'yesterday' or '17th Nov', translate them to standard date comparisons (e.g., '2025-11-17').{date_rule}
 
     User Query: "{user_query}"
     """
     
-    try:
+    with metrics.timer("llm_sql_seconds"):
         response = client.models.generate_content(
-            model='gemini-2.5-flash',
+            model=SQL_TRANSLATION_MODEL,
             contents=prompt
         )
-        # Extract the raw SQL query from the model's response format (```sql...```)
-        sql_text = response.text.strip()
-        if sql_text.startswith('```sql'):
-            return sql_text.replace('```sql', '').replace('```', '').strip()
-        return sql_text # Return text if formatting failed (will likely fail later)
-        
+    # Extract the raw SQL query from the model's response format (```sql...```)
+    sql_text = response.text.strip()
+    if sql_text.startswith('```sql'):
+        return sql_text.replace('```sql', '').replace('```', '').strip()
+    return sql_text # Return text if formatting failed (will likely fail later)
+
+
+def translate_natural_language_to_sql(user_query: str, table_schema: List[Dict[str, str]]) -> str:
+    """
+    Task 5.2: Converts a user's natural language query into a secure SQL SELECT statement.
+    The response MUST be a single, valid SQL query string enclosed in triple backticks.
+    A DATE_RANGE_PLACEHOLDER in the query is translated to the :start_date / :end_date bind parameters.
+    """
+    if not client:
+        return "SELECT 'AI Query Service Offline' AS status;"
+
+    try:
+        return request_sql_translation(user_query, table_schema)
     except APIError as e:
         print(f"Gemini API Error (SQL Translator): {e}")
-        return "SELECT 'AI Translator Error' AS status;"
\ No newline at end of file
+    except Exception as e:
+        print(f"Gemini request failed (SQL Translator): {e}")
+    metrics.increment("llm_sql_errors")
+    return "SELECT 'AI Translator Error' AS status;"
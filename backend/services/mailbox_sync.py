@@ -0,0 +1,258 @@
+# backend/services/mailbox_sync.py
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlmodel import Session, select
+
+from models.mailbox_model import MailboxSyncState
+from models.workflow import Workflow
+from services.attachment_sources import SOURCE_GMAIL
+
+
+@dataclass
+class MailMessage:
+    """Header-level view of a new message, enough to match it against workflows."""
+    message_id: str
+    subject: str = ""
+    sender: str = ""
+    internal_date: int = 0 # epoch millis, used to keep message order
+    attachments: List[Tuple[str, bytes]] = field(default_factory=list) # only filled by FakeMailBackend
+
+
+class HistoryExpiredError(Exception):
+    """The stored historyId is too old for the provider (Gmail answers 404)."""
+
+
+class MailBackend(ABC):
+    """Minimal mailbox API the sync needs. Gmail in production, FakeMailBackend in tests/load runs."""
+
+    @abstractmethod
+    def current_history_id(self) -> str:
+        """Latest history id of the mailbox (the starting point on first sync)."""
+
+    @abstractmethod
+    def list_new_message_ids(self, start_history_id: str) -> Tuple[List[str], str]:
+        """Message ids added after start_history_id, oldest first, plus the new history id."""
+
+    @abstractmethod
+    def get_messages(self, message_ids: List[str]) -> List[MailMessage]:
+        """Subject/sender/date for the given ids."""
+
+
+class GmailMailBackend(MailBackend):
+    """Gmail implementation on top of users.history.list (API calls scale with new mail)."""
+
+    # Gmail batch endpoint accepts up to 100 calls; stay well below for payload size
+    METADATA_BATCH_SIZE = 50
+
+    def __init__(self, user_id: str = 'me'):
+        self.user_id = user_id
+
+    def _service(self):
+        from services.gmail_monitor import get_gmail_service
+        service = get_gmail_service()
+        if service is None:
+            raise RuntimeError("Gmail service could not be initialized.")
+        return service
+
+    def current_history_id(self) -> str:
+        profile = self._service().users().getProfile(userId=self.user_id).execute()
+        return str(profile['historyId'])
+
+    def list_new_message_ids(self, start_history_id: str) -> Tuple[List[str], str]:
+        from googleapiclient.errors import HttpError
+
+        service = self._service()
+        message_ids: List[str] = []
+        latest_history_id = start_history_id
+        page_token = None
+        try:
+            while True:
+                response = service.users().history().list(
+                    userId=self.user_id,
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'],
+                    pageToken=page_token,
+                ).execute()
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message_ids.append(added['message']['id'])
+                latest_history_id = str(response.get('historyId', latest_history_id))
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+        except HttpError as error:
+            if getattr(error, 'resp', None) is not None and error.resp.status == 404:
+                raise HistoryExpiredError(str(error))
+            raise
+
+        # A message can appear in several history records
+        return list(dict.fromkeys(message_ids)), latest_history_id
+
+    def get_messages(self, message_ids: List[str]) -> List[MailMessage]:
+        service = self._service()
+        messages: Dict[str, MailMessage] = {}
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                print(f"WARNING: Mailbox sync could not read message {request_id}: {exception}")
+                return
+            headers = {h['name'].lower(): h['value'] for h in response.get('payload', {}).get('headers', [])}
+            messages[response['id']] = MailMessage(
+                message_id=response['id'],
+                subject=headers.get('subject', ''),
+                sender=headers.get('from', ''),
+                internal_date=int(response.get('internalDate', 0)),
+            )
+
+        for start in range(0, len(message_ids), self.METADATA_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=collect)
+            for message_id in message_ids[start:start + self.METADATA_BATCH_SIZE]:
+                batch.add(
+                    service.users().messages().get(
+                        userId=self.user_id, id=message_id,
+                        format='metadata', metadataHeaders=['Subject', 'From'],
+                    ),
+                    request_id=message_id,
+                )
+            batch.execute()
+
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+
+
+class FakeMailBackend(MailBackend):
+    """In-memory mailbox with Gmail-like history ids, for tests and offline load runs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._history_id = 1000
+        self._log: List[Tuple[int, MailMessage]] = []
+        self._ids = itertools.count(1)
+        self.api_calls = 0
+
+    def add_message(self, subject: str, sender: str, attachments: Optional[List[Tuple[str, bytes]]] = None) -> MailMessage:
+        with self._lock:
+            self._history_id += 1
+            message = MailMessage(
+                message_id=f"fake-{next(self._ids)}",
+                subject=subject,
+                sender=sender,
+                internal_date=int(datetime.utcnow().timestamp() * 1000),
+                attachments=list(attachments or []),
+            )
+            self._log.append((self._history_id, message))
+            return message
+
+    def current_history_id(self) -> str:
+        self.api_calls += 1
+        return str(self._history_id)
+
+    def list_new_message_ids(self, start_history_id: str) -> Tuple[List[str], str]:
+        self.api_calls += 1
+        start = int(start_history_id)
+        with self._lock:
+            return [m.message_id for h, m in self._log if h > start], str(self._history_id)
+
+    def get_messages(self, message_ids: List[str]) -> List[MailMessage]:
+        self.api_calls += 1
+        wanted = set(message_ids)
+        with self._lock:
+            return [m for _, m in self._log if m.message_id in wanted]
+
+
+def workflow_matches(workflow: Workflow, message: MailMessage) -> bool:
+    """Local equivalent of the Gmail query 'subject:<trigger_subject> from:<trigger_sender>'."""
+    if workflow.trigger_subject and workflow.trigger_subject.lower() not in message.subject.lower():
+        return False
+    if workflow.trigger_sender and workflow.trigger_sender.lower() not in message.sender.lower():
+        return False
+    return True
+
+
+class MailboxSync:
+    """
+    Pulls only the mail added since the last stored historyId and fans each new message
+    out to every active Workflow whose trigger_subject/trigger_sender matches, so the
+    number of API calls depends on new mail, not on the number of workflows.
+    """
+
+    def __init__(self, backend: MailBackend, mailbox: str = 'me'):
+        self.backend = backend
+        self.mailbox = mailbox
+        # One sync at a time per process; the scheduler may fire while a slow sync runs
+        self._lock = threading.Lock()
+
+    def sync(self, session: Session, on_match: Callable[[Workflow, MailMessage], None],
+             on_gap: Optional[Callable[[Workflow], None]] = None) -> List[Tuple[Workflow, MailMessage]]:
+        """
+        Runs one incremental sync. on_match is called once per (workflow, message), in message order.
+        on_gap is called once per active Gmail workflow when the sync (re-)baselines, i.e. when mail
+        before the new baseline will never come through history; it should start a catch-up search.
+        """
+        if not self._lock.acquire(blocking=False):
+            print("MAILBOX SYNC: Previous sync still running. Skipping.")
+            return []
+        try:
+            return self._sync(session, on_match, on_gap)
+        finally:
+            self._lock.release()
+
+    def _gmail_workflows(self, session: Session) -> List[Workflow]:
+        # Only Gmail-backed workflows; other sources are polled by their own jobs
+        return session.exec(
+            select(Workflow).where(Workflow.is_active == True, Workflow.source_type == SOURCE_GMAIL)  # noqa: E712
+        ).all()
+
+    def _baseline(self, session: Session, state: MailboxSyncState, on_gap) -> List[Tuple[Workflow, MailMessage]]:
+        """Starts history from "now". Workflows catch up on older mail with their own search (on_gap)."""
+        history_id = self.backend.current_history_id()
+        if on_gap is not None:
+            # Hand off before storing the baseline: a crash here re-baselines and asks again
+            for workflow in self._gmail_workflows(session):
+                on_gap(workflow)
+        state.last_history_id = history_id
+        state.last_synced_at = datetime.utcnow()
+        session.add(state)
+        session.commit()
+        return []
+
+    def _sync(self, session: Session, on_match, on_gap) -> List[Tuple[Workflow, MailMessage]]:
+        state = session.get(MailboxSyncState, self.mailbox)
+        if state is None:
+            state = MailboxSyncState(mailbox=self.mailbox)
+
+        if not state.last_history_id:
+            self._baseline(session, state, on_gap)
+            print(f"MAILBOX SYNC: Baseline historyId {state.last_history_id} stored.")
+            return []
+
+        try:
+            message_ids, latest_history_id = self.backend.list_new_message_ids(state.last_history_id)
+        except HistoryExpiredError:
+            print("WARNING: MAILBOX SYNC: Stored historyId expired. Re-baselining; workflows catch up on the gap with their own search.")
+            return self._baseline(session, state, on_gap)
+
+        matches: List[Tuple[Workflow, MailMessage]] = []
+        if message_ids:
+            messages = sorted(self.backend.get_messages(message_ids), key=lambda m: m.internal_date)
+            workflows = self._gmail_workflows(session)
+            for message in messages:
+                for workflow in workflows:
+                    if workflow_matches(workflow, message):
+                        matches.append((workflow, message))
+
+        # Hand off before advancing the cursor: a crash here replays rather than drops mail
+        for workflow, message in matches:
+            on_match(workflow, message)
+
+        state.last_history_id = latest_history_id
+        state.last_synced_at = datetime.utcnow()
+        state.messages_seen += len(message_ids)
+        session.add(state)
+        session.commit()
+
+        print(f"MAILBOX SYNC: {len(message_ids)} new message(s), {len(matches)} workflow match(es).")
+        return matches
@@ -0,0 +1,306 @@
+# backend/services/online_anomalies.py
+"""
+Ingest-time anomaly scoring. Each batch's days are read back from the freshly refreshed
+KpiDailyRollup rows and, per series (workflow total / product / customer) and metric, scored
+against KpiRunningStat (Welford mean / variance over every day seen, plus an EWMA) before the
+day is folded into those statistics. Flagged days go to AnomalyEvent, in the same transaction
+as the batch; the run links them to its WorkflowLog afterwards (link_anomaly_events).
+
+Cost is O(days x series in the batch). A day that is already the series' last day (the same
+day delivered again) replaces that observation; older days arriving late update the rollups
+but not the running statistics. The first batch of a workflow that already has data seeds the
+statistics from its rollup history once.
+
+    python -m services.online_anomalies --workflow-id 3     # rebuild statistics from the rollups
+    python -m services.online_anomalies --all
+"""
+import argparse
+import math
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from sqlalchemy import delete, select, tuple_, update
+from sqlmodel import Session
+
+from analytics.anomaly_detector import (
+    EWMA_SPAN, METRICS, MIN_DAILY_ORDERS, MIN_DETECTORS, MIN_HISTORY, RECENT_DAYS, SEVERITIES, Z_THRESHOLD,
+)
+from models.anomaly_model import AnomalyEvent, KpiRunningStat
+from models.rollup_model import KpiDailyRollup
+from services.metrics import metrics
+
+ONLINE_METRICS = ("otif_rate", "order_count")
+ONLINE_DETECTORS = ("welford", "ewma")
+ALPHA = 2.0 / (EWMA_SPAN + 1)
+LOOKUP_CHUNK = 500
+
+_TABLES_READY: Set[str] = set()
+
+SeriesKey = Tuple[str, str, str] # (dimension, dim_key, metric)
+
+
+def _ensure_tables(connection):
+    url = str(connection.engine.url)
+    if url not in _TABLES_READY:
+        KpiRunningStat.__table__.create(connection, checkfirst=True)
+        AnomalyEvent.__table__.create(connection, checkfirst=True)
+        _TABLES_READY.add(url)
+
+
+def _as_date(value) -> date:
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _observations(session: Session, workflow_id: int, days: Optional[Iterable[date]] = None,
+                  before: Optional[date] = None) -> List[Tuple[date, str, str, str, float, int]]:
+    """(day, dimension, dim_key, metric, value, orders) for the given days (or all days before `before`), by day."""
+    columns = (KpiDailyRollup.day, KpiDailyRollup.dimension, KpiDailyRollup.dim_key, KpiDailyRollup.order_count,
+               KpiDailyRollup.on_time_count, KpiDailyRollup.in_full_count, KpiDailyRollup.otif_count)
+    counters = {"on_time_count": 4, "in_full_count": 5, "otif_count": 6}
+    stmt = select(*columns).where(KpiDailyRollup.workflow_id == workflow_id)
+    if days is not None:
+        stmt = stmt.where(KpiDailyRollup.day.in_(sorted(days)))
+    if before is not None:
+        stmt = stmt.where(KpiDailyRollup.day < before)
+
+    observations = []
+    for row in session.execute(stmt).all():
+        orders = row[3]
+        for metric in ONLINE_METRICS:
+            numerator = METRICS[metric][0]
+            if numerator is None:
+                value = float(orders)
+            elif orders >= MIN_DAILY_ORDERS:
+                value = row[counters[numerator]] / orders
+            else:
+                continue # too few orders for a meaningful rate
+            observations.append((_as_date(row[0]), row[1], row[2], metric, value, orders))
+    observations.sort(key=lambda observation: observation[0])
+    return observations
+
+
+def _load_stats(session: Session, workflow_id: int, keys: Sequence[SeriesKey]) -> Dict[SeriesKey, KpiRunningStat]:
+    stats = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        stmt = select(KpiRunningStat).where(
+            KpiRunningStat.workflow_id == workflow_id,
+            tuple_(KpiRunningStat.dimension, KpiRunningStat.dim_key, KpiRunningStat.metric).in_(chunk),
+        )
+        for stat in session.execute(stmt).scalars():
+            stats[(stat.dimension, stat.dim_key, stat.metric)] = stat
+    return stats
+
+
+def _remove_last(stat: KpiRunningStat):
+    """Takes the last day's observation back out (Welford in reverse; EWMA from its saved state)."""
+    value = stat.last_value
+    if stat.count <= 1:
+        stat.count, stat.mean, stat.m2 = 0, 0.0, 0.0
+    else:
+        previous_mean = (stat.count * stat.mean - value) / (stat.count - 1)
+        stat.m2 = max(stat.m2 - (value - previous_mean) * (value - stat.mean), 0.0)
+        stat.mean = previous_mean
+        stat.count -= 1
+    stat.ewma_mean, stat.ewma_var = stat.prev_ewma_mean, stat.prev_ewma_var
+
+
+def _add(stat: KpiRunningStat, day: date, value: float):
+    stat.prev_ewma_mean, stat.prev_ewma_var = stat.ewma_mean, stat.ewma_var
+    if stat.count == 0:
+        stat.ewma_mean, stat.ewma_var = value, 0.0
+    else:
+        diff = value - stat.ewma_mean
+        increment = ALPHA * diff
+        stat.ewma_mean += increment
+        stat.ewma_var = (1 - ALPHA) * (stat.ewma_var + diff * increment)
+    stat.count += 1
+    delta = value - stat.mean
+    stat.mean += delta / stat.count
+    stat.m2 += delta * (value - stat.mean)
+    stat.last_day, stat.last_value = day, value
+
+
+def _score(stat: KpiRunningStat, metric: str, value: float, orders: int) -> Optional[Dict[str, Any]]:
+    """Scores a value against the statistics (before it is added); None unless enough detectors fire."""
+    if stat.count < MIN_HISTORY:
+        return None
+    _, direction, std_floor = METRICS[metric]
+    baselines = (
+        (stat.mean, math.sqrt(stat.m2 / (stat.count - 1))),
+        (stat.ewma_mean, math.sqrt(stat.ewma_var)),
+    )
+    z_scores = []
+    for mean, std in baselines:
+        floor = std_floor
+        if METRICS[metric][0] is not None and 0.0 < mean < 1.0:
+            floor = max(floor, math.sqrt(mean * (1 - mean) / orders)) # binomial noise of a rate over `orders`
+        z_scores.append((value - mean) / max(std, floor))
+    scores = [-z if direction == "drop" else z if direction == "spike" else abs(z) for z in z_scores]
+    hits = [score >= Z_THRESHOLD for score in scores]
+    if METRICS[metric][0] is None:
+        hits = [hit and mean >= MIN_DAILY_ORDERS for hit, (mean, _) in zip(hits, baselines)]
+    if sum(hits) < min(MIN_DETECTORS, len(baselines)):
+        return None
+
+    strongest = max(range(len(scores)), key=lambda index: scores[index])
+    return {
+        "value": round(value, 4),
+        "expected": round(baselines[strongest][0], 4),
+        "z_score": round(z_scores[strongest], 2),
+        "direction": "drop" if z_scores[strongest] < 0 else "spike",
+        "severity": next(label for bound, label in SEVERITIES if scores[strongest] >= bound),
+        "detectors": [name for name, hit in zip(ONLINE_DETECTORS, hits) if hit],
+        "orders": int(orders),
+    }
+
+
+def _apply(session: Session, workflow_id: int, observations, emit_from: Optional[date]) -> int:
+    """
+    Scores and folds observations (in day order) into the running statistics. Days on or after
+    emit_from are written to AnomalyEvent (None = seed only). Returns the number of flagged days.
+    """
+    keys = sorted({(dimension, dim_key, metric) for _, dimension, dim_key, metric, _, _ in observations})
+    stats = _load_stats(session, workflow_id, keys)
+
+    emitted_days = sorted({day for day, *_ in observations if emit_from is not None and day >= emit_from})
+    events: Dict[Tuple[str, str, str, date], AnomalyEvent] = {}
+    if emitted_days:
+        stmt = select(AnomalyEvent).where(AnomalyEvent.workflow_id == workflow_id, AnomalyEvent.day.in_(emitted_days))
+        events = {(event.dimension, event.dim_key, event.metric, event.day): event
+                  for event in session.execute(stmt).scalars()}
+
+    flagged = late = 0
+    for day, dimension, dim_key, metric, value, orders in observations:
+        key = (dimension, dim_key, metric)
+        stat = stats.get(key)
+        if stat is None:
+            stat = stats[key] = KpiRunningStat(workflow_id=workflow_id, dimension=dimension, dim_key=dim_key, metric=metric)
+            session.add(stat)
+        if stat.last_day is not None and day < stat.last_day:
+            late += 1
+            continue
+        if stat.last_day == day:
+            _remove_last(stat) # the same day again: replace its observation
+
+        anomaly = _score(stat, metric, value, orders)
+        _add(stat, day, value)
+        if emit_from is None or day < emit_from:
+            continue
+
+        existing = events.get((dimension, dim_key, metric, day))
+        if anomaly is None:
+            if existing is not None:
+                session.delete(existing) # the day's complete data is no longer anomalous
+            continue
+        flagged += 1
+        if existing is None:
+            existing = AnomalyEvent(workflow_id=workflow_id, dimension=dimension, dim_key=dim_key, metric=metric, day=day,
+                                    **anomaly)
+        else:
+            for field, field_value in anomaly.items():
+                setattr(existing, field, field_value)
+            existing.workflow_log_id = None # re-flagged by this run
+            existing.detected_at = datetime.utcnow()
+        session.add(existing)
+
+    if late:
+        metrics.increment("anomaly_late_observations", late)
+    return flagged
+
+
+def score_batch(session: Session, workflow_id: int, days: Iterable[date]) -> int:
+    """
+    Scores the days a batch touched (their rollups must already be refreshed) and updates the
+    running statistics. Does not commit. Returns the number of anomalies flagged.
+    """
+    days = sorted({_as_date(day) for day in days})
+    if not days:
+        return 0
+    _ensure_tables(session.connection())
+    with metrics.timer("anomaly_scoring_seconds"):
+        seeded = session.execute(
+            select(KpiRunningStat.id).where(KpiRunningStat.workflow_id == workflow_id).limit(1)
+        ).first() is not None
+        if not seeded:
+            # Existing history (e.g. data loaded before ingest-time scoring): baseline only, no events
+            _apply(session, workflow_id, _observations(session, workflow_id, before=days[0]), None)
+        # A large backfill batch only reports its most recent days
+        flagged = _apply(session, workflow_id, _observations(session, workflow_id, days),
+                         days[-1] - timedelta(days=RECENT_DAYS - 1))
+    if flagged:
+        metrics.increment("anomalies_flagged", flagged)
+    return flagged
+
+
+def link_anomaly_events(session: Session, workflow_id: int, workflow_log_id: int) -> int:
+    """Attaches the workflow's not yet linked events to the run's WorkflowLog. Does not commit."""
+    _ensure_tables(session.connection())
+    result = session.execute(
+        update(AnomalyEvent)
+        .where(AnomalyEvent.workflow_id == workflow_id, AnomalyEvent.workflow_log_id.is_(None))
+        .values(workflow_log_id=workflow_log_id)
+    )
+    return result.rowcount or 0
+
+
+def load_recent_anomalies(session: Session, workflow_ids: Sequence[int], recent_days: int = RECENT_DAYS,
+                          limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Stored events of the last recent_days (up to the latest flagged day) of the workflows,
+    strongest first, in the same shape as analytics/anomaly_detector.detect_series_anomalies.
+    """
+    workflow_ids = list(workflow_ids)
+    if not workflow_ids:
+        return []
+    _ensure_tables(session.connection())
+    latest = session.execute(
+        select(AnomalyEvent.day).where(AnomalyEvent.workflow_id.in_(workflow_ids)).order_by(AnomalyEvent.day.desc()).limit(1)
+    ).scalar()
+    if latest is None:
+        return []
+    stmt = select(AnomalyEvent).where(
+        AnomalyEvent.workflow_id.in_(workflow_ids),
+        AnomalyEvent.day > _as_date(latest) - timedelta(days=recent_days),
+    )
+    events = sorted(session.execute(stmt).scalars(), key=lambda event: (-abs(event.z_score), event.day))[:limit]
+    return [{
+        "workflow_id": event.workflow_id,
+        "dimension": event.dimension,
+        "key": event.dim_key,
+        "day": event.day.isoformat(),
+        "metric": event.metric,
+        "direction": event.direction,
+        "value": event.value,
+        "expected": event.expected,
+        "z_score": event.z_score,
+        "detectors": event.detectors,
+        "severity": event.severity,
+        "orders": event.orders,
+        "workflow_log_id": event.workflow_log_id,
+    } for event in events]
+
+
+def rebuild_running_stats(session: Session, workflow_id: int) -> int:
+    """Drops a workflow's running statistics and replays its whole rollup history (no events). Commits."""
+    _ensure_tables(session.connection())
+    session.execute(delete(KpiRunningStat).where(KpiRunningStat.workflow_id == workflow_id))
+    observations = _observations(session, workflow_id)
+    _apply(session, workflow_id, observations, None)
+    session.commit()
+    return len(observations)
+
+
+if __name__ == "__main__":
+    from database import get_session
+    from models.workflow import Workflow
+
+    parser = argparse.ArgumentParser(description="Rebuild ingest-time anomaly statistics from the KPI rollups.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--workflow-id", type=int, action="append", help="Workflow to rebuild (repeatable).")
+    target.add_argument("--all", action="store_true", help="Rebuild every workflow.")
+    args = parser.parse_args()
+
+    with next(get_session()) as session:
+        workflow_ids = args.workflow_id or session.execute(select(Workflow.id).order_by(Workflow.id)).scalars().all()
+        for workflow_id in workflow_ids:
+            print(f"Workflow {workflow_id}: {rebuild_running_stats(session, workflow_id)} observations replayed.")
@@ -0,0 +1,422 @@
+# backend/services/query_cache.py
+"""
+Cache of natural-language -> SQL translations for /api/v1/query-data.
+
+Key: sha256 of the normalized question plus the schema fingerprint (the 'salesdata' columns
+the model sees, the translation model, SQL_PROMPT_VERSION and CACHE_RULES_VERSION), so a schema,
+prompt or storage-rule change starts a fresh key space instead of reusing SQL written against the old one.
+
+Normalization (normalize_query): Unicode NFKC, whitespace collapsed, trailing punctuation and
+'please' dropped, words lowercased. Quoted text and tokens containing digits, '_' or '-'
+(product / customer ids) keep their case. One relative date phrase ('yesterday', 'last week',
+'past 30 days', 'this month', ...) is replaced by DATE_RANGE_PLACEHOLDER and resolved to
+start/end dates for today ('since <phrase>' runs from the phrase's start through today). The
+translation filters on :start_date / :end_date, so the SQL cached for "top products last week" is
+reused next week, and for "top products yesterday" too. Questions with several relative date
+phrases, or with date words no phrase covers ('3 days ago', 'last quarter', 'this weekend',
+'since monday'), are not cached: their SQL hard-codes dates.
+
+Tiers: the 'nl_sql' ResponseCache (per-process LRU + optional Redis, concurrent misses
+coalesced), then the NlQueryCacheEntry table, which survives restarts. warm_local loads the
+most used stored entries into the LRU at startup; prewarm translates common questions ahead
+of time (at most QUERY_CACHE_PREWARM_MAX per API request). Only SELECTs that use the bind parameters when (and only when) the question had a date
+range, and hold no date literals or current-date functions, are stored; LLM errors never are.
+
+    python -m services.query_cache --stats                        # with the most asked questions
+    python -m services.query_cache --prewarm                      # DEFAULT_PREWARM_QUESTIONS
+    python -m services.query_cache --prewarm --file questions.txt # one question per line
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session
+
+from models.query_cache_model import NlQueryCacheEntry
+from models.sales_data_model import SalesData
+from services import llm_translator
+from services.cache import ResponseCache, shared_tier_from_env
+from services.metrics import metrics
+
+QUERY_CACHE_TTL_DAYS = int(os.getenv("QUERY_CACHE_TTL_DAYS", "30"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "4096")) # per-process LRU
+QUERY_CACHE_WARM_ENTRIES = int(os.getenv("QUERY_CACHE_WARM_ENTRIES", "500")) # loaded into the LRU at startup
+QUERY_CACHE_PREWARM_MAX = int(os.getenv("QUERY_CACHE_PREWARM_MAX", "20")) # questions per prewarm request
+# Bumped when normalize_query / _storable change what may be stored, so entries stored under the
+# old rules stop matching
+CACHE_RULES_VERSION = 2
+
+DEFAULT_PREWARM_QUESTIONS = (
+    "top products last week",
+    "top customers last month",
+    "total order quantity yesterday",
+    "on time delivery rate last 30 days",
+    "in full delivery rate this month",
+    "orders not delivered on time last week",
+    "top products by delivered quantity this month",
+    "number of orders per day last 30 days",
+)
+
+translation_cache = ResponseCache(
+    "nl_sql", QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_DAYS * 86400,
+    shared=shared_tier_from_env("nl_sql", QUERY_CACHE_TTL_DAYS * 86400),
+)
+
+_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+_TABLES_READY: Set[str] = set()
+_COUNTS = {"lookups": 0, "memory_hits": 0, "database_hits": 0, "translations": 0, "uncached": 0}
+_COUNTS_LOCK = threading.Lock()
+_SALES_SCHEMA: Optional[List[Dict[str, str]]] = None
+
+
+# --- Normalization ---
+
+def _month_start(day: date, months_back: int = 0) -> date:
+    month = day.month - 1 - months_back
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+# Relative date phrase -> (start, end) for today. Numbered phrases pass their number.
+_DATE_PHRASES: List[Tuple[str, Callable[..., Tuple[date, date]]]] = [
+    (r"(?:last|past|previous)\s+(\d+)\s+days?", lambda today, n: (today - timedelta(days=int(n)), today)),
+    (r"(?:last|past|previous)\s+(\d+)\s+weeks?", lambda today, n: (today - timedelta(weeks=int(n)), today)),
+    (r"(?:last|past|previous)\s+(\d+)\s+months?", lambda today, n: (_month_start(today, int(n)), today)),
+    (r"today", lambda today: (today, today)),
+    (r"yesterday", lambda today: (today - timedelta(days=1), today - timedelta(days=1))),
+    (r"(?:this|current)\s+week|week\s+to\s+date", lambda today: (_week_start(today), today)),
+    (r"(?:last|previous)\s+week", lambda today: (_week_start(today) - timedelta(days=7),
+                                                 _week_start(today) - timedelta(days=1))),
+    (r"past\s+week", lambda today: (today - timedelta(days=7), today)),
+    (r"(?:this|current)\s+month|month\s+to\s+date", lambda today: (_month_start(today), today)),
+    (r"(?:last|previous)\s+month", lambda today: (_month_start(today, 1), _month_start(today) - timedelta(days=1))),
+    (r"past\s+month", lambda today: (today - timedelta(days=30), today)),
+    (r"(?:this|current)\s+year|year\s+to\s+date", lambda today: (date(today.year, 1, 1), today)),
+    (r"(?:last|previous)\s+year", lambda today: (date(today.year - 1, 1, 1), date(today.year - 1, 12, 31))),
+]
+# The preposition in front of a phrase goes with it ("in the last 7 days" -> "{date_range}")
+_DATE_PHRASE_PATTERNS = [
+    (re.compile(rf"\b(?:(in|during|for|over|from|of|since)\s+)?(?:the\s+)?(?:{pattern})\b"), resolve)
+    for pattern, resolve in _DATE_PHRASES
+]
+_WEEKDAYS = r"monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+# Date words left over once the phrase (if any) is lifted out: the question is relative to today
+# in a way the parameters do not capture
+_RELATIVE_DATE_WORDS = re.compile(
+    rf"\b(?:ago|since|recent|recently|lately|today|yesterday|tomorrow|tonight|weekends?|fortnight|"
+    rf"quarters?|quarterly|[mqy]td|{_WEEKDAYS}|"
+    rf"(?:last|past|previous|next|this|current|coming)\s+(?:\d+\s+)?(?:days?|weeks?|months?|years?))\b"
+)
+# Date literals and current-date functions in translated SQL
+_SQL_DATES = re.compile(
+    r"'\d{4}-\d{2}(?:-\d{2})?[^']*'|\b(?:current_date|current_timestamp|localtimestamp|now|today|"
+    r"date_trunc|interval)\b|\bdate\s*\(",
+    re.IGNORECASE,
+)
+_QUOTED = re.compile(r"('[^']*'|\"[^\"]*\")")
+_KEEPS_CASE = re.compile(r"[\d_-]")
+_PLEASE = re.compile(r"^please[\s,]+|[\s,]+please$")
+_BIND = re.compile(r"(?<![:\w]):(start_date|end_date)\b")
+_QUOTED_IDENTIFIERS = re.compile(r'"[^"]*"')
+
+
+@dataclass
+class NormalizedQuery:
+    text: str # cache key text; a relative date phrase is replaced by DATE_RANGE_PLACEHOLDER
+    parameters: Dict[str, date] = field(default_factory=dict) # start_date / end_date, resolved for today
+    cacheable: bool = True # False if the question has relative dates the parameters do not capture
+
+
+@dataclass
+class Translation:
+    sql: str
+    parameters: Dict[str, date] = field(default_factory=dict)
+    source: str = "llm" # 'memory', 'database', 'llm' or 'uncached'
+
+
+def _normalize_words(text: str) -> str:
+    """Collapses whitespace and lowercases the words outside quotes (ids keep their case)."""
+    parts = _QUOTED.split(text)
+    for position in range(0, len(parts), 2):
+        parts[position] = re.sub(r"\s+", " ", parts[position])
+        parts[position] = re.sub(r"\S+", lambda word: word.group() if _KEEPS_CASE.search(word.group())
+                                 else word.group().lower(), parts[position])
+    return "".join(parts).strip()
+
+
+def normalize_query(user_query: str, today: Optional[date] = None) -> NormalizedQuery:
+    """Canonical form of a question, with its relative date range (if any) lifted into parameters."""
+    today = today or date.today()
+    text = unicodedata.normalize("NFKC", user_query)
+    text = text.replace("‘", "'").replace("’", "'").replace("“", '"').replace("”", '"')
+    text = _normalize_words(text).rstrip("?.!; ").strip()
+    text = _PLEASE.sub("", text).strip()
+
+    matches = []
+    for pattern, resolve in _DATE_PHRASE_PATTERNS:
+        matches += [(match, resolve) for match in pattern.finditer(text)]
+    if not matches:
+        return NormalizedQuery(text, cacheable=not _RELATIVE_DATE_WORDS.search(text))
+    if len(matches) > 1:
+        return NormalizedQuery(text, cacheable=False)
+    match, resolve = matches[0]
+    preposition, *numbers = match.groups()
+    start_date, end_date = resolve(today, *numbers)
+    if preposition == "since":
+        end_date = today
+    rest = f"{text[:match.start()]} {text[match.end():]}"
+    text = f"{text[:match.start()]}{llm_translator.DATE_RANGE_PLACEHOLDER}{text[match.end():]}"
+    return NormalizedQuery(text, {"start_date": start_date, "end_date": end_date},
+                           cacheable=not _RELATIVE_DATE_WORDS.search(rest))
+
+
+def sales_schema_for_llm() -> List[Dict[str, str]]:
+    """Name and type of every 'salesdata' column (the LLM's schema context). Built once per process."""
+    global _SALES_SCHEMA
+    if _SALES_SCHEMA is None:
+        _SALES_SCHEMA = [{"name": column.key, "type": str(column.type).split("(")[0]}
+                         for column in SalesData.__table__.columns]
+    return _SALES_SCHEMA
+
+
+def schema_fingerprint(table_schema: List[Dict[str, str]]) -> str:
+    """Identifies what a translation was written against: the schema, the model, the prompt and cache rules."""
+    payload = json.dumps({
+        "schema": table_schema,
+        "model": llm_translator.SQL_TRANSLATION_MODEL,
+        "prompt": llm_translator.SQL_PROMPT_VERSION,
+        "rules": CACHE_RULES_VERSION,
+    }, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def cache_key(normalized_text: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{fingerprint}\n{normalized_text}".encode()).hexdigest()
+
+
+# --- Binding ---
+
+def bound_parameters(sql: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """The parameters the SQL actually references (for SQLAlchemy text())."""
+    return {name: parameters[name] for name in set(_BIND.findall(sql)) if name in parameters}
+
+
+def positional_parameters(sql: str, parameters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """The SQL with its :start_date / :end_date rewritten to '?' placeholders, and their values (DuckDB)."""
+    values: List[Any] = []
+
+    def placeholder(match) -> str:
+        values.append(parameters[match.group(1)])
+        return "?"
+
+    return _BIND.sub(placeholder, sql), values
+
+
+def _storable(sql: str, normalized: NormalizedQuery) -> bool:
+    """
+    A SELECT that uses the date bind parameters exactly when the question had a date range, and
+    no date literals or current-date functions (they would be replayed for QUERY_CACHE_TTL_DAYS).
+    """
+    return (sql.upper().startswith("SELECT") and bool(_BIND.search(sql)) == bool(normalized.parameters)
+            and not _SQL_DATES.search(_QUOTED_IDENTIFIERS.sub("", sql)))
+
+
+# --- Persistent tier ---
+
+def _ensure_tables(connection):
+    url = str(connection.engine.url)
+    if url not in _TABLES_READY:
+        NlQueryCacheEntry.__table__.create(connection, checkfirst=True)
+        _TABLES_READY.add(url)
+
+
+def _load_entry(session: Session, key: str) -> Optional[str]:
+    """Stored SQL for key, unless it is older than QUERY_CACHE_TTL_DAYS. Counts the hit. Commits."""
+    _ensure_tables(session.connection())
+    table = NlQueryCacheEntry.__table__
+    sql = session.execute(select(table.c.sql).where(
+        table.c.cache_key == key,
+        table.c.created_at >= datetime.utcnow() - timedelta(days=QUERY_CACHE_TTL_DAYS),
+    )).scalar()
+    if sql is not None:
+        session.execute(update(table).where(table.c.cache_key == key).values(
+            hits=table.c.hits + 1, last_used_at=datetime.utcnow()))
+        session.commit()
+    return sql
+
+
+def _store_entry(session: Session, key: str, fingerprint: str, normalized: NormalizedQuery, sql: str):
+    """Upserts a translation (replacing an expired one with the same key). Commits."""
+    connection = session.connection()
+    _ensure_tables(connection)
+    table = NlQueryCacheEntry.__table__
+    now = datetime.utcnow()
+    row = {"cache_key": key, "schema_fingerprint": fingerprint, "normalized_query": normalized.text, "sql": sql,
+           "parameterized": bool(normalized.parameters), "hits": 0, "created_at": now, "last_used_at": now}
+    dialect = connection.dialect.name
+    if dialect in _INSERTS:
+        stmt = _INSERTS[dialect](table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["cache_key"],
+            set_={"sql": stmt.excluded.sql, "parameterized": stmt.excluded.parameterized, "hits": 0,
+                  "created_at": stmt.excluded.created_at, "last_used_at": stmt.excluded.last_used_at},
+        )
+        session.execute(stmt, [row])
+    else:
+        session.execute(delete(table).where(table.c.cache_key == key))
+        session.execute(insert(table), [row])
+    session.commit()
+
+
+# --- Lookups ---
+
+class _Uncached(Exception):
+    """Carries SQL that must be returned but not cached (errors, unusable translations)."""
+
+    def __init__(self, sql: str):
+        super().__init__(sql)
+        self.sql = sql
+
+
+def _count(name: str, record: bool = True):
+    if not record:
+        return
+    with _COUNTS_LOCK:
+        _COUNTS[name] += 1
+        lookups = _COUNTS["lookups"]
+        hits = _COUNTS["memory_hits"] + _COUNTS["database_hits"]
+    metrics.increment(f"nl_sql_{name}")
+    if lookups:
+        metrics.set_gauge("nl_sql_hit_ratio", round(hits / lookups, 4))
+
+
+def _translate(normalized: NormalizedQuery, table_schema: List[Dict[str, str]]) -> str:
+    """One LLM translation of a normalized question; raises _Uncached if it must not be stored."""
+    if not llm_translator.client:
+        raise _Uncached("SELECT 'AI Query Service Offline' AS status;")
+    try:
+        sql = llm_translator.request_sql_translation(normalized.text, table_schema)
+    except Exception as e:
+        print(f"Gemini request failed (SQL Translator): {e}")
+        metrics.increment("llm_sql_errors")
+        raise _Uncached("SELECT 'AI Translator Error' AS status;")
+    if not _storable(sql, normalized):
+        raise _Uncached(sql)
+    return sql
+
+
+def translate_cached(session: Session, user_query: str, table_schema: List[Dict[str, str]],
+                     record: bool = True) -> Translation:
+    """
+    SQL for a question: from the LRU, the NlQueryCacheEntry table or (on a miss) the LLM.
+    record=False leaves the hit-rate counters alone (pre-warming).
+    """
+    normalized = normalize_query(user_query)
+    _count("lookups", record)
+    if not normalized.cacheable:
+        _count("uncached", record)
+        return Translation(llm_translator.translate_natural_language_to_sql(user_query, table_schema), source="uncached")
+
+    fingerprint = schema_fingerprint(table_schema)
+    key = cache_key(normalized.text, fingerprint)
+    source = "memory"
+
+    def compute() -> str:
+        nonlocal source
+        sql = _load_entry(session, key)
+        if sql is not None:
+            source = "database"
+            return sql
+        source = "llm"
+        sql = _translate(normalized, table_schema)
+        _store_entry(session, key, fingerprint, normalized, sql)
+        return sql
+
+    try:
+        sql = translation_cache.get_or_compute(key, compute)
+    except _Uncached as uncached:
+        _count("uncached", record)
+        return Translation(uncached.sql, normalized.parameters, "uncached")
+    _count({"memory": "memory_hits", "database": "database_hits", "llm": "translations"}[source], record)
+    return Translation(sql, normalized.parameters, source)
+
+
+def prewarm(session: Session, table_schema: List[Dict[str, str]],
+            questions: Iterable[str] = DEFAULT_PREWARM_QUESTIONS) -> List[Dict[str, Any]]:
+    """Translates (or loads) each question so later lookups hit the cache. Returns where each came from."""
+    results = []
+    for question in questions:
+        translation = translate_cached(session, question, table_schema, record=False)
+        results.append({"question": question, "source": translation.source,
+                        "cached": translation.source != "uncached"})
+    return results
+
+
+def warm_local(session: Session, table_schema: List[Dict[str, str]], limit: int = QUERY_CACHE_WARM_ENTRIES) -> int:
+    """Loads the most used stored translations for the current schema into this process's LRU."""
+    _ensure_tables(session.connection())
+    table = NlQueryCacheEntry.__table__
+    rows = session.execute(select(table.c.cache_key, table.c.sql).where(
+        table.c.schema_fingerprint == schema_fingerprint(table_schema),
+        table.c.created_at >= datetime.utcnow() - timedelta(days=QUERY_CACHE_TTL_DAYS),
+    ).order_by(table.c.hits.desc(), table.c.last_used_at.desc()).limit(limit)).all()
+    for key, sql in rows:
+        translation_cache.local.set(key, sql)
+    return len(rows)
+
+
+def cache_stats(session: Session, top: int = 0) -> Dict[str, Any]:
+    """
+    This process's hit rate plus the stored entry counts. top > 0 adds the most asked questions,
+    which span every merchant: the CLI shows them, the API does not.
+    """
+    with _COUNTS_LOCK:
+        counts = dict(_COUNTS)
+    hits = counts["memory_hits"] + counts["database_hits"]
+    _ensure_tables(session.connection())
+    table = NlQueryCacheEntry.__table__
+    entries, stored_hits = session.execute(select(func.count(), func.coalesce(func.sum(table.c.hits), 0))).one()
+    stats = {
+        "process": {**counts, "hit_rate": round(hits / counts["lookups"], 4) if counts["lookups"] else None},
+        "stored": {"entries": entries, "hits": stored_hits},
+    }
+    if top > 0:
+        top_questions = session.execute(
+            select(table.c.normalized_query, table.c.hits).order_by(table.c.hits.desc()).limit(top)
+        ).all()
+        stats["stored"]["top_questions"] = [{"question": question, "hits": question_hits}
+                                            for question, question_hits in top_questions]
+    return stats
+
+
+if __name__ == "__main__":
+    from database import get_session
+
+    parser = argparse.ArgumentParser(description="Inspect or pre-warm the NL -> SQL translation cache.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--stats", action="store_true")
+    action.add_argument("--prewarm", action="store_true")
+    parser.add_argument("--file", help="Questions to pre-warm, one per line (default: the built-in list).")
+    args = parser.parse_args()
+
+    with next(get_session()) as session:
+        if args.stats:
+            print(json.dumps(cache_stats(session, top=10), indent=2, default=str))
+        else:
+            questions = DEFAULT_PREWARM_QUESTIONS
+            if args.file:
+                with open(args.file) as handle:
+                    questions = [line.strip() for line in handle if line.strip()]
+            for result in prewarm(session, sales_schema_for_llm(), questions):
+                print(f"{result['source']:>9}  {result['question']}")
@@ -0,0 +1,309 @@
+# backend/services/run_queue.py
+"""
+Durable ETL run queue on the EtlRun table.
+
+The scheduler, mailbox sync and the manual trigger enqueue runs; workers claim them
+atomically, so several worker processes can drain a backlog without double-processing:
+PostgreSQL claims with SELECT ... FOR UPDATE SKIP LOCKED, other databases with a
+conditional UPDATE (status='queued' -> 'running') that only one worker can win.
+
+A workflow has at most one 'running' run: claims skip runs whose workflow already has one
+(two runs of one workflow would ingest the same backlog and race on its rollups and cursor).
+Manual runs execute inline in the API request; they are inserted as 'running' (start_manual_run)
+and are never claimed, retried or re-queued by workers.
+
+Failed runs go back to 'queued' with exponential backoff (available_at) until
+max_attempts, then to 'dead' (dead letter) with an ERROR WorkflowLog. Runs stuck in
+'running' longer than RUN_STALE_AFTER_SECONDS (crashed worker) are re-queued.
+
+Standalone worker (run from the backend/ folder):
+    python -m services.run_queue --worker-id etl-1
+"""
+import argparse
+import os
+import random
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import exists, func, update
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+
+from database import get_session
+from models.run_model import EtlRun
+from models.log_model import WorkflowLog
+from services.metrics import metrics
+
+RUN_QUEUED = "queued"
+RUN_RUNNING = "running"
+RUN_SUCCEEDED = "succeeded"
+RUN_DEAD = "dead"
+
+RUN_KIND_CHECK = "check"
+RUN_KIND_MESSAGE = "message"
+RUN_KIND_MANUAL = "manual"
+
+RUN_MAX_ATTEMPTS = int(os.getenv("RUN_MAX_ATTEMPTS", "5"))
+RUN_BACKOFF_BASE_SECONDS = int(os.getenv("RUN_BACKOFF_BASE_SECONDS", "30"))
+RUN_BACKOFF_MAX_SECONDS = int(os.getenv("RUN_BACKOFF_MAX_SECONDS", "3600"))
+RUN_STALE_AFTER_SECONDS = int(os.getenv("RUN_STALE_AFTER_SECONDS", "3600"))
+RUN_QUEUE_POLL_SECONDS = int(os.getenv("RUN_QUEUE_POLL_SECONDS", "15"))
+# First key of the PostgreSQL advisory locks that serialize claims per workflow
+RUN_CLAIM_LOCK_CLASS = 7301
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with +/-20% jitter so retries of a failed batch do not fire together."""
+    delay = min(RUN_BACKOFF_MAX_SECONDS, RUN_BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def enqueue_run(session: Session, workflow_id: int, merchant_id: int, kind: str = RUN_KIND_CHECK,
+                message_id: Optional[str] = None, max_attempts: int = RUN_MAX_ATTEMPTS) -> EtlRun:
+    """
+    Adds a run to the queue and commits. A run identical to one that is still queued is not
+    added twice (the queued one is returned), so backed-up triggers collapse into one run.
+    """
+    if kind != RUN_KIND_MANUAL:
+        pending = session.exec(
+            select(EtlRun).where(
+                EtlRun.workflow_id == workflow_id,
+                EtlRun.kind == kind,
+                EtlRun.message_id == message_id if message_id is not None else EtlRun.message_id.is_(None),
+                EtlRun.status == RUN_QUEUED,
+            )
+        ).first()
+        if pending is not None:
+            metrics.increment("etl_runs_coalesced")
+            return pending
+
+    run = EtlRun(workflow_id=workflow_id, merchant_id=merchant_id, kind=kind,
+                 message_id=message_id, max_attempts=max_attempts)
+    session.add(run)
+    session.commit()
+    session.refresh(run)
+    metrics.increment("etl_runs_enqueued")
+    return run
+
+
+def start_manual_run(session: Session, workflow_id: int, merchant_id: int, worker_id: str) -> Optional[EtlRun]:
+    """
+    Records a manual run as already running (the caller executes it inline) and commits.
+    Returns None if the workflow has a run in progress.
+    """
+    _lock_workflow_claims(session, workflow_id)
+    if session.exec(select(EtlRun.id).where(EtlRun.workflow_id == workflow_id, EtlRun.status == RUN_RUNNING)).first():
+        session.rollback()
+        return None
+    now = datetime.utcnow()
+    run = EtlRun(workflow_id=workflow_id, merchant_id=merchant_id, kind=RUN_KIND_MANUAL, status=RUN_RUNNING,
+                 attempts=1, max_attempts=1, available_at=now, started_at=now, worker_id=worker_id)
+    session.add(run)
+    session.commit()
+    session.refresh(run)
+    metrics.increment("etl_runs_enqueued")
+    _record_queue_wait(run)
+    return run
+
+
+def _workflow_idle():
+    """Condition: the run's workflow has no run in progress."""
+    running = aliased(EtlRun)
+    return ~exists().where(running.workflow_id == EtlRun.workflow_id, running.status == RUN_RUNNING)
+
+
+def _claimable(now: datetime):
+    return (EtlRun.status == RUN_QUEUED, EtlRun.available_at <= now, EtlRun.kind != RUN_KIND_MANUAL, _workflow_idle())
+
+
+def _record_queue_wait(run: EtlRun):
+    metrics.observe("etl_run_queue_wait_seconds", max(0.0, (run.started_at - run.available_at).total_seconds()))
+
+
+def _lock_workflow_claims(session: Session, workflow_id: int):
+    """
+    PostgreSQL: serializes claims of one workflow until commit (the NOT EXISTS check cannot see
+    another transaction's uncommitted claim). SQLite serializes writers already.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(select(func.pg_advisory_xact_lock(RUN_CLAIM_LOCK_CLASS, workflow_id)))
+
+
+def claim_run(session: Session, run_id: int, worker_id: str) -> Optional[EtlRun]:
+    """
+    Claims one specific run if it is still queued and due and its workflow has no run in progress.
+    Returns None if someone else got it (or the workflow is busy).
+    """
+    workflow_id = session.exec(select(EtlRun.workflow_id).where(EtlRun.id == run_id)).first()
+    if workflow_id is None:
+        return None
+    _lock_workflow_claims(session, workflow_id)
+    now = datetime.utcnow()
+    # Conditional UPDATE: only one worker can move the row out of 'queued'
+    result = session.execute(
+        update(EtlRun)
+        .where(EtlRun.id == run_id, *_claimable(now))
+        .values(status=RUN_RUNNING, attempts=EtlRun.attempts + 1, started_at=now,
+                finished_at=None, worker_id=worker_id)
+    )
+    if result.rowcount != 1:
+        session.rollback()
+        return None
+    session.commit()
+    run = session.get(EtlRun, run_id, populate_existing=True)
+    _record_queue_wait(run)
+    return run
+
+
+def claim_next_run(session: Session, worker_id: str) -> Optional[EtlRun]:
+    """Claims the oldest due run of an idle workflow, or returns None when nothing is claimable."""
+    now = datetime.utcnow()
+    due = (
+        select(EtlRun)
+        .where(*_claimable(now))
+        .order_by(EtlRun.available_at, EtlRun.id)
+    )
+
+    if session.get_bind().dialect.name == "postgresql":
+        run = session.exec(due.limit(1).with_for_update(skip_locked=True)).first()
+        # Two workers can lock different runs of one workflow: the conditional claim settles it
+        return claim_run(session, run.id, worker_id) if run is not None else None
+
+    # No SKIP LOCKED: try a few candidates with an optimistic conditional UPDATE
+    for candidate_id in session.exec(due.with_only_columns(EtlRun.id).limit(5)).all():
+        run = claim_run(session, candidate_id, worker_id)
+        if run is not None:
+            return run
+    return None
+
+
+def complete_run(session: Session, run: EtlRun, messages_seen: int = 0):
+    run.status = RUN_SUCCEEDED
+    run.finished_at = datetime.utcnow()
+    run.messages_seen = messages_seen
+    run.last_error = None
+    session.add(run)
+    session.commit()
+    metrics.increment("etl_runs_succeeded")
+    metrics.observe("etl_run_duration_seconds", (run.finished_at - run.started_at).total_seconds())
+
+
+def fail_run(session: Session, run: EtlRun, error: str):
+    """Schedules a retry with backoff, or dead-letters the run once max_attempts is reached."""
+    session.rollback() # discard whatever the failed attempt left in the session
+    run = session.get(EtlRun, run.id)
+    run.finished_at = datetime.utcnow()
+    run.last_error = error[:2000]
+
+    if run.attempts < run.max_attempts:
+        delay = backoff_seconds(run.attempts)
+        run.status = RUN_QUEUED
+        run.available_at = run.finished_at + timedelta(seconds=delay)
+        metrics.increment("etl_runs_retried")
+        print(f"RUN QUEUE: Run {run.id} (workflow {run.workflow_id}) failed attempt {run.attempts}/{run.max_attempts}; "
+              f"retrying in {delay:.0f}s. {error}")
+    else:
+        run.status = RUN_DEAD
+        metrics.increment("etl_runs_dead")
+        session.add(WorkflowLog(
+            merchant_id=run.merchant_id,
+            status="ERROR",
+            workflow_id=run.workflow_id,
+            message=f"Run {run.id} gave up after {run.attempts} attempt(s): {run.last_error}"
+        ))
+        print(f"RUN QUEUE: Run {run.id} (workflow {run.workflow_id}) moved to dead letter. {error}")
+    session.add(run)
+    session.commit()
+
+
+def requeue_stale_runs(session: Session, older_than_seconds: int = RUN_STALE_AFTER_SECONDS) -> int:
+    """
+    Puts runs whose worker vanished (still 'running' after the timeout) back in the queue.
+    Stale manual runs are dead-lettered instead: their request is long gone.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+    stale = (EtlRun.status == RUN_RUNNING, EtlRun.started_at < cutoff)
+    session.execute(
+        update(EtlRun)
+        .where(*stale, EtlRun.kind == RUN_KIND_MANUAL)
+        .values(status=RUN_DEAD, finished_at=datetime.utcnow(), last_error="request timed out")
+    )
+    result = session.execute(
+        update(EtlRun)
+        .where(*stale, EtlRun.kind != RUN_KIND_MANUAL)
+        .values(status=RUN_QUEUED, available_at=datetime.utcnow(), last_error="worker timed out")
+    )
+    session.commit()
+    if result.rowcount:
+        print(f"RUN QUEUE: Re-queued {result.rowcount} stale run(s).")
+    return result.rowcount
+
+
+def due_runs(session: Session, limit: int = 200) -> List[EtlRun]:
+    """Claimable runs (due, workflow idle), oldest first (without claiming them)."""
+    return session.exec(
+        select(EtlRun)
+        .where(*_claimable(datetime.utcnow()))
+        .order_by(EtlRun.available_at, EtlRun.id)
+        .limit(limit)
+    ).all()
+
+
+def execute_run(run: EtlRun) -> int:
+    """Does the work of a claimed run. Returns messages seen; raises on failure."""
+    # Imported here: workflow_runner pulls in the parsing/ingestion stack
+    from services.workflow_runner import run_workflow_check, run_workflow_for_message
+
+    if run.kind == RUN_KIND_MESSAGE:
+        return run_workflow_for_message(run.workflow_id, run.message_id)
+    return run_workflow_check(run.workflow_id)
+
+
+def _finish(session: Session, run: EtlRun):
+    try:
+        messages_seen = execute_run(run)
+    except Exception as error:
+        fail_run(session, run, repr(error))
+        return
+    complete_run(session, run, messages_seen)
+
+
+def process_run(run_id: int, worker_id: Optional[str] = None) -> bool:
+    """Claims and executes one specific run. Returns False if it was not claimable (e.g. another worker has it)."""
+    with next(get_session()) as session:
+        run = claim_run(session, run_id, worker_id or default_worker_id())
+        if run is None:
+            return False
+        _finish(session, run)
+        return True
+
+
+def work(worker_id: Optional[str] = None, max_runs: Optional[int] = None, idle_sleep: float = RUN_QUEUE_POLL_SECONDS):
+    """Worker loop: claim the next due run, execute it, repeat. Sleeps when the queue is empty."""
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+    print(f"RUN QUEUE: Worker {worker_id} started.")
+    while max_runs is None or processed < max_runs:
+        with next(get_session()) as session:
+            run = claim_next_run(session, worker_id)
+            if run is None:
+                if max_runs is not None:
+                    break
+                time.sleep(idle_sleep)
+                continue
+            _finish(session, run)
+            processed += 1
+    return processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drain the ETL run queue.")
+    parser.add_argument("--worker-id", default=None)
+    parser.add_argument("--max-runs", type=int, default=None, help="Stop after this many runs (or when the queue is empty).")
+    args = parser.parse_args()
+    work(args.worker_id, args.max_runs)
@@ -0,0 +1,217 @@
+# backend/services/workflow_runner.py
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlmodel import Session
+
+from database import get_session
+from models.workflow import Workflow
+from models.log_model import WorkflowLog
+from models.sales_data_model import get_sales_data_model, ensure_sales_table
+from services.attachment_sources import get_attachment_source, GmailAttachmentSource, SOURCE_GMAIL
+from services.online_anomalies import link_anomaly_events
+from services.etl_pipeline import ingest_attachment, attachment_content_hash, find_processed_attachment, record_processed_attachment
+
+# Backlog mode catches up on every email since the last processed one (off = newest email only)
+BACKLOG_MODE_ENABLED = os.getenv("GMAIL_BACKLOG_MODE", "true").lower() == "true"
+
+
+class SourceFetchError(Exception):
+    """A message could not be fetched (network, quota, auth). The run is worth retrying."""
+
+
+class PartialIngestionError(Exception):
+    """An attachment stopped part-way. The email cursor stays put, so the run is retried (or dead-lettered)."""
+
+
+def build_search_query(workflow: Workflow) -> str:
+    """Gmail search query for a workflow's trigger points."""
+    search_query = f"subject:{workflow.trigger_subject}"
+    if workflow.trigger_sender:
+        search_query += f" from:{workflow.trigger_sender}"
+    return search_query
+
+
+def _ingest_workflow_file(session: Session, workflow: Workflow, raw_data: bytes, file_name: str,
+                          message_id: str) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Hash dedupe, parse/validate/load and WorkflowLog for one attachment. Does not commit the
+    workflow state. Returns (rows inserted, error): rows is 0 for a duplicate file and None if
+    nothing could be parsed; error is set if the file stopped part-way.
+    """
+    # --- CONTENT-HASH DEDUPE (same file re-sent in a new email) ---
+    content_hash = attachment_content_hash(raw_data)
+    if find_processed_attachment(session, workflow.id, content_hash):
+        session.add(WorkflowLog(
+            merchant_id=workflow.user_id,
+            status="INFO",
+            workflow_id=workflow.id,
+            source_filename=file_name,
+            message=f"Attachment '{file_name}' is identical to one already ingested. Skipping."
+        ))
+        print(f"SCHEDULER: Workflow {workflow.id} skipped '{file_name}'. Identical attachment already ingested.")
+        return 0, None
+
+    SalesDataModel = get_sales_data_model(workflow.id)
+    # CRITICAL: Ensure the table exists before use (Multitenancy safety)
+    ensure_sales_table(SalesDataModel, session.get_bind())
+
+    # --- ETL Logic (Same as manual trigger) ---
+    # Parse -> validate -> load; large attachments are streamed and committed chunk by chunk
+    summary = ingest_attachment(session, workflow.user_id, SalesDataModel, raw_data, file_name)
+    if summary is None or summary.rows_processed == 0:
+        print(f"SCHEDULER: ERROR - Data processing failed for workflow {workflow.id} ('{file_name}').")
+        session.add(WorkflowLog(
+            merchant_id=workflow.user_id,
+            status="ERROR",
+            workflow_id=workflow.id,
+            source_filename=file_name,
+            message=f"Attachment '{file_name}' could not be parsed or was empty."
+        ))
+        return None, None
+
+    rows_inserted = summary.rows_inserted
+
+    # --- Update Log ---
+    log = WorkflowLog(
+        merchant_id=workflow.user_id,
+        status="SUCCESS" if summary.error is None else "PARTIAL",
+        workflow_id=workflow.id,
+        source_filename=file_name,
+        rows_inserted=rows_inserted,
+        rows_rejected=summary.rows_rejected,
+        validation_report=summary.validation_report,
+        message=(f"Ingestion successful. Processed {summary.rows_processed} rows, rejected {summary.rows_rejected}."
+                 if summary.error is None else
+                 f"Ingestion stopped after {summary.chunks} chunk(s): {summary.error}")
+    )
+    session.add(log)
+    session.flush()
+    flagged = link_anomaly_events(session, workflow.id, log.id)
+    if flagged:
+        log.message += f" {flagged} KPI anomal{'y' if flagged == 1 else 'ies'} flagged."
+    if summary.error is None:
+        record_processed_attachment(session, workflow.id, content_hash, file_name, message_id, rows_inserted)
+    return rows_inserted, summary.error
+
+
+def ingest_workflow_message(session: Session, workflow: Workflow, message_id: str,
+                            attachments: List[Tuple[bytes, str]], success_status: str = "AUTO-SUCCESS") -> Optional[int]:
+    """
+    Shared tail of every automatic run: ingests all attachments of one email, in order, then
+    advances the workflow's email cursor. Returns rows inserted, or None if skipped/failed.
+    Raises PartialIngestionError (cursor not advanced) if an attachment stopped part-way.
+    """
+    # --- IDEMPOTENCY CHECK ---
+    if workflow.last_processed_email_id == message_id:
+        print(f"SCHEDULER: Workflow {workflow.id} skipped. Email already processed.")
+        return None
+
+    outcomes = [_ingest_workflow_file(session, workflow, raw_data, file_name, message_id)
+                for raw_data, file_name in attachments]
+    results = [rows for rows, _ in outcomes]
+    rows_inserted = sum(rows for rows in results if rows is not None)
+
+    errors = [error for _, error in outcomes if error]
+    if errors:
+        # Keep the cursor on this email: the run is retried, and re-loading chunks that made it
+        # is harmless (rows are upserted on their order-line key)
+        session.commit() # the PARTIAL log(s)
+        raise PartialIngestionError(f"Workflow {workflow.id}, message {message_id}: {errors[0]}")
+
+    # UPDATE WORKFLOW STATE
+    # An unparseable file will not parse on retry either, so the cursor moves past it (the ERROR log stays)
+    workflow.last_processed_email_id = message_id # <<< CRUCIAL IDEMPOTENCY UPDATE
+    if any(rows for rows in results):
+        workflow.last_run_status = success_status
+        workflow.last_run_timestamp = datetime.utcnow()
+    session.add(workflow)
+    session.commit()
+
+    if all(rows is None for rows in results):
+        return None
+    print(f"SCHEDULER: Workflow {workflow.id} SUCCESS: {rows_inserted} rows inserted from message {message_id}.")
+    return rows_inserted
+
+
+def ingest_workflow_attachment(session: Session, workflow: Workflow, raw_data: bytes, file_name: str,
+                               message_id: str, success_status: str = "AUTO-SUCCESS") -> Optional[int]:
+    """Single-attachment form of ingest_workflow_message."""
+    return ingest_workflow_message(session, workflow, message_id, [(raw_data, file_name)], success_status)
+
+
+def run_workflow_source(session: Session, workflow: Workflow, backlog: bool = BACKLOG_MODE_ENABLED) -> int:
+    """
+    Fetch -> parse -> ingest for one workflow from its configured attachment source.
+    Backlog mode catches up on everything newer than the workflow's cursor, oldest first;
+    otherwise only the newest message is considered. Returns the number of messages seen.
+    """
+    try:
+        source = get_attachment_source(workflow)
+    except ValueError as error:
+        print(f"SCHEDULER: ERROR - {error}")
+        session.add(WorkflowLog(merchant_id=workflow.user_id, status="ERROR", workflow_id=workflow.id, message=str(error)))
+        session.commit()
+        return 0
+
+    messages_seen = 0
+    since_message_id = workflow.last_processed_email_id if backlog else None
+    for fetched in source.fetch_new(workflow, since_message_id):
+        messages_seen += 1
+        if fetched.error:
+            # Transient (network/quota): stop here so newer mail is not ingested ahead of it; the run queue retries
+            print(f"SCHEDULER: Workflow {workflow.id} backlog stopped at message {fetched.message_id}: {fetched.error}")
+            raise SourceFetchError(f"Workflow {workflow.id}: {fetched.error}")
+        if not fetched.attachments:
+            print(f"SCHEDULER: Message {fetched.message_id} for workflow {workflow.id} has no attachment.")
+            workflow.last_processed_email_id = fetched.message_id
+            session.add(workflow)
+            session.commit()
+            continue
+        ingest_workflow_message(session, workflow, fetched.message_id, fetched.attachments)
+
+    if messages_seen == 0:
+        # Log INFO if no new email found
+        session.add(WorkflowLog(
+            merchant_id=workflow.user_id,
+            status="INFO",
+            workflow_id=workflow.id,
+            message=f"No new {workflow.source_type or SOURCE_GMAIL} message for '{build_search_query(workflow)}'. Skipping."
+        ))
+        session.commit()
+    return messages_seen
+
+
+def run_workflow_check(workflow_id: int) -> int:
+    """
+    Checks one workflow's attachment source for new message(s) and triggers ETL for each.
+    Returns the number of messages seen; raises SourceFetchError on a retryable fetch failure.
+    """
+    with next(get_session()) as session:
+        # 1. Fetch workflow
+        workflow = session.get(Workflow, workflow_id)
+        if not workflow or not workflow.is_active:
+            print(f"SCHEDULER: Job failed. Workflow ID {workflow_id} not found or inactive.")
+            return 0
+
+        print(f"SCHEDULER: Checking workflow ID {workflow_id}: {workflow.name}")
+        return run_workflow_source(session, workflow)
+
+
+def run_workflow_for_message(workflow_id: int, message_id: str) -> int:
+    """ETL for a specific Gmail message that mailbox sync already matched to this workflow."""
+    with next(get_session()) as session:
+        workflow = session.get(Workflow, workflow_id)
+        if not workflow or not workflow.is_active:
+            print(f"SCHEDULER: Job failed. Workflow ID {workflow_id} not found or inactive.")
+            return 0
+
+        fetched = GmailAttachmentSource().fetch_message(message_id)
+        if fetched.error:
+            raise SourceFetchError(f"Workflow {workflow_id}, message {message_id}: {fetched.error}")
+        if not fetched.attachments:
+            print(f"SCHEDULER: Message {message_id} for workflow {workflow_id} has no usable attachment.")
+            return 1
+
+        ingest_workflow_message(session, workflow, message_id, fetched.attachments, success_status="SYNC-SUCCESS")
+        return 1